@@ -0,0 +1,50 @@
+#!/bin/bash
+# Copyright 2018-2021 Khulnasoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Usage: build-cache.sh <cache dir> <build URL>...
+# Fetches every build once, keyed by its sha512: the content goes to <cache dir>/blobs/<sha512> and the published
+# checksum file to <cache dir>/<file name>.sha512. The package stages of the Dockerfiles read the build from there
+# instead of downloading it again, and still validate its checksum.
+
+set -e
+
+CACHE_DIR=$1
+shift
+mkdir -p ${CACHE_DIR}/blobs
+
+for URL in "$@"; do
+	NAME=`basename ${URL}`
+	if [[ -f ${CACHE_DIR}/${NAME}.sha512 ]]; then
+		DIGEST=`grep -oE '[0-9a-f]{128}' ${CACHE_DIR}/${NAME}.sha512 || true`
+		if [[ -n "${DIGEST}" && -f ${CACHE_DIR}/blobs/${DIGEST} ]]; then
+			echo "Using the cached ${NAME}"
+			continue
+		fi
+	fi
+	wget -qO ${CACHE_DIR}/${NAME}.sha512.tmp ${URL}.sha512
+	DIGEST=`grep -oE '[0-9a-f]{128}' ${CACHE_DIR}/${NAME}.sha512.tmp`
+	# Another URL may already have brought the same content
+	if [[ ! -f ${CACHE_DIR}/blobs/${DIGEST} ]]; then
+		echo "Downloading ${URL} into ${CACHE_DIR}"
+		wget -qO ${CACHE_DIR}/blobs/${DIGEST}.tmp ${URL}
+		if ! echo "${DIGEST}  ${CACHE_DIR}/blobs/${DIGEST}.tmp" | sha512sum --check --status; then
+			echo "Checksum validation failed for ${URL}"
+			rm -f ${CACHE_DIR}/blobs/${DIGEST}.tmp ${CACHE_DIR}/${NAME}.sha512.tmp
+			exit 1
+		fi
+		mv ${CACHE_DIR}/blobs/${DIGEST}.tmp ${CACHE_DIR}/blobs/${DIGEST}
+	fi
+	mv ${CACHE_DIR}/${NAME}.sha512.tmp ${CACHE_DIR}/${NAME}.sha512
+done
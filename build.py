@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Builds Makefile targets along with everything they depend on, running independent targets concurrently within the
+host's CPU and memory budget:
+
+    build.py [options] [target ...] [NAME=value ...]
+
+Each target runs its own Makefile recipe once its prerequisites are done, so the Makefile stays the only definition of
+how images get built. Image builds of several platforms sharing a Dockerfile and a build URL reuse a single package
+stage. A per-target timing report is written once the build is over.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import multiprocessing
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MAKEFILE = os.path.join(REPO_DIR, "Makefile")
+LOGS_DIR = os.path.join(REPO_DIR, "test-results", "build-logs")
+REPORT_FILE = os.path.join(REPO_DIR, "test-results", "build-report.json")
+# Host resources reserved for an image build while it runs - the Khulnasoft images extract and copy a whole tarball
+BUILD_CPUS = 2
+BUILD_MEMORY_MB = 2048
+# Other recipes (git clone, downloads) mostly wait on the network
+OTHER_CPUS = 1
+OTHER_MEMORY_MB = 256
+# Expected durations of targets the previous report does not have, used to start the longest chains first
+DEFAULT_BUILD_DURATION = 300 # in seconds
+DEFAULT_OTHER_DURATION = 30 # in seconds
+LOG_TAIL = 20 # lines of the log of a failed target to print
+
+DOCKERFILE_PATTERN = re.compile(r"-f\s+(\S*Dockerfile)")
+BUILD_URL_PATTERN = re.compile(r"--build-arg\s+KHULNASOFT_BUILD_URL=(\S+)")
+BASE_IMAGE_PATTERN = re.compile(r"--build-arg\s+KHULNASOFT_BASE_IMAGE=(\S+)")
+STAGE_PATTERN = re.compile(r"--target\s+(\S+)")
+# The stage images of different platforms can share, see the Dockerfiles
+SHARED_STAGE = "package"
+
+
+class Target(object):
+    '''
+    A rule of the Makefile, with its recipe as printed by `make -p` (variables not expanded)
+    '''
+
+    def __init__(self, name, deps, recipe):
+        self.name = name
+        self.deps = deps
+        self.recipe = recipe
+
+    @property
+    def builds_image(self):
+        return bool(re.search(r"\bdocker (buildx )?build\b", self.recipe))
+
+    @property
+    def stage(self):
+        match = STAGE_PATTERN.search(self.recipe)
+        return match.group(1) if match else None
+
+    def stage_key(self):
+        '''
+        Return (Dockerfile, build URL) if the package stage of this build could come from another platform's build -
+        buildx builds target other architectures, so they never share it
+        '''
+        if not re.search(r"\bdocker build\b", self.recipe):
+            return None
+        dockerfile, build_url = DOCKERFILE_PATTERN.search(self.recipe), BUILD_URL_PATTERN.search(self.recipe)
+        if not dockerfile or not build_url:
+            return None
+        return dockerfile.group(1), build_url.group(1)
+
+
+def make_command(makefile, variables):
+    return ["make", "--no-print-directory", "-f", makefile] + variables
+
+
+def read_makefile(makefile, variables):
+    '''
+    Return {name: Target} of every rule in the make database of `makefile`
+    '''
+    with open(os.devnull, "w") as devnull:
+        # -q never runs a recipe, and -p prints the database whatever the outcome
+        proc = subprocess.Popen(make_command(makefile, variables) + ["-pRrq"], stdout=subprocess.PIPE, stderr=devnull,
+                                cwd=os.path.dirname(os.path.abspath(makefile)))
+        output = proc.communicate()[0].decode("utf-8", "replace")
+    if "\n# Files\n" not in output:
+        raise RuntimeError("Unable to read the make database of {}".format(makefile))
+    targets = {}
+    section = output.split("\n# Files\n", 1)[1].split("\n# files hash-table stats", 1)[0]
+    for block in section.split("\n\n"):
+        lines = block.splitlines()
+        if "# Not a target:" in lines:
+            continue
+        rules = [x for x in lines if x and not x.startswith(("#", "\t"))]
+        if not rules or ":" not in rules[0]:
+            continue
+        name, _, deps = rules[0].partition(":")
+        if name.startswith(".") or "=" in name:
+            continue
+        deps = deps.lstrip(":").split("|")[0].split()
+        recipe = "\n".join(x[1:] for x in lines if x.startswith("\t"))
+        targets[name] = Target(name, deps, recipe)
+    return targets
+
+
+def plan(targets, goals):
+    '''
+    Return {name: Target} of the goals and everything they depend on - prerequisites that are existing files rather
+    than targets are left out
+    '''
+    planned = {}
+
+    def visit(name, chain):
+        if name in chain:
+            raise ValueError("Circular dependency: {}".format(" -> ".join(chain + [name])))
+        if name in planned:
+            return
+        if name not in targets:
+            if os.path.exists(name):
+                return
+            raise ValueError("No rule to make target '{}'{}".format(name, ", needed by '{}'".format(chain[-1]) if chain else ""))
+        for dep in targets[name].deps:
+            visit(dep, chain + [name])
+        planned[name] = targets[name]
+
+    for goal in goals:
+        visit(goal, [])
+    return planned
+
+
+def dry_run(makefile, variables, target):
+    '''
+    Return the expanded recipe of `target` alone
+    '''
+    command = make_command(makefile, variables) + ["-n"]
+    for dep in target.deps:
+        command += ["-o", dep]
+    return subprocess.check_output(command + [target.name], cwd=os.path.dirname(os.path.abspath(makefile))).decode("utf-8", "replace")
+
+
+def share_stages(planned, targets, makefile, variables):
+    '''
+    Make the planned image builds that can reuse the package stage of a `--target package` rule depend on that rule,
+    which is only worth it for two builds or more - returns {name: docker build flags} of the builds that share one
+    '''
+    stages = dict((x.stage_key(), x) for x in targets.values() if x.stage == SHARED_STAGE and x.stage_key())
+    groups = {}
+    for target in planned.values():
+        key = target.stage_key()
+        if key in stages and target.stage != SHARED_STAGE:
+            groups.setdefault(key, []).append(target)
+    flags = {}
+    for key, members in groups.items():
+        if len(members) < 2:
+            continue
+        stage = stages[key]
+        base_image = BASE_IMAGE_PATTERN.search(dry_run(makefile, variables, stage))
+        if not base_image:
+            continue
+        for dep in plan(targets, [stage.name]).values():
+            planned.setdefault(dep.name, dep)
+        for target in members:
+            target.deps = target.deps + [stage.name]
+            flags[target.name] = "--build-arg KHULNASOFT_PACKAGE_IMAGE={}".format(base_image.group(1))
+    return flags
+
+
+def host_budget():
+    '''
+    Return the (CPUs, memory in MB) of this host
+    '''
+    memory_mb = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    memory_mb = int(line.split()[1]) // 1024
+    except IOError:
+        pass
+    return multiprocessing.cpu_count(), memory_mb or BUILD_MEMORY_MB
+
+
+def load_durations(filename=REPORT_FILE):
+    '''
+    Durations (in seconds) of the targets that completed in the previous build
+    '''
+    try:
+        with open(filename) as f:
+            report = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    return dict((name, x["duration"]) for name, x in report.get("targets", {}).items() if x.get("status") == "ok")
+
+
+class Builder(object):
+    '''
+    Runs the recipes of the planned targets - a target starts once its prerequisites are done and its resources fit
+    in the budget, longest remaining chain first (a target larger than the whole budget runs alone)
+    '''
+
+    def __init__(self, planned, makefile, variables, flags, cpus, memory_mb, keep_going=False, logs_dir=LOGS_DIR, durations=None):
+        self.planned = planned
+        self.makefile = makefile
+        self.variables = variables
+        self.flags = flags
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.keep_going = keep_going
+        self.logs_dir = logs_dir
+        self.durations = durations or {}
+        self.results = {}
+        self.cond = threading.Condition()
+
+    def resources(self, target):
+        if not target.recipe:
+            return 0, 0
+        if target.builds_image:
+            return BUILD_CPUS, BUILD_MEMORY_MB
+        return OTHER_CPUS, OTHER_MEMORY_MB
+
+    def expected_duration(self, target):
+        if target.name in self.durations:
+            return self.durations[target.name]
+        if not target.recipe:
+            return 0
+        return DEFAULT_BUILD_DURATION if target.builds_image else DEFAULT_OTHER_DURATION
+
+    def critical_paths(self):
+        '''
+        Return {name: expected seconds from the start of the target to the end of its longest chain of dependents}
+        '''
+        dependents = {}
+        for target in self.planned.values():
+            for dep in target.deps:
+                dependents.setdefault(dep, []).append(target.name)
+        paths = {}
+
+        def path(name):
+            if name not in paths:
+                paths[name] = self.expected_duration(self.planned[name]) + max([path(x) for x in dependents.get(name, [])] or [0])
+            return paths[name]
+
+        for name in self.planned:
+            path(name)
+        return paths
+
+    def command(self, target):
+        variables = list(self.variables)
+        if target.name in self.flags:
+            # Appended to the flags given on the command line or in the environment, which it must not replace
+            given = [x.split("=", 1)[1] for x in variables if x.startswith("DOCKER_BUILD_FLAGS=")]
+            base = given[-1] if given else os.environ.get("DOCKER_BUILD_FLAGS", "")
+            variables = [x for x in variables if not x.startswith("DOCKER_BUILD_FLAGS=")]
+            variables.append("DOCKER_BUILD_FLAGS={} {}".format(base, self.flags[target.name]).strip())
+        command = make_command(self.makefile, variables)
+        # Prerequisites were built by this script already, make must only run the recipe of the target itself
+        for dep in target.deps:
+            command += ["-o", dep]
+        return command + [target.name]
+
+    def _run(self, target, start):
+        log_file = os.path.join(self.logs_dir, "{}.log".format(target.name))
+        with open(log_file, "wb") as log:
+            rc = subprocess.call(self.command(target), stdout=log, stderr=subprocess.STDOUT,
+                                 cwd=os.path.dirname(os.path.abspath(self.makefile)))
+        tail = []
+        if rc != 0:
+            with open(log_file, "rb") as f:
+                tail = f.read().decode("utf-8", "replace").splitlines()[-LOG_TAIL:]
+        self._finish(target, "ok" if rc == 0 else "failed", start, tail)
+
+    def _finish(self, target, status, start, tail):
+        with self.cond:
+            end = time.time()
+            self.results[target.name].update({"status": status, "start": start - self.t0, "end": end - self.t0, "duration": end - start})
+            print("{:>7.0f}s {} {} in {:.0f}s".format(end - self.t0, "finished" if status == "ok" else "FAILED", target.name, end - start))
+            for line in tail:
+                print("    {}".format(line))
+            sys.stdout.flush()
+            self.cond.notify_all()
+
+    def run(self):
+        '''
+        Build every planned target - returns the number of targets that failed or were skipped because of a failure
+        '''
+        if not os.path.isdir(self.logs_dir):
+            os.makedirs(self.logs_dir)
+        paths = self.critical_paths()
+        self.t0 = time.time()
+        waiting = set(self.planned)
+        used_cpus = used_memory = 0
+        running = {}
+        with self.cond:
+            while True:
+                done = set(name for name, x in self.results.items() if x.get("status") == "ok")
+                failed = set(name for name, x in self.results.items() if x.get("status") in ("failed", "skipped"))
+                for name in list(running):
+                    if name in done or name in failed:
+                        cpus, memory_mb = running.pop(name)
+                        used_cpus -= cpus
+                        used_memory -= memory_mb
+                # Targets that depend on a failure will never run
+                for name in sorted(waiting):
+                    if any(x in failed for x in self.planned[name].deps):
+                        waiting.discard(name)
+                        self.results[name] = {"status": "skipped"}
+                        failed.add(name)
+                if failed and not self.keep_going:
+                    for name in waiting:
+                        self.results[name] = {"status": "cancelled"}
+                    waiting.clear()
+                ready = [x for x in waiting if all(dep in done or dep not in self.planned for dep in self.planned[x].deps)]
+                # Targets without a recipe (ex. all) are done as soon as they are ready, which may make others ready
+                instant = False
+                for name in sorted(ready, key=lambda x: (-paths[x], x)):
+                    target = self.planned[name]
+                    cpus, memory_mb = self.resources(target)
+                    if running and (used_cpus + cpus > self.cpus or used_memory + memory_mb > self.memory_mb):
+                        continue
+                    waiting.discard(name)
+                    now = time.time()
+                    ends = [self.results[x]["end"] for x in target.deps if x in self.results]
+                    self.results[name] = {"status": "running", "queued": now - self.t0 - max(ends or [0])}
+                    if not target.recipe:
+                        self.results[name].update({"status": "ok", "start": now - self.t0, "end": now - self.t0, "duration": 0})
+                        instant = True
+                        continue
+                    running[name] = (cpus, memory_mb)
+                    used_cpus += cpus
+                    used_memory += memory_mb
+                    print("{:>7.0f}s started {} ({} CPUs, {} MB)".format(now - self.t0, name, cpus, memory_mb))
+                    sys.stdout.flush()
+                    thread = threading.Thread(target=self._run, args=(target, now))
+                    thread.daemon = True
+                    thread.start()
+                if instant:
+                    continue
+                if not running:
+                    break
+                self.cond.wait()
+        self.wall_time = time.time() - self.t0
+        return len([x for x in self.results.values() if x["status"] != "ok"])
+
+    def report(self, goals, filename=REPORT_FILE):
+        '''
+        Write the timings of this build to `filename` and print them, in start order
+        '''
+        report = {
+            "goals": goals,
+            "cpus": self.cpus,
+            "memory_mb": self.memory_mb,
+            "wall_time": round(self.wall_time, 2),
+            "targets": dict((name, dict((k, round(v, 2) if isinstance(v, float) else v) for k, v in x.items()))
+                            for name, x in self.results.items())
+        }
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print("{:<32} {:>8} {:>9} {:>9} {:>9}".format("target", "status", "start", "duration", "queued"))
+        for name, x in sorted(self.results.items(), key=lambda x: (x[1].get("start", float("inf")), x[0])):
+            if "start" in x:
+                print("{:<32} {:>8} {:>8.0f}s {:>8.0f}s {:>8.0f}s".format(name, x["status"], x["start"], x["duration"], x["queued"]))
+            else:
+                print("{:<32} {:>8}".format(name, x["status"]))
+        busy = sum(x.get("duration", 0) for x in self.results.values())
+        print("Built {} target(s) in {:.0f}s, {:.0f}s of recipes ({:.1f}x parallelism), report in {}".format(
+            len([x for x in self.results.values() if x["status"] == "ok"]), self.wall_time, busy,
+            busy / self.wall_time if self.wall_time else 0, os.path.relpath(filename)))
+
+
+def main():
+    cpus, memory_mb = host_budget()
+    parser = argparse.ArgumentParser(description=__doc__.strip(), formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("args", nargs="*", metavar="target|NAME=value", help="Targets to build (default: all), and make variables")
+    parser.add_argument("-f", "--makefile", default=MAKEFILE, help="Makefile to read the targets from (default: the one of this repository)")
+    parser.add_argument("--cpus", type=int, default=cpus, help="CPUs the running targets may reserve (default: {})".format(cpus))
+    parser.add_argument("--memory", type=int, default=memory_mb, help="Memory in MB the running targets may reserve (default: {})".format(memory_mb))
+    parser.add_argument("-k", "--keep-going", action="store_true", help="Keep building the targets that do not depend on a failed one")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="Print the targets to build, their prerequisites and shared stages, and exit")
+    parser.add_argument("--report", default=REPORT_FILE, help="Timing report, also used to start the longest chains first (default: test-results/build-report.json)")
+    args = parser.parse_args()
+    variables = [x for x in args.args if "=" in x]
+    goals = [x for x in args.args if "=" not in x] or ["all"]
+    try:
+        targets = read_makefile(args.makefile, variables)
+        planned = plan(targets, goals)
+        flags = share_stages(planned, targets, args.makefile, variables)
+    except (ValueError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(e)
+        return 2
+    builder = Builder(planned, args.makefile, variables, flags, args.cpus, args.memory, args.keep_going,
+                      durations=load_durations(args.report))
+    if args.dry_run:
+        paths = builder.critical_paths()
+        for name in sorted(planned, key=lambda x: (-paths[x], x)):
+            print("{:<32} {:>6.0f}s  {}{}".format(name, paths[name], " ".join(planned[name].deps), "  [{}]".format(flags[name]) if name in flags else ""))
+        return 0
+    failures = builder.run()
+    builder.report(goals, args.report)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
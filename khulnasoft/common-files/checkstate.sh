@@ -23,18 +23,33 @@
 # health results
 
 if [[ "" == "$NO_HEALTHCHECK" ]]; then
-    if [[ "false" == "$KHULNASOFTD_SSL_ENABLE" || "false" == "$(/opt/khulnasoft/bin/khulnasoft btool server list | grep enableKhulnasoftdSSL | cut -d\  -f 3)" ]]; then
-      SCHEME="http"
-	else
-      SCHEME="https"
-    fi
 	#If NO_HEALTHCHECK is NOT defined, then we want the healthcheck
 	state="$(< $CONTAINER_ARTIFACT_DIR/khulnasoft-container.state)"
 
 	case "$state" in
 	running|started)
-	    curl --max-time 30 --fail --insecure $SCHEME://localhost:8089/
-	    exit $?
+	    #Answer from the status cached by healthresponder.py (KHULNASOFT_HEALTH_RESPONDER=true) while it is fresh
+	    if read -r checked rc latency 2>/dev/null < $CONTAINER_ARTIFACT_DIR/khulnasoftd.health; then
+	        printf -v now '%(%s)T' -1
+	        if (( now - checked <= ${KHULNASOFT_HEALTH_MAX_AGE:-60} )); then
+	            exit $rc
+	        fi
+	    fi
+	    #The scheme is resolved once by the entrypoint after provisioning, btool is only a fallback
+	    read -r SCHEME 2>/dev/null < $CONTAINER_ARTIFACT_DIR/khulnasoftd.scheme
+	    if [[ -z "$SCHEME" ]]; then
+	        if [[ "false" == "$KHULNASOFTD_SSL_ENABLE" || "false" == "$(/opt/khulnasoft/bin/khulnasoft btool server list | grep enableKhulnasoftdSSL | cut -d\  -f 3)" ]]; then
+	          SCHEME="http"
+	        else
+	          SCHEME="https"
+	        fi
+	    fi
+	    OUTPUT="$(curl --max-time 30 --fail --insecure --write-out '\n%{time_total}' $SCHEME://localhost:8089/)"
+	    rc=$?
+	    printf '%s' "${OUTPUT%$'\n'*}"
+	    #The outcome and latency of the probe are exposed by metricsexporter.py
+	    printf '%(%s)T %s %s\n' -1 $rc "${OUTPUT##*$'\n'}" 2>/dev/null > $CONTAINER_ARTIFACT_DIR/khulnasoftd.healthcheck
+	    exit $rc
 	;;
 	*)
 	    exit 1
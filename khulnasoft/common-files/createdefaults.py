@@ -60,7 +60,7 @@ elif khulnasoft_shc_pass4SymmKey:
     os.environ["KHULNASOFT_SHC_PASS4SYMMKEY"] = os.environ["KHULNASOFT_SHC_SECRET"] = khulnasoft_shc_secret
 else:
     os.environ["KHULNASOFT_SHC_PASS4SYMMKEY"] = os.environ["KHULNASOFT_SHC_SECRET"] = random_generator()
-sys.argv.append("--write-to-stdout")
-import environ
-environ.main()
+# Served from the inventory cache when the same environment and default.yml were already rendered in this container
+import environ_cache
+environ_cache.main(["--write-to-stdout"])
 
@@ -37,12 +37,18 @@ trap teardown SIGINT SIGTERM
 
 prep_ansible() {
 	cd ${KHULNASOFT_ANSIBLE_HOME}
+	# The inventory is computed once per start, then shared by the warm restart check and Ansible
+	rm -rf ${CONTAINER_ARTIFACT_DIR}/inventory_cache ${CONTAINER_ARTIFACT_DIR}/khulnasoftd.scheme ${CONTAINER_ARTIFACT_DIR}/khulnasoftd.health ${CONTAINER_ARTIFACT_DIR}/khulnasoftd.healthcheck
+	# Per-task timings are recorded by the provision_profile callback plugin
+	if [[ "$KHULNASOFT_ANSIBLE_PROFILE" == "true" ]]; then
+		export KHULNASOFT_ANSIBLE_PROFILE_FILE=${CONTAINER_ARTIFACT_DIR}/ansible_profile.json
+	fi
 	if [ `whoami` == "${KHULNASOFT_USER}" ]; then
 		sed -i -e "s,^become\\s*=.*,become = false," ansible.cfg
 	fi
 	if [[ "$DEBUG" == "true" ]]; then
 		ansible-playbook --version
-		python inventory/environ.py --write-to-file
+		python inventory/environ_cache.py --write-to-file
 		cat /opt/container_artifact/ansible_inventory.json 2>/dev/null
 		cat /opt/ansible/inventory/messages.txt 2>/dev/null || true
 		echo
@@ -59,6 +65,16 @@ watch_for_failure(){
 	if [ `whoami` != "${KHULNASOFT_USER}" ]; then
 		RUN_AS_KHULNASOFT="sudo -u ${KHULNASOFT_USER}"
 	fi
+	# Resolved once here instead of running btool on every healthcheck
+	if [[ "false" == "$KHULNASOFTD_SSL_ENABLE" || "false" == "$(${RUN_AS_KHULNASOFT} ${KHULNASOFT_HOME}/bin/khulnasoft btool server list | grep enableKhulnasoftdSSL | cut -d\  -f 3)" ]]; then
+		echo http > ${CONTAINER_ARTIFACT_DIR}/khulnasoftd.scheme
+	else
+		echo https > ${CONTAINER_ARTIFACT_DIR}/khulnasoftd.scheme
+	fi
+	if [[ "$KHULNASOFT_HEALTH_RESPONDER" == "true" ]] && ! kill -0 `cat ${CONTAINER_ARTIFACT_DIR}/healthresponder.pid 2>/dev/null` 2>/dev/null; then
+		healthresponder.py &
+		echo $! > ${CONTAINER_ARTIFACT_DIR}/healthresponder.pid
+	fi
 	# Any crashes/errors while Khulnasoft is running should get logged to khulnasoftd_stderr.log and sent to the container's stdout
 	if [ -z "$KHULNASOFT_TAIL_FILE" ]; then
 		echo Ansible playbook complete, will begin streaming khulnasoftd_stderr.log
@@ -73,6 +89,64 @@ watch_for_failure(){
 	wait
 }
 
+provision_fingerprint() {
+	# Everything provisioning depends on: the effective inventory, the Khulnasoft build and playbooks of the image, and the mounted defaults
+	# The inventory holds the secrets in clear, so it is hashed straight from the inventory cache and never written out
+	local INVENTORY
+	INVENTORY=`python inventory/environ_cache.py --list 2>/dev/null` || return 1
+	(echo "${INVENTORY}"; cat ${KHULNASOFT_HOME}-etc/khulnasoft.version ${KHULNASOFT_ANSIBLE_HOME}/version.txt /tmp/defaults/default.yml 2>/dev/null) | sha512sum | cut -d' ' -f1
+}
+
+save_fingerprint() {
+	if [[ "$KHULNASOFT_WARM_RESTART" == "true" ]]; then
+		provision_fingerprint > ${CONTAINER_ARTIFACT_DIR}/provision.fingerprint || rm -f ${CONTAINER_ARTIFACT_DIR}/provision.fingerprint
+	fi
+	return 0
+}
+
+warm_start() {
+	# Only taken when nothing changed since the last successful provisioning of this container
+	if [[ "$KHULNASOFT_WARM_RESTART" != "true" || ! -s ${CONTAINER_ARTIFACT_DIR}/provision.fingerprint ]]; then
+		return 1
+	fi
+	FINGERPRINT=`provision_fingerprint` || return 1
+	if [[ "${FINGERPRINT}" != "`cat ${CONTAINER_ARTIFACT_DIR}/provision.fingerprint`" ]]; then
+		echo "Configuration changed since the last provisioning, running Ansible"
+		rm -f ${CONTAINER_ARTIFACT_DIR}/provision.fingerprint
+		return 1
+	fi
+	echo "Configuration unchanged since the last provisioning, starting Khulnasoft without running Ansible"
+	if [ `whoami` != "${KHULNASOFT_USER}" ]; then
+		RUN_AS_KHULNASOFT="sudo -u ${KHULNASOFT_USER}"
+	fi
+	${RUN_AS_KHULNASOFT} ${KHULNASOFT_HOME}/bin/khulnasoft start ${KHULNASOFT_START_ARGS} --answer-yes --no-prompt
+}
+
+count_restart() {
+	# The state file survives a `docker restart`, so finding it means this container already ran
+	if [[ -f ${CONTAINER_ARTIFACT_DIR}/khulnasoft-container.state ]]; then
+		RESTARTS=`cat ${CONTAINER_ARTIFACT_DIR}/restart.count 2>/dev/null || echo 0`
+		echo $((RESTARTS + 1)) > ${CONTAINER_ARTIFACT_DIR}/restart.count
+	fi
+}
+
+start_provisioning() {
+	PROVISION_START=`date +%s`
+	echo ${PROVISION_START} > ${CONTAINER_ARTIFACT_DIR}/provision.timing
+}
+
+finish_provisioning() {
+	# Records how provisioning completed: "ansible", or "warm" when the playbook was skipped
+	echo "${PROVISION_START} `date +%s` $1" > ${CONTAINER_ARTIFACT_DIR}/provision.timing
+}
+
+start_metrics_exporter() {
+	if [[ "$KHULNASOFT_METRICS_EXPORTER" == "true" ]] && ! kill -0 `cat ${CONTAINER_ARTIFACT_DIR}/metricsexporter.pid 2>/dev/null` 2>/dev/null; then
+		metricsexporter.py &
+		echo $! > ${CONTAINER_ARTIFACT_DIR}/metricsexporter.pid
+	fi
+}
+
 create_defaults() {
 	createdefaults.py
 }
@@ -82,10 +156,19 @@ start_and_exit() {
 	then
 		echo "WARNING: No password ENV var.  Stack may fail to provision if khulnasoft.password is not set in ENV or a default.yml"
 	fi
+	count_restart
 	sh -c "echo 'starting' > ${CONTAINER_ARTIFACT_DIR}/khulnasoft-container.state"
 	setup
+	start_metrics_exporter
+	start_provisioning
 	prep_ansible
-	ansible-playbook $ANSIBLE_EXTRA_FLAGS -i inventory/environ.py -l localhost site.yml
+	if warm_start; then
+		finish_provisioning warm
+		return
+	fi
+	ansible-playbook $ANSIBLE_EXTRA_FLAGS -i inventory/environ_cache.py -l localhost site.yml
+	finish_provisioning ansible
+	save_fingerprint
 }
 
 start() {
@@ -101,14 +184,23 @@ secure_start() {
 
 configure_multisite() {
 	prep_ansible
-	ansible-playbook $ANSIBLE_EXTRA_FLAGS -i inventory/environ.py -l localhost multisite.yml
+	ansible-playbook $ANSIBLE_EXTRA_FLAGS -i inventory/environ_cache.py -l localhost multisite.yml
 }
 
 restart(){
+	count_restart
 	sh -c "echo 'restarting' > ${CONTAINER_ARTIFACT_DIR}/khulnasoft-container.state"
+	start_metrics_exporter
+	start_provisioning
 	prep_ansible
 	${KHULNASOFT_HOME}/bin/khulnasoft stop 2>/dev/null || true
-	ansible-playbook -i inventory/environ.py -l localhost start.yml
+	if warm_start; then
+		finish_provisioning warm
+	else
+		ansible-playbook -i inventory/environ_cache.py -l localhost start.yml
+		finish_provisioning ansible
+		save_fingerprint
+	fi
 	watch_for_failure
 }
 
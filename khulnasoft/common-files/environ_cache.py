@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Copyright 2018-2021 Khulnasoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Caching front-end to the environ.py dynamic inventory - the output of environ.py is stored in the container artifact
+directory, keyed by a hash of everything it depends on, so the warm restart fingerprint and the inventory runs of Ansible
+share one run per start. create-defaults sets secrets of its own, so it always gets an entry of its own.
+"""
+import os
+import sys
+import json
+import socket
+import hashlib
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+INVENTORY_DIR = os.path.dirname(os.path.abspath(__file__))
+CONTAINER_ARTIFACT_DIR = os.environ.get("CONTAINER_ARTIFACT_DIR", "/opt/container_artifact")
+CACHE_DIR = os.path.join(CONTAINER_ARTIFACT_DIR, "inventory_cache")
+DEFAULTS_FILE = "/tmp/defaults/default.yml"
+# environ.py builds the inventory from these variables only - the rest of the environment differs between the entrypoint
+# and the inventory runs of Ansible, and must not split the cache
+INVENTORY_ENV_PREFIXES = ("KHULNASOFT_", "JAVA_")
+INVENTORY_ENV = ("DEBUG",)
+
+
+def to_bytes(value):
+    return value if isinstance(value, bytes) else value.encode("utf-8", "replace")
+
+
+def cache_key(args):
+    key = hashlib.sha256()
+    key.update(to_bytes(repr(args)))
+    key.update(to_bytes(socket.gethostname()))
+    for name in sorted(os.environ):
+        if name.startswith(INVENTORY_ENV_PREFIXES) or name in INVENTORY_ENV:
+            key.update(to_bytes(name) + b"=" + to_bytes(os.environ[name]) + b"\0")
+    # A new khulnasoft-ansible release or a different default.yml must never be served from the cache
+    for filename in [DEFAULTS_FILE] + sorted(os.path.join(INVENTORY_DIR, x) for x in os.listdir(INVENTORY_DIR) if x.endswith(".py")):
+        try:
+            with open(filename, "rb") as f:
+                key.update(f.read())
+        except (IOError, OSError):
+            pass
+    return key.hexdigest()
+
+
+def generate(args):
+    """
+    Run environ.py in-process with the given arguments and return what it printed
+    """
+    sys.path.insert(0, INVENTORY_DIR)
+    import environ
+    argv, stdout = sys.argv, sys.stdout
+    sys.argv = [os.path.join(INVENTORY_DIR, "environ.py")] + args
+    sys.stdout = StringIO()
+    try:
+        environ.main()
+    except SystemExit:
+        pass
+    finally:
+        output = sys.stdout.getvalue()
+        sys.argv, sys.stdout = argv, stdout
+    return output
+
+
+def cached(args):
+    """
+    Return the output of environ.py for `args`, generating it only if the inputs changed since it was cached
+    """
+    filename = os.path.join(CACHE_DIR, cache_key(args))
+    try:
+        with open(filename) as f:
+            return f.read()
+    except (IOError, OSError):
+        pass
+    output = generate(args)
+    if not output:
+        return output
+    # The cache is only an optimization - without a writable artifact directory, environ.py simply runs every time.
+    # Entries hold the passwords and secrets in clear, so only the user provisioning the container may read them.
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR, 0o700)
+        fd = os.open(filename + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(output)
+        os.rename(filename + ".tmp", filename)
+    except (IOError, OSError):
+        pass
+    return output
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if "--write-to-stdout" in args:
+        sys.stdout.write(cached(["--write-to-stdout"]))
+        return
+    if "--write-to-file" in args:
+        # Not cached, environ.py masks the passwords and secrets of the inventory it writes out
+        sys.stdout.write(generate(["--write-to-file"]))
+        return
+    inventory = json.loads(cached(["--list"]))
+    if "--host" in args:
+        host = args[args.index("--host") + 1]
+        print(json.dumps(inventory.get("_meta", {}).get("hostvars", {}).get(host, {})))
+    else:
+        print(json.dumps(inventory))
+
+
+if __name__ == "__main__":
+    main()
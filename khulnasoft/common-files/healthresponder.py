@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright 2018-2021 Khulnasoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Polls khulnasoftd over a single keep-alive connection and records the outcome, so that checkstate.sh can answer the
+Docker HEALTHCHECK from this cached status instead of running btool and curl on every probe
+"""
+import os
+import ssl
+import time
+try:
+    from http.client import HTTPConnection, HTTPSConnection
+except ImportError:
+    from httplib import HTTPConnection, HTTPSConnection
+
+CONTAINER_ARTIFACT_DIR = os.environ.get("CONTAINER_ARTIFACT_DIR", "/opt/container_artifact")
+STATUS_FILE = os.path.join(CONTAINER_ARTIFACT_DIR, "khulnasoftd.health")
+SCHEME_FILE = os.path.join(CONTAINER_ARTIFACT_DIR, "khulnasoftd.scheme")
+INTERVAL = int(os.environ.get("KHULNASOFT_HEALTH_INTERVAL", 10)) # in seconds
+TIMEOUT = 30 # in seconds, same as the curl probe
+
+
+def connect():
+    try:
+        with open(SCHEME_FILE) as f:
+            scheme = f.read().strip()
+    except (IOError, OSError):
+        scheme = "https"
+    if scheme == "http":
+        return HTTPConnection("localhost", 8089, timeout=TIMEOUT)
+    return HTTPSConnection("localhost", 8089, timeout=TIMEOUT, context=ssl._create_unverified_context())
+
+
+def probe(conn):
+    conn.request("GET", "/")
+    resp = conn.getresponse()
+    resp.read()
+    # Same outcome as `curl --fail`
+    return 0 if resp.status < 400 else 1
+
+
+def write_status(rc, latency):
+    with open(STATUS_FILE + ".tmp", "w") as f:
+        f.write("{} {} {:.6f}\n".format(int(time.time()), rc, latency))
+    os.rename(STATUS_FILE + ".tmp", STATUS_FILE)
+
+
+def main():
+    conn = None
+    while True:
+        rc = 1
+        start = time.time()
+        # A kept-alive connection may have been dropped by khulnasoftd in the meantime, so retry once on a fresh one
+        for attempt in range(2):
+            try:
+                conn = conn or connect()
+                rc = probe(conn)
+                break
+            except Exception:
+                if conn:
+                    conn.close()
+                conn = None
+        try:
+            write_status(rc, time.time() - start)
+        except (IOError, OSError):
+            pass
+        time.sleep(INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,149 @@
 #!/usr/bin/python
+"""
+Prints the tar exclude patterns of the minimal image for a Khulnasoft build:
 
-import re, sys
-
-EXCLUDE_V7 = """*-manifest
-*/bin/installit.py
-*/bin/jars/*
-*/bin/jsmin*
-*/bin/*mongo*
-*/3rdparty/Copyright-for-mongo*
-*/bin/node*
-*/bin/pcregextest*
-*/etc/*.lic*
-*/etc/anonymizer*
-*/etc/apps/KhulnasoftForwarder*
-*/etc/apps/KhulnasoftLightForwarder*
-*/etc/apps/launcher*
-*/etc/apps/legacy*
-*/etc/apps/sample_app*
-*/etc/apps/appsbrowser*
-*/etc/apps/alert_webhook*
-*/etc/apps/khulnasoft_archiver*
-*/etc/apps/khulnasoft_monitoring_console*
-*/lib/node_modules*
-*/share/khulnasoft/app_templates*
-*/share/khulnasoft/authScriptSamples*
-*/share/khulnasoft/diag
-*/share/khulnasoft/mbtiles*
-*/share/khulnasoft/migration*
-*/share/khulnasoft/pdf*
-*mrsparkle*"""
-
-version_string = re.match(".*khulnasoft-([0-9]+)\.([0-9]+)\.[0-9]+\.?[0-9]?-[0-9a-z]+-Linux-[0-9a-z_-]+.tgz", sys.argv[1])
-major_version = None
-minor_version = None
-
-if version_string:
-    major_version = version_string.group(1)
-    minor_version = version_string.group(2)
-
-if major_version:
-    if int(major_version) == 7:
-        print("*/bin/parsetest*")
-        if int(minor_version) < 3:
-            print("*/etc/apps/framework*")
-            print("*/etc/apps/gettingstarted*")
-        else:
-            print("*/etc/apps/khulnasoft_metrics_workspace*")
-    elif 7 < int(major_version) < 9:
-        print("*/etc/apps/khulnasoft_metrics_workspace*")
-        if int(minor_version) < 1:
-            print("*/bin/parsetest*")
-    elif int(major_version) >= 9:
-        if int(minor_version) >= 4:
-            EXCLUDE_V7 = EXCLUDE_V7.replace('*/bin/jsmin*', '')
-    print(EXCLUDE_V7)
+    make-minimal-exclude.py <build URL or tarball>
+
+Or checks the rules against a downloaded build and reports how many bytes each of them saves:
+
+    make-minimal-exclude.py --report <tarball>
+"""
+
+import re, sys, fnmatch, tarfile
+
+# Each rule applies to the builds in [since, until), open-ended when omitted. "exclude" globs are left out of the
+# minimal image, "include" globs cancel the identical exclude globs of earlier rules
+RULES = [
+    {
+        "name": "base",
+        "exclude": [
+            "*-manifest",
+            "*/bin/installit.py",
+            "*/bin/jars/*",
+            "*/bin/jsmin*",
+            "*/bin/*mongo*",
+            "*/3rdparty/Copyright-for-mongo*",
+            "*/bin/node*",
+            "*/bin/pcregextest*",
+            "*/etc/*.lic*",
+            "*/etc/anonymizer*",
+            "*/etc/apps/KhulnasoftForwarder*",
+            "*/etc/apps/KhulnasoftLightForwarder*",
+            "*/etc/apps/launcher*",
+            "*/etc/apps/legacy*",
+            "*/etc/apps/sample_app*",
+            "*/etc/apps/appsbrowser*",
+            "*/etc/apps/alert_webhook*",
+            "*/etc/apps/khulnasoft_archiver*",
+            "*/etc/apps/khulnasoft_monitoring_console*",
+            "*/lib/node_modules*",
+            "*/share/khulnasoft/app_templates*",
+            "*/share/khulnasoft/authScriptSamples*",
+            "*/share/khulnasoft/diag",
+            "*/share/khulnasoft/mbtiles*",
+            "*/share/khulnasoft/migration*",
+            "*/share/khulnasoft/pdf*",
+            "*mrsparkle*"
+        ]
+    },
+    {"name": "parsetest", "since": "7.0.0", "until": "8.1.0", "exclude": ["*/bin/parsetest*"]},
+    {"name": "getting-started-apps", "since": "7.0.0", "until": "7.3.0", "exclude": ["*/etc/apps/framework*", "*/etc/apps/gettingstarted*"]},
+    {"name": "metrics-workspace", "since": "7.3.0", "until": "9.0.0", "exclude": ["*/etc/apps/khulnasoft_metrics_workspace*"]},
+    # jsmin is needed at runtime from 9.4 on
+    {"name": "jsmin", "since": "9.4.0", "include": ["*/bin/jsmin*"]}
+]
+
+BUILD_PATTERN = re.compile(r"khulnasoft-([0-9]+)\.([0-9]+)\.([0-9]+)(?:\.[0-9]+)?-[0-9a-z]+-Linux-[0-9a-z_-]+\.tgz$")
+
+
+def parse_version(value):
+    """
+    Return the (major, minor, patch) of a build URL, tarball name or "x.y.z" string, or None
+    """
+    match = BUILD_PATTERN.search(value) or re.match(r"([0-9]+)\.([0-9]+)\.([0-9]+)$", value)
+    if not match:
+        return None
+    return tuple(int(x) for x in match.groups())
+
+
+def applies(rule, version):
+    since, until = rule.get("since"), rule.get("until")
+    return (not since or version >= parse_version(since)) and (not until or version < parse_version(until))
+
+
+def exclude_globs(version):
+    """
+    Return [(glob, rule name)] of the exclude patterns in effect for `version`
+    """
+    globs = []
+    for rule in RULES:
+        if not applies(rule, version):
+            continue
+        included = rule.get("include", [])
+        globs = [x for x in globs if x[0] not in included]
+        globs.extend((x, rule["name"]) for x in rule.get("exclude", []))
+    return globs
+
+
+def tar_match(glob, name):
+    # Same as tar's default for exclusions: the pattern may match the name after any "/"
+    parts = name.split("/")
+    return any(fnmatch.fnmatchcase("/".join(parts[i:]), glob) for i in range(len(parts)))
+
+
+def excluded_by(glob, name):
+    # Excluding a directory excludes everything below it
+    parts = name.rstrip("/").split("/")
+    return any(tar_match(glob, "/".join(parts[:i])) for i in range(1, len(parts) + 1))
+
+
+def report(tarball):
+    """
+    Check every glob in effect for the build of `tarball` against its contents, and print the bytes each rule saves -
+    returns the number of globs that match nothing
+    """
+    version = parse_version(tarball)
+    if not version:
+        print("Unable to tell the Khulnasoft version of {}".format(tarball))
+        return 1
+    globs = exclude_globs(version)
+    matched = dict((x, 0) for x, _ in globs)
+    saved = dict((x["name"], 0) for x in RULES)
+    total = kept = 0
+    with tarfile.open(tarball) as tar:
+        for member in tar:
+            hits = [(x, name) for x, name in globs if excluded_by(x, member.name)]
+            size = member.size if member.isfile() else 0
+            for glob, name in hits:
+                matched[glob] += 1
+                saved[name] += size
+            if hits:
+                total += size
+            else:
+                kept += size
+    print("Khulnasoft {}: minimal image keeps {:.1f} MB and excludes {:.1f} MB".format(".".join(str(x) for x in version), kept / 1048576.0, total / 1048576.0))
+    for rule in RULES:
+        if applies(rule, version):
+            print("{:>10.1f} MB  {}".format(saved[rule["name"]] / 1048576.0, rule["name"]))
+    stale = [x for x, _ in globs if not matched[x]]
+    for glob in stale:
+        print("Glob matches nothing in {}: {}".format(tarball, glob))
+    return len(stale)
+
+
+def main(args):
+    if args[:1] == ["--report"] and len(args) == 2:
+        return 1 if report(args[1]) else 0
+    if len(args) != 1:
+        print(__doc__.strip())
+        return 2
+    version = parse_version(args[0])
+    # Builds that can't be recognized get a complete minimal image
+    if version:
+        for glob, _ in exclude_globs(version):
+            print(glob)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
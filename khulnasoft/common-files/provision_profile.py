@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Copyright 2018-2021 Khulnasoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: provision_profile
+    type: aggregate
+    short_description: Records how long each provisioning task takes
+    description:
+      - Writes the per-task timings of every playbook run to the JSON file named by KHULNASOFT_ANSIBLE_PROFILE_FILE,
+        and prints the slowest tasks once the playbook completes
+      - Inert unless the entrypoint exports KHULNASOFT_ANSIBLE_PROFILE_FILE (see KHULNASOFT_ANSIBLE_PROFILE=true)
+'''
+
+import os
+import json
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "provision_profile"
+    # Loaded from the playbook directory, and enabled by the environment rather than the callback whitelist
+    CALLBACK_NEEDS_WHITELIST = False
+
+    SUMMARY_SIZE = 10
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.filename = os.environ.get("KHULNASOFT_ANSIBLE_PROFILE_FILE")
+        self.playbook = None
+        self.started = None
+        self.tasks = []
+        self.current = None
+
+    def _end_task(self):
+        if self.current:
+            self.current["duration"] = round(time.time() - self.started - self.current["start"], 3)
+            self.tasks.append(self.current)
+            self.current = None
+
+    def _start_task(self, task, handler=False):
+        if not self.filename:
+            return
+        # Tasks of the linear strategy run back to back, so a task ends when the next one starts
+        self._end_task()
+        self.current = {
+            "name": task.get_name(),
+            "role": task._role.get_name() if task._role else None,
+            "action": task.action,
+            "path": task.get_path(),
+            "handler": handler,
+            "start": round(time.time() - self.started, 3)
+        }
+
+    def v2_playbook_on_start(self, playbook):
+        self.playbook = os.path.basename(playbook._file_name)
+        self.started = time.time()
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._start_task(task)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._start_task(task, handler=True)
+
+    def v2_playbook_on_stats(self, stats):
+        if not self.filename:
+            return
+        self._end_task()
+        run = {
+            "playbook": self.playbook,
+            "started": self.started,
+            "duration": round(time.time() - self.started, 3),
+            "tasks": self.tasks
+        }
+        # Every playbook run (ex. site.yml, then start.yml on restarts) is appended to the same profile
+        profile = {"runs": []}
+        try:
+            with open(self.filename) as f:
+                profile = json.load(f)
+        except (IOError, ValueError):
+            pass
+        profile["runs"].append(run)
+        try:
+            with open(self.filename, "w") as f:
+                json.dump(profile, f, indent=2)
+        except (IOError, OSError) as e:
+            self._display.warning("Unable to write the provisioning profile to {}: {}".format(self.filename, e))
+        self._display.display("Slowest provisioning tasks of {} ({:.1f}s total):".format(self.playbook, run["duration"]))
+        for task in sorted(self.tasks, key=lambda x: x["duration"], reverse=True)[:self.SUMMARY_SIZE]:
+            name = "{} : {}".format(task["role"], task["name"]) if task["role"] else task["name"]
+            self._display.display("{:>10.2f}s  {}".format(task["duration"], name))
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+"""
+Extracts a Khulnasoft build tarball in a single pass, sending the members matched by the minimal exclude list to the
+extras tree and everything else to the minimal tree - equivalent to two `tar --strip 1` runs with --exclude-from and
+--wildcards --files-from, but decompressing the archive only once. The --drop-from patterns are anchored at the top
+directory of the tarball, like with `tar --anchored`
+"""
+
+import os, sys, shutil, fnmatch, tarfile, argparse, subprocess
+
+# Preferred decompressors, the first one found on the PATH is used
+DECOMPRESSORS = (["pigz", "-dc"], ["gzip", "-dc"])
+
+
+def read_patterns(filename):
+    if not filename:
+        return []
+    with open(filename) as f:
+        return [x.rstrip("\n") for x in f if x.strip()]
+
+
+def tar_match(pattern, name):
+    # Same as tar's default for exclusions: the pattern may match the name after any "/"
+    parts = name.split("/")
+    return any(fnmatch.fnmatchcase("/".join(parts[i:]), pattern) for i in range(len(parts)))
+
+
+def anchored_match(pattern, name):
+    # Same as tar --anchored: the pattern must match the whole name
+    return fnmatch.fnmatchcase(name, pattern)
+
+
+class Router(object):
+    """
+    Decides where each member goes - a directory matched by a pattern takes its whole subtree along
+    """
+
+    def __init__(self, patterns, anchored=False):
+        self.patterns = patterns
+        self.matcher = anchored_match if anchored else tar_match
+        self.matched = {}
+
+    def match(self, name):
+        name = name.rstrip("/")
+        if name in self.matched:
+            return self.matched[name]
+        parent = os.path.dirname(name)
+        result = (parent and self.match(parent)) or any(self.matcher(x, name) for x in self.patterns)
+        self.matched[name] = result
+        return result
+
+
+def decompress(tarball):
+    for command in DECOMPRESSORS:
+        try:
+            return subprocess.Popen(command + [tarball], stdout=subprocess.PIPE, bufsize=1024 * 1024)
+        except OSError:
+            continue
+    raise RuntimeError("No gzip decompressor found, tried: {}".format(", ".join(x[0] for x in DECOMPRESSORS)))
+
+
+def split(tarball, minimal, extras, exclude, drop):
+    """
+    Extract `tarball` into `minimal` and `extras`, skipping the members matched by `drop` altogether - returns the
+    number of bytes written to each tree
+    """
+    to_extras, dropped = Router(exclude), Router(drop, anchored=True)
+    kwargs = {"filter": "fully_trusted"} if hasattr(tarfile, "fully_trusted_filter") else {}
+    destinations = {}
+    directories = []
+    written = {minimal: 0, extras: 0}
+    proc = decompress(tarball)
+    with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+        for member in tar:
+            # Same as --strip 1
+            original = member.name
+            if "/" not in original.rstrip("/"):
+                continue
+            if dropped.match(original):
+                continue
+            dest = extras if to_extras.match(original) else minimal
+            destinations[original] = dest
+            member.name = original.split("/", 1)[1]
+            if member.islnk():
+                target = member.linkname
+                member.linkname = target.split("/", 1)[1] if "/" in target else target
+                # A stream can't be rewound, so a hard link into the other tree becomes a copy
+                if destinations.get(target, dest) != dest:
+                    path = os.path.join(dest, member.name)
+                    if not os.path.isdir(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    shutil.copy2(os.path.join(destinations[target], member.linkname), path)
+                    continue
+            tar.extract(member, dest, **kwargs)
+            written[dest] += member.size if member.isfile() else 0
+            if member.isdir():
+                directories.append((os.path.join(dest, member.name), member.mtime))
+    if proc.wait() != 0:
+        raise RuntimeError("Decompressing {} failed with exit code {}".format(tarball, proc.returncode))
+    # Extracting their contents touched the directories again, so restore their mtimes last, like tar does
+    for path, mtime in reversed(directories):
+        os.utime(path, (mtime, mtime))
+    return written[minimal], written[extras]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("tarball")
+    parser.add_argument("minimal", help="Directory receiving everything not matched by --exclude-from")
+    parser.add_argument("extras", help="Directory receiving the members matched by --exclude-from")
+    parser.add_argument("--exclude-from", help="Patterns of the members that belong to the extras tree")
+    parser.add_argument("--drop-from", help="Patterns of the members to leave out of both trees, anchored at the top directory")
+    args = parser.parse_args()
+    for directory in (args.minimal, args.extras):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    minimal, extras = split(args.tarball, args.minimal, args.extras, read_patterns(args.exclude_from), read_patterns(args.drop_from))
+    print("Extracted {:.1f} MB into {} and {:.1f} MB into {}".format(minimal / 1048576.0, args.minimal, extras / 1048576.0, args.extras))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import threading
+from executor import Executor, LOGGER, FILE_DIR, READY_MARKER, KHULNASOFT_MAINTAINER, docker_timestamp
+
+
+RESULTS_DIR = os.path.join(FILE_DIR, "..", "test-results", "benchmarks")
+# Kept next to the tests so that it can be committed and shared between hosts of the same class
+BASELINE_FILE = os.path.join(FILE_DIR, ".benchmark_baseline.json")
+ANSIBLE_START_MARKER = "PLAY ["
+
+
+def median(values):
+    values = sorted(x for x in values if x is not None)
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+class StartupBenchmark(Executor):
+    '''
+    Brings up a compose scenario and records, for every container, when each startup phase was reached - all timings
+    are in seconds relative to the `docker-compose up` call
+    '''
+
+    PHASES = ("created", "entrypoint_start", "ansible_start", "ansible_end", "khulnasoftd_ready", "hec_ready")
+    PROBE_INTERVAL = 0.5 # in seconds
+    # How long to keep probing HEC once provisioning is complete; scenarios without HEC enabled never become ready
+    PROBE_GRACE = 30 # in seconds
+    READY_TIMEOUT = 900 # in seconds
+
+    @classmethod
+    def setup_class(cls, platform):
+        super(StartupBenchmark, cls).setup_class(platform)
+        cls.platform = platform
+
+    def _probe(self, url, phase, timings, t0, stop, **kwargs):
+        # The raw session is used on purpose - the pooled client's retries and backoff would blur the measurement
+        session = self.get_http_client(url).session
+        while not stop.is_set():
+            try:
+                resp = session.get(url, timeout=5, **kwargs)
+                # An authentication challenge still proves that the REST API is up
+                if resp.status_code in (200, 401):
+                    timings[phase] = time.time() - t0
+                    return
+            except Exception:
+                pass
+            stop.wait(self.PROBE_INTERVAL)
+
+    def _start_probes(self, containers, timings, t0, stop):
+        threads = []
+        for container in containers:
+            if container["Labels"].get("maintainer") != KHULNASOFT_MAINTAINER:
+                continue
+            ports = dict((x["PrivatePort"], x["PublicPort"]) for x in container["Ports"] if x.get("PublicPort"))
+            probes = []
+            if 8089 in ports:
+                probes.append(("https://localhost:{}/services/server/info".format(ports[8089]), "khulnasoftd_ready"))
+            if 8088 in ports:
+                probes.append(("https://localhost:{}/services/collector/health".format(ports[8088]), "hec_ready"))
+            for url, phase in probes:
+                thread = threading.Thread(target=self._probe, args=(url, phase, timings[container["Id"]], t0, stop))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        return threads
+
+    def _log_phases(self, container_id, timings, t0):
+        logs = self.client.logs(container_id, timestamps=True)
+        for line in logs.decode("utf-8", "replace").splitlines():
+            timestamp, _, message = line.partition(" ")
+            if "ansible_start" not in timings and ANSIBLE_START_MARKER in message:
+                timings["ansible_start"] = docker_timestamp(timestamp) - t0
+            elif READY_MARKER in message:
+                timings["ansible_end"] = docker_timestamp(timestamp) - t0
+                break
+
+    def _generate_defaults(self):
+        cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, command="create-defaults")
+        self.client.start(cid.get("Id"))
+        output = self.get_container_logs(cid.get("Id"))
+        self.client.remove_container(cid.get("Id"), v=True, force=True)
+        with open(os.path.join(self.DEFAULTS_DIR, "{}.yml".format(self.project_name)), "w") as f:
+            f.write(output)
+
+    def run_scenario(self, compose_file_name):
+        '''
+        Measure a single cold start of `compose_file_name` - returns None if the scenario did not become ready
+        '''
+        self.compose_file_name = compose_file_name
+        self.project_name = self.generate_random_string()
+        label = "com.docker.compose.project={}".format(self.project_name)
+        # Clustered scenarios need a common default.yml, so every scenario gets one the same way the tests do
+        self._generate_defaults()
+        stop = threading.Event()
+        try:
+            t0 = time.time()
+            container_count, rc = self.compose_up(defaults_url="/tmp/defaults/{}.yml".format(self.project_name))
+            if rc != 0:
+                return None
+            containers = self.client.containers(filters={"label": label})
+            timings = dict((x["Id"], {}) for x in containers)
+            probes = self._start_probes(containers, timings, t0, stop)
+            if not self.wait_for_containers(container_count, label=label, timeout=self.READY_TIMEOUT):
+                return None
+            ready = time.time() - t0
+            deadline = time.time() + self.PROBE_GRACE
+            for thread in probes:
+                thread.join(max(0, deadline - time.time()))
+            stop.set()
+            result = {"ready": ready, "containers": {}, "images": {}}
+            for container in containers:
+                inspect = self.client.inspect_container(container["Id"])
+                phases = timings[container["Id"]]
+                phases["created"] = docker_timestamp(inspect["Created"]) - t0
+                phases["entrypoint_start"] = docker_timestamp(inspect["State"]["StartedAt"]) - t0
+                if container["Labels"].get("maintainer") == KHULNASOFT_MAINTAINER:
+                    self._log_phases(container["Id"], phases, t0)
+                service = container["Labels"].get("com.docker.compose.service", container["Names"][0].strip("/"))
+                result["containers"][service] = dict((x, round(phases[x], 2)) for x in self.PHASES if x in phases)
+                result["images"][container["Image"]] = inspect["Image"]
+            result["ready"] = round(ready, 2)
+            return result
+        finally:
+            stop.set()
+            self._run_command("docker-compose -p {} -f test_scenarios/{} down --volumes --remove-orphans".format(self.project_name, compose_file_name))
+            self._clean_docker_env()
+            self.cleanup_files([os.path.join(self.DEFAULTS_DIR, "{}.yml".format(self.project_name))])
+
+    def run(self, scenarios, runs=1):
+        '''
+        Benchmark every scenario `runs` times and keep the median of each timing
+        '''
+        report = {"platform": self.platform, "timestamp": int(time.time()), "images": {}, "scenarios": {}}
+        for scenario in scenarios:
+            samples = []
+            for i in range(runs):
+                self.logger.info("Benchmarking {} ({}/{})".format(scenario, i + 1, runs))
+                sample = self.run_scenario(scenario)
+                if sample:
+                    samples.append(sample)
+                    report["images"].update(sample["images"])
+            if not samples:
+                self.logger.error("Scenario {} never became ready".format(scenario))
+                report["scenarios"][scenario] = {"failed": True}
+                continue
+            containers = {}
+            for service in samples[0]["containers"]:
+                phases = [x["containers"].get(service, {}) for x in samples]
+                containers[service] = dict((phase, median([x.get(phase) for x in phases])) for phase in self.PHASES
+                                           if any(phase in x for x in phases))
+            report["scenarios"][scenario] = {"ready": median([x["ready"] for x in samples]), "runs": len(samples), "containers": containers}
+        return report
+
+
+def compare(report, baseline, threshold, slack):
+    '''
+    List the timings of `report` that are more than `threshold` (a fraction) and `slack` seconds slower than `baseline`
+    '''
+    regressions = []
+
+    def check(name, current, previous):
+        if current is not None and previous is not None and current > previous * (1 + threshold) and current - previous > slack:
+            regressions.append("{}: {:.1f}s -> {:.1f}s (+{:.0%})".format(name, previous, current, (current - previous) / max(previous, 0.01)))
+    for scenario, current in sorted(report["scenarios"].items()):
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous or previous.get("failed"):
+            continue
+        if current.get("failed"):
+            regressions.append("{}: no longer becomes ready".format(scenario))
+            continue
+        check("{} ready".format(scenario), current["ready"], previous["ready"])
+        for service, phases in sorted(current["containers"].items()):
+            for phase, value in sorted(phases.items()):
+                check("{} {} {}".format(scenario, service, phase), value, previous["containers"].get(service, {}).get(phase))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the time-to-ready of the compose scenarios in test_scenarios/")
+    parser.add_argument("scenarios", nargs="*", help="Compose files to benchmark, ex. 1so_hec.yaml (default: all of them)")
+    parser.add_argument("--platform", default="debian-9", help="Platform of the images to benchmark (default: debian-9)")
+    parser.add_argument("--runs", type=int, default=1, help="Cold starts per scenario, the median is reported (default: 1)")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline to compare against (default: tests/.benchmark_baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Record this run as the new baseline for the platform")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown that counts as a regression (default: 0.2)")
+    parser.add_argument("--slack", type=float, default=10, help="Absolute slowdown in seconds always tolerated as noise (default: 10)")
+    args = parser.parse_args()
+    os.chdir(os.path.join(FILE_DIR, ".."))
+    scenarios = args.scenarios or sorted(os.path.basename(x) for x in glob.glob(os.path.join(Executor.SCENARIOS_DIR, "*.y*ml")))
+    StartupBenchmark.setup_class(args.platform)
+    benchmark = StartupBenchmark()
+    try:
+        report = benchmark.run(scenarios, args.runs)
+    finally:
+        StartupBenchmark.teardown_class()
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    filename = os.path.join(RESULTS_DIR, "startup_{}_{}.json".format(args.platform, report["timestamp"]))
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    LOGGER.info("Benchmark results written to {}".format(filename))
+    try:
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    except (IOError, ValueError):
+        baselines = {}
+    regressions = []
+    if args.platform in baselines:
+        regressions = compare(report, baselines[args.platform], args.threshold, args.slack)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+    else:
+        print("No baseline recorded for {}".format(args.platform))
+    for scenario, result in sorted(report["scenarios"].items()):
+        print("{:<40} {}".format(scenario, "FAILED" if result.get("failed") else "{:.1f}s".format(result["ready"])))
+    if args.save_baseline:
+        baseline = baselines.get(args.platform, {"scenarios": {}})
+        # Only the scenarios that were benchmarked are replaced
+        baseline["scenarios"].update(report["scenarios"])
+        baseline["images"] = report["images"]
+        baselines[args.platform] = baseline
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
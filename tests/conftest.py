@@ -1,8 +1,85 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import os
 import pytest
+import docker
+import scheduler
+from executor import WarmPool, NoProvisionContainers
+
+# Duration of the latest attempt of every test run by this process, fed back into the scheduler's cost model
+DURATIONS = {}
 
 
 def pytest_addoption(parser):
     parser.addoption("--platform", default="debian-9", action="store", help="Define which platform of images to run tests again (default: debian-9)")
+    parser.addoption("--schedule", default=False, action="store_true", help="Run the most expensive tests first and only start a test once its containers fit in the host's container budget")
+    parser.addoption("--container-budget", default=None, type=int, action="store", help="Maximum number of containers running at once across all workers (default: derived from host memory and CPUs)")
+    parser.addoption("--durations-file", default=scheduler.DURATIONS_FILE, action="store", help="JSON file with the recorded test durations used to estimate test costs")
+    parser.addoption("--num-shards", default=1, type=int, action="store", help="Split the tests into this many cost-balanced shards, ex. one per CI host (default: 1)")
+    parser.addoption("--shard-id", default=0, type=int, action="store", help="Zero-based index of the shard to run (default: 0)")
+
+
+def pytest_configure(config):
+    config.container_budget = None
+    if config.getoption("schedule"):
+        capacity = config.getoption("container_budget") or scheduler.host_container_budget()
+        config.container_budget = scheduler.ContainerBudget(capacity)
+
+
+def pytest_collection_modifyitems(config, items):
+    recorded = scheduler.load_durations(config.getoption("durations_file"))
+    costs = {}
+    for item in items:
+        item.containers = scheduler.count_containers(getattr(item, "function", None))
+        costs[item.nodeid] = scheduler.estimate_duration(item.containers, recorded.get(item.nodeid))
+    num_shards, shard_id = config.getoption("num_shards"), config.getoption("shard_id")
+    if num_shards > 1:
+        shards, loads = scheduler.assign_shards(costs, num_shards)
+        deselected = [x for x in items if shards[x.nodeid] != shard_id]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = [x for x in items if shards[x.nodeid] == shard_id]
+    if config.getoption("schedule"):
+        # Longest first, so the big topologies don't end up as the stragglers of a run
+        items.sort(key=lambda x: -costs[x.nodeid])
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    budget = item.config.container_budget
+    if budget:
+        budget.acquire(item.containers)
+    try:
+        yield
+    finally:
+        if budget:
+            budget.release(item.containers)
+
+
+def pytest_runtest_logreport(report):
+    if report.when == "setup":
+        DURATIONS[report.nodeid] = report.duration
+    else:
+        DURATIONS[report.nodeid] = DURATIONS.get(report.nodeid, 0) + report.duration
+
+
+def pytest_sessionfinish(session):
+    # With pytest-xdist, worker reports are relayed to the controller, which is the only process writing the file
+    if DURATIONS and not hasattr(session.config, "workerinput"):
+        scheduler.save_durations(DURATIONS, session.config.getoption("durations_file"))
+
+
+@pytest.fixture(scope="session")
+def warm_pool():
+    # Set WARM_POOL_SNAPSHOTS=true to keep provisioned snapshots around between test runs
+    pool = WarmPool(docker.APIClient(), snapshots=os.environ.get("WARM_POOL_SNAPSHOTS", "").lower() == "true")
+    yield pool
+    pool.close()
+
+
+@pytest.fixture(scope="session")
+def no_provision():
+    containers = NoProvisionContainers(docker.APIClient())
+    yield containers
+    containers.close()
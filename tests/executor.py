@@ -9,14 +9,30 @@ import requests
 import logging
 import docker
 import json
-import urllib
 import yaml
 import shlex
 import subprocess
+import signal
 import logging.handlers
-from shutil import copy
-from random import choice
+import threading
+import calendar
+import codecs
+import re
+import tempfile
+import traceback
+import hashlib
+from collections import deque, defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copy, rmtree
+from random import choice, uniform
 from string import ascii_lowercase
+from requests.adapters import HTTPAdapter
+try:
+    from queue import Queue, Empty
+    from urllib.parse import urlsplit
+except ImportError:
+    from Queue import Queue, Empty
+    from urlparse import urlsplit
 # Code to suppress insecure https warnings
 import urllib3
 from urllib3.exceptions import InsecureRequestWarning, SubjectAltNameWarning
@@ -37,6 +53,731 @@ LOGGER.addHandler(file_handler)
 # Define Docker client settings
 os.environ['COMPOSE_HTTP_TIMEOUT'] = "500"
 os.environ['DOCKER_CLIENT_TIMEOUT'] = "500"
+# Log lines emitted by the entrypoint that determine whether a Khulnasoft container is usable
+READY_MARKER = "Ansible playbook complete"
+FAILURE_MARKERS = ("unable to", "denied", "khulnasoftd.pid file is unreadable")
+KHULNASOFT_MAINTAINER = "support@khulnasoft.com"
+# Upper bound on the amount of container output kept in memory per log stream
+MAX_LOG_BYTES = 4 * 1024 * 1024
+
+
+def iter_log_lines(stream):
+    '''
+    Re-assemble an attached Docker log stream (which arrives in arbitrary, often single-byte, chunks) into decoded lines
+    '''
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    for chunk in stream:
+        pending += decoder.decode(chunk)
+        while "\n" in pending:
+            line, pending = pending.split("\n", 1)
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def docker_timestamp(value):
+    '''
+    Convert an RFC 3339 timestamp with nanoseconds, as reported by the Docker daemon, into (fractional) epoch seconds
+    '''
+    seconds = calendar.timegm(time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S"))
+    fraction = re.match(r"\.(\d+)", value[19:])
+    return seconds + (float("0." + fraction.group(1)) if fraction else 0)
+
+
+def container_started_at(inspect):
+    '''
+    Convert the `State.StartedAt` timestamp of a `docker inspect` payload into epoch seconds
+    '''
+    return int(docker_timestamp(inspect["State"]["StartedAt"]))
+
+
+class LogStream(object):
+    '''
+    Line-oriented view over a container's log stream - output is decoded incrementally as it is consumed, and only the
+    most recent `max_bytes` are kept in a ring buffer (optionally, the full output is spooled to a temporary file)
+    '''
+
+    def __init__(self, client, container_id, max_bytes=MAX_LOG_BYTES, spool=False, **kwargs):
+        kwargs.setdefault("stream", True)
+        self.container_id = container_id
+        self.max_bytes = max_bytes
+        self.buffer = deque()
+        self.buffered_bytes = 0
+        self.spool = tempfile.TemporaryFile(mode="w+b") if spool else None
+        self.stream = client.logs(container_id, **kwargs)
+        self.lines = iter_log_lines(self.stream)
+
+    def __iter__(self):
+        for line in self.lines:
+            self._record(line)
+            yield line
+
+    def _record(self, line):
+        if self.spool:
+            self.spool.write(line.encode("utf-8") + b"\n")
+        self.buffer.append(line)
+        self.buffered_bytes += len(line) + 1
+        while self.buffered_bytes > self.max_bytes and len(self.buffer) > 1:
+            self.buffered_bytes -= len(self.buffer.popleft()) + 1
+
+    def read_until(self, marker=None, pattern=None):
+        '''
+        Consume the stream until a line contains `marker` or matches the `pattern` regex - returns the matching line (or
+        the match object for patterns), or None if the stream ended first. The matching line itself is not buffered.
+        '''
+        if pattern is not None and not hasattr(pattern, "search"):
+            pattern = re.compile(pattern)
+        for line in self.lines:
+            if marker is not None and marker in line:
+                return line
+            if pattern is not None:
+                match = pattern.search(line)
+                if match:
+                    return match
+            self._record(line)
+        return None
+
+    def expect(self, *needles, **kwargs):
+        '''
+        Consume the stream until every one of `needles` has been seen (or `until` is reached) - returns the needles that
+        were never found, so that callers can assert on an empty result without materialising the output
+        '''
+        until = kwargs.get("until", READY_MARKER)
+        missing = set(needles)
+        for line in self.lines:
+            if until is not None and until in line:
+                break
+            self._record(line)
+            missing = set(x for x in missing if x not in line)
+            if not missing:
+                break
+        return missing
+
+    def getvalue(self):
+        '''
+        Return the consumed output - everything when spooling, otherwise only the tail kept in the ring buffer
+        '''
+        if self.spool:
+            self.spool.seek(0)
+            return self.spool.read().decode("utf-8")
+        return "".join(line + "\n" for line in self.buffer)
+
+    def close(self):
+        try:
+            self.stream.close()
+        except Exception:
+            pass
+        if self.spool:
+            self.spool.close()
+
+
+class KhulnasoftdClient(object):
+    '''
+    Keep-alive REST client for a single khulnasoftd (or HEC) endpoint - connections are pooled in a `requests.Session`
+    so repeated checks against the same container reuse one TLS connection, and latencies are tracked per endpoint
+    '''
+
+    POOL_SIZE = 4
+    RETRY_COUNT = 3
+    RETRY_DELAY = 6 # base delay in seconds, doubled after every failed attempt
+    RETRY_MAX_DELAY = 60 # in seconds
+
+    def __init__(self, base_url, auth=None, logger=LOGGER, pool_size=POOL_SIZE, retry_count=RETRY_COUNT, retry_delay=RETRY_DELAY):
+        self.base_url = base_url.rstrip("/")
+        self.logger = logger
+        self.retry_count = retry_count
+        self.retry_delay = retry_delay
+        self.latencies = defaultdict(list)
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def backoff(self, attempt):
+        # "Equal jitter": wait at least half of the exponential delay, so retries from parallel tests don't line up
+        delay = min(self.RETRY_MAX_DELAY, self.retry_delay * 2 ** attempt)
+        return delay / 2.0 + uniform(0, delay / 2.0)
+
+    def request(self, method, path, **kwargs):
+        url = path if "://" in path else self.base_url + path
+        endpoint = urlsplit(url).path
+        start = time.time()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            self.latencies[endpoint].append(time.time() - start)
+
+    def request_with_retry(self, method, path, **kwargs):
+        for n in range(self.retry_count):
+            try:
+                self.logger.info("Attempt #{}: running {} against {} with kwargs {}".format(n+1, method, path, kwargs))
+                resp = self.request(method, path, **kwargs)
+                resp.raise_for_status()
+                return resp.status_code, resp.content
+            except Exception as e:
+                self.logger.error("Attempt #{} error: {}".format(n+1, str(e)))
+                if n < self.retry_count-1:
+                    time.sleep(self.backoff(n))
+                    continue
+                raise e
+
+    def stats(self):
+        stats = {}
+        for endpoint, samples in self.latencies.items():
+            stats[endpoint] = {
+                "count": len(samples),
+                "total": sum(samples),
+                "mean": sum(samples) / len(samples),
+                "max": max(samples)
+            }
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+class SearchJob(object):
+    '''
+    Search job on a khulnasoftd instance - completion is detected with adaptive short-interval polling (fast searches
+    return within a fraction of a second, long ones back off to `MAX_POLL_INTERVAL`) and results are paged through
+    with offset/count, so callers can iterate over them without loading the whole result set
+    '''
+
+    MIN_POLL_INTERVAL = 0.1 # in seconds
+    MAX_POLL_INTERVAL = 2 # in seconds
+    TIMEOUT = 300 # in seconds
+    PAGE_SIZE = 1000
+
+    def __init__(self, client, query, auth=None, logger=LOGGER, **params):
+        self.client = client
+        self.auth = auth
+        self.logger = logger
+        params["search"] = query
+        resp = self.client.request("POST", "/services/search/jobs?output_mode=json", auth=auth, data=params)
+        assert resp.status_code == 201
+        self.sid = json.loads(resp.content)["sid"]
+        assert self.sid
+        self.metadata = None
+
+    @property
+    def content(self):
+        return self.metadata["entry"][0]["content"]
+
+    def refresh(self):
+        resp = self.client.request("GET", "/services/search/jobs/{}?output_mode=json".format(self.sid), auth=self.auth)
+        assert resp.status_code == 200
+        self.metadata = json.loads(resp.content)
+        return self.content["isDone"]
+
+    def wait(self, timeout=TIMEOUT):
+        start = time.time()
+        interval = self.MIN_POLL_INTERVAL
+        while not self.refresh():
+            if time.time() - start > timeout:
+                raise AssertionError("Search job {} not done after {}s".format(self.sid, timeout))
+            time.sleep(interval)
+            interval = min(interval * 1.5, self.MAX_POLL_INTERVAL)
+        self.logger.info("Search job {} done: {}".format(self.sid, self.stats()))
+        return self.metadata
+
+    def stats(self):
+        '''
+        Job-level figures reported by khulnasoftd, useful to benchmark searches
+        '''
+        return {
+            "sid": self.sid,
+            "run_duration": self.content.get("runDuration"),
+            "scan_count": self.content.get("scanCount"),
+            "event_count": self.content.get("eventCount"),
+            "result_count": self.content.get("resultCount")
+        }
+
+    def iter_results(self, page_size=PAGE_SIZE):
+        offset = 0
+        while True:
+            url = "/services/search/jobs/{}/results?output_mode=json&offset={}&count={}".format(self.sid, offset, page_size)
+            resp = self.client.request("GET", url, auth=self.auth)
+            assert resp.status_code == 200
+            page = json.loads(resp.content).get("results", [])
+            for result in page:
+                yield result
+            if len(page) < page_size:
+                return
+            offset += len(page)
+
+
+class VerificationResult(object):
+    '''
+    Aggregated outcome of a fan-out verification - one entry per probe with its status, error and duration
+    '''
+
+    def __init__(self):
+        self.results = OrderedDict()
+
+    def record(self, name, error, duration):
+        self.results[name] = {"passed": error is None, "error": error, "duration": duration}
+
+    @property
+    def passed(self):
+        return all(x["passed"] for x in self.results.values())
+
+    @property
+    def failures(self):
+        return OrderedDict((k, v) for k, v in self.results.items() if not v["passed"])
+
+    def summary(self):
+        lines = []
+        for name, result in self.results.items():
+            status = "PASS" if result["passed"] else "FAIL"
+            lines.append("{} {} ({:.2f}s){}".format(status, name, result["duration"], ": " + result["error"] if result["error"] else ""))
+        return "\n".join(lines)
+
+
+class VerificationRunner(object):
+    '''
+    Run independent per-container probes concurrently, bounded by `concurrency`, and collect a VerificationResult
+    '''
+
+    CONCURRENCY = 8
+
+    def __init__(self, logger=LOGGER, concurrency=CONCURRENCY):
+        self.logger = logger
+        self.concurrency = concurrency
+
+    def _run_probe(self, name, probe):
+        start = time.time()
+        try:
+            probe()
+            return name, None, time.time() - start
+        except Exception as e:
+            self.logger.error("Probe {} failed: {}".format(name, traceback.format_exc()))
+            return name, "{}: {}".format(type(e).__name__, e), time.time() - start
+
+    def run(self, probes):
+        '''
+        `probes` is an ordered sequence of (name, callable) pairs; a probe fails by raising
+        '''
+        result = VerificationResult()
+        if not probes:
+            return result
+        pool = ThreadPoolExecutor(max_workers=min(self.concurrency, len(probes)))
+        try:
+            futures = [pool.submit(self._run_probe, name, probe) for name, probe in probes]
+            for future in futures:
+                result.record(*future.result())
+        finally:
+            pool.shutdown(wait=True)
+        self.logger.info("Verification results:\n{}".format(result.summary()))
+        return result
+
+
+class ReadinessWatcher(object):
+    '''
+    Event-driven replacement for polling container logs - subscribes once to the Docker events stream and follows each
+    container's log stream, so a container is marked ready (or failed) as soon as the relevant line is written
+    '''
+
+    FAILURE_GRACE = 15 # in seconds
+
+    def __init__(self, client, logger, ready_marker=READY_MARKER, failure_markers=FAILURE_MARKERS):
+        self.client = client
+        self.logger = logger
+        self.ready_marker = ready_marker
+        self.failure_markers = failure_markers
+        self.notifications = Queue()
+        self.names = {}
+        self.ready = set()
+        self.failed = {}
+        self.suspects = {}
+        self.exited = {}
+        # Bumped every time a container (re)starts, so that lines from a previous run are discarded
+        self.generations = {}
+        self.log_streams = {}
+        self.events = None
+
+    def _follow_logs(self, cid, generation, since):
+        last_seen = since
+        while self.generations.get(cid) == generation:
+            try:
+                stream = self.client.logs(cid, stream=True, follow=True, since=last_seen)
+            except Exception as e:
+                self.logger.error("Unable to attach to logs of {}: {}".format(self.names[cid], e))
+                return
+            self.log_streams[cid] = stream
+            try:
+                for line in iter_log_lines(stream):
+                    last_seen = int(time.time())
+                    self.notifications.put(("line", cid, (generation, line)))
+                # The log stream only ends once the container stops
+                return
+            except Exception as e:
+                # Quiet Ansible tasks can outlast the client read timeout - re-attach from where we left off
+                self.logger.debug("Log stream for {} interrupted, re-attaching: {}".format(self.names[cid], e))
+
+    def _follow_events(self):
+        try:
+            for event in self.events:
+                self.notifications.put((event.get("status"), event.get("id"), None))
+        except Exception:
+            # Raised when the stream is closed on shutdown
+            pass
+
+    def _watch(self, cid):
+        self.ready.discard(cid)
+        self.suspects.pop(cid, None)
+        self.exited.pop(cid, None)
+        generation = self.generations.get(cid, 0) + 1
+        self.generations[cid] = generation
+        old_stream = self.log_streams.pop(cid, None)
+        if old_stream:
+            old_stream.close()
+        since = container_started_at(self.client.inspect_container(cid))
+        thread = threading.Thread(target=self._follow_logs, args=(cid, generation, since))
+        thread.daemon = True
+        thread.start()
+
+    def _handle(self, kind, cid, payload):
+        if cid not in self.generations:
+            return
+        name = self.names[cid]
+        if kind == "line":
+            generation, line = payload
+            if cid in self.ready or generation != self.generations[cid]:
+                return
+            if self.ready_marker in line:
+                self.logger.info("Container {} is ready".format(name))
+                self.ready.add(cid)
+                self.suspects.pop(cid, None)
+            elif any(marker in line for marker in self.failure_markers):
+                self.suspects[cid] = (time.time(), "last log line: {}".format(line))
+            else:
+                self.suspects.pop(cid, None)
+        elif kind == "start":
+            self.logger.info("Container {} (re)started, waiting for it to become ready".format(name))
+            self._watch(cid)
+        elif kind == "die" and cid not in self.ready:
+            # Give a restarting container the chance to come back up before declaring it failed
+            self.exited[cid] = (time.time(), "container exited before becoming ready")
+
+    def wait(self, containers, timeout):
+        '''
+        Block until all `containers` (as returned by `client.containers()`) are ready - returns False as soon as one of
+        them fails, or when the timeout is reached
+        '''
+        start = time.time()
+        for container in containers:
+            cid, name = container["Id"], container["Names"][0]
+            self.names[cid] = name
+            # Non-Khulnasoft containers (ex. nginx app servers) have no provisioning step to wait for
+            if container.get("Labels", {}).get("maintainer") == KHULNASOFT_MAINTAINER:
+                self._watch(cid)
+            else:
+                self.logger.info("Container {} is ready".format(name))
+                self.ready.add(cid)
+        while len(self.ready) < len(containers):
+            remaining = timeout - (time.time() - start)
+            if remaining <= 0:
+                self.logger.error("Timed out after {}s waiting for containers: {}".format(timeout, [self.names[x] for x in self.names if x not in self.ready]))
+                return False
+            try:
+                self._handle(*self.notifications.get(timeout=min(remaining, 1)))
+            except Empty:
+                pass
+            # A failure line only counts if the container is stuck on it; Ansible also prints these in recoverable tasks
+            for cid, (seen, reason) in list(self.suspects.items()) + list(self.exited.items()):
+                if time.time() - seen > self.FAILURE_GRACE:
+                    self.failed[cid] = reason
+            if self.failed:
+                for cid, reason in self.failed.items():
+                    self.logger.error("Container {} did not start properly, {}".format(self.names[cid], reason))
+                return False
+        self.logger.info("All containers ready to proceed")
+        return True
+
+    def subscribe(self, filters=None):
+        '''
+        Start listening to container lifecycle events - do this before listing containers so that no restart is missed
+        '''
+        event_filters = {"type": "container", "event": ["start", "die"]}
+        event_filters.update(filters or {})
+        self.events = self.client.events(since=int(time.time()), filters=event_filters, decode=True)
+        thread = threading.Thread(target=self._follow_events)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        streams = list(self.log_streams.values())
+        self.generations = {}
+        self.log_streams = {}
+        for stream in streams + [self.events]:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+class WarmContainer(object):
+    '''
+    Handle to a provisioned container checked out of a WarmPool
+    '''
+
+    def __init__(self, key, cid, name, password):
+        self.key = key
+        self.id = cid
+        self.name = name
+        self.password = password
+
+
+class WarmPool(object):
+    '''
+    Pool of pre-provisioned containers for tests that only inspect state - containers are keyed by a hash of the image
+    digest, the environment and the default.yml, and handed back out to the next test asking for the same key.
+    With `snapshots` enabled, the first provisioned container of each key is also committed (along with the contents
+    of its volumes, which `docker commit` leaves out) so that later runs start from the provisioned state - the admin
+    password of a snapshot is kept next to its volumes, readable only by the current user, and never in the image.
+    '''
+
+    POOL_LABEL = "com.khulnasoft.warm.pool"
+    KEY_LABEL = "com.khulnasoft.warm.key"
+    IMAGE_LABEL = "com.khulnasoft.warm.image"
+    DIGEST_LABEL = "com.khulnasoft.warm.image-digest"
+    SNAPSHOT_REPOSITORY = "khulnasoft-warm"
+    SNAPSHOT_DIR = os.path.join(FILE_DIR, "..", "test-results", "warm-snapshots")
+    PORTS = [8000, 8088, 8089]
+
+    def __init__(self, client, logger=LOGGER, snapshots=False, timeout=500):
+        self.client = client
+        self.logger = logger
+        self.snapshots = snapshots
+        self.timeout = timeout
+        self.idle = defaultdict(list)
+        self.containers = {}
+        self.lock = threading.Lock()
+        self.pruned = set()
+
+    def key(self, digest, environment, default_yml=None):
+        # The password is generated by the pool and saved along with the snapshot, so it is not part of the key
+        env = sorted((k, v) for k, v in environment.items() if k != "KHULNASOFT_PASSWORD")
+        return hashlib.sha256(json.dumps([digest, env, default_yml]).encode("utf-8")).hexdigest()
+
+    def checkout(self, image, environment=None, default_yml=None):
+        '''
+        Return a ready WarmContainer for the given image/environment/default.yml contents, provisioning one if needed
+        '''
+        environment = dict(environment or {})
+        digest = self.client.inspect_image(image)["Id"]
+        if self.snapshots:
+            self.prune_snapshots(image, digest)
+        key = self.key(digest, environment, default_yml)
+        with self.lock:
+            if self.idle[key]:
+                container = self.idle[key].pop()
+                self.logger.info("Reusing warm container {} for key {}".format(container.name, key[:12]))
+                return container
+        return self._provision(image, digest, key, environment, default_yml)
+
+    def checkin(self, container, dirty=False):
+        '''
+        Hand a container back to the pool - tests that changed its state must pass `dirty=True` to have it removed
+        '''
+        if dirty:
+            self._remove(container)
+            return
+        with self.lock:
+            self.idle[container.key].append(container)
+
+    def _snapshot_dir(self, key):
+        return os.path.join(self.SNAPSHOT_DIR, key)
+
+    def _find_snapshot(self, key):
+        images = self.client.images(name=self.SNAPSHOT_REPOSITORY, filters={"label": "{}={}".format(self.KEY_LABEL, key)})
+        snapshot_dir = self._snapshot_dir(key)
+        if images and all(os.path.isfile(os.path.join(snapshot_dir, x)) for x in ("password", "volumes.json")):
+            return images[0]
+        return None
+
+    def _provision(self, image, digest, key, environment, default_yml):
+        snapshot = self._find_snapshot(key) if self.snapshots else None
+        if snapshot:
+            with open(os.path.join(self._snapshot_dir(key), "password")) as f:
+                password = f.read()
+            self.logger.info("Starting warm container for key {} from snapshot {}".format(key[:12], snapshot["Id"]))
+        else:
+            password = environment.get("KHULNASOFT_PASSWORD") or Executor.generate_random_string()
+        environment["KHULNASOFT_PASSWORD"] = password
+        binds = []
+        if default_yml is not None:
+            defaults_dir = os.path.join(self._snapshot_dir(key), "defaults")
+            if not os.path.isdir(defaults_dir):
+                os.makedirs(defaults_dir)
+            with open(os.path.join(defaults_dir, "default.yml"), "w") as f:
+                f.write(default_yml)
+            binds.append("{}:/tmp/defaults/".format(os.path.abspath(defaults_dir)))
+        name = "warm-{}".format(Executor.generate_random_string())
+        cid = self.client.create_container(snapshot["Id"] if snapshot else image, tty=True, ports=self.PORTS, name=name,
+                                           environment=environment, labels={self.POOL_LABEL: "true", self.KEY_LABEL: key},
+                                           host_config=self.client.create_host_config(binds=binds, port_bindings=dict((x, ("0.0.0.0",)) for x in self.PORTS))
+                                           ).get("Id")
+        container = WarmContainer(key, cid, name, password)
+        self.containers[cid] = container
+        if snapshot:
+            self._restore_volumes(cid, key)
+        self.client.start(cid)
+        watcher = ReadinessWatcher(self.client, self.logger)
+        try:
+            ready = watcher.wait(self.client.containers(filters={"id": cid}), self.timeout)
+        finally:
+            watcher.close()
+        if not ready:
+            self._remove(container)
+            raise AssertionError("Warm container {} for key {} did not become ready".format(name, key[:12]))
+        if self.snapshots and not snapshot:
+            self._snapshot(container, image, digest)
+        return container
+
+    def _snapshot(self, container, image, digest):
+        snapshot_dir = self._snapshot_dir(container.key)
+        if not os.path.isdir(snapshot_dir):
+            os.makedirs(snapshot_dir)
+        volumes = {}
+        for n, path in enumerate(sorted(self.client.inspect_container(container.id)["Config"].get("Volumes") or {})):
+            archive = os.path.join(snapshot_dir, "volume{}.tar".format(n))
+            stream, _ = self.client.get_archive(container.id, path)
+            with open(archive, "wb") as f:
+                for chunk in stream:
+                    f.write(chunk)
+            volumes[path] = archive
+        changes = ["LABEL {}={}".format(label, value) for label, value in [(self.KEY_LABEL, container.key),
+                                                                          (self.IMAGE_LABEL, image),
+                                                                          (self.DIGEST_LABEL, digest)]]
+        # The container's environment is committed along with it - containers started from the snapshot get the
+        # password passed again
+        changes.append("ENV KHULNASOFT_PASSWORD=")
+        with os.fdopen(os.open(os.path.join(snapshot_dir, "password"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            f.write(container.password)
+        self.client.commit(container.id, repository=self.SNAPSHOT_REPOSITORY, tag=container.key[:16], changes=changes)
+        # Written last - a snapshot without its volume index is ignored
+        with open(os.path.join(snapshot_dir, "volumes.json"), "w") as f:
+            json.dump(volumes, f)
+        self.logger.info("Saved warm snapshot {}:{}".format(self.SNAPSHOT_REPOSITORY, container.key[:16]))
+
+    def _restore_volumes(self, cid, key):
+        with open(os.path.join(self._snapshot_dir(key), "volumes.json")) as f:
+            volumes = json.load(f)
+        for path, archive in volumes.items():
+            # Archives are rooted at the basename of the volume path
+            with open(archive, "rb") as f:
+                self.client.put_archive(cid, os.path.dirname(path.rstrip("/")), f)
+
+    def prune_snapshots(self, image, digest):
+        '''
+        Remove snapshots taken from a previous build of `image` - they are keyed by the digest and can never match again
+        '''
+        if image in self.pruned:
+            return
+        self.pruned.add(image)
+        for snapshot in self.client.images(name=self.SNAPSHOT_REPOSITORY):
+            labels = snapshot.get("Labels") or {}
+            if labels.get(self.IMAGE_LABEL) != image or labels.get(self.DIGEST_LABEL) == digest:
+                continue
+            key = labels.get(self.KEY_LABEL)
+            self.logger.info("Removing stale warm snapshot {}".format(snapshot["Id"]))
+            try:
+                self.client.remove_image(snapshot["Id"], force=True)
+            except docker.errors.APIError as e:
+                self.logger.error("Unable to remove warm snapshot {}: {}".format(snapshot["Id"], e))
+            if key:
+                rmtree(self._snapshot_dir(key), ignore_errors=True)
+
+    def _remove(self, container):
+        self.containers.pop(container.id, None)
+        try:
+            self.client.remove_container(container.id, v=True, force=True)
+        except docker.errors.APIError as e:
+            self.logger.error("Unable to remove warm container {}: {}".format(container.name, e))
+
+    def close(self):
+        for container in list(self.containers.values()):
+            self._remove(container)
+        self.idle.clear()
+
+
+class NoProvisionContainers(object):
+    '''
+    One `no-provision` container per image, shared by the tests that only exec read-only commands into it - the
+    commands a test asks for are run concurrently, their outputs are kept for the tests asking for them next
+    '''
+
+    # Started by the entrypoint once `no-provision` is set up, so the container can be exec'ed into when it shows up
+    IDLE_COMMAND = "tail -n 0 -f /etc/hosts"
+    POLL_INTERVAL = 0.2 # in seconds
+    START_TIMEOUT = 120 # in seconds
+    CONCURRENCY = VerificationRunner.CONCURRENCY
+
+    def __init__(self, client, logger=LOGGER, concurrency=CONCURRENCY):
+        self.client = client
+        self.logger = logger
+        self.concurrency = concurrency
+        self.containers = {}
+        self.outputs = defaultdict(dict)
+        self.lock = threading.Lock()
+
+    def _start(self, image):
+        name = "no-provision-{}".format(Executor.generate_random_string())
+        cid = self.client.create_container(image, tty=True, command="no-provision", name=name).get("Id")
+        self.containers[image] = cid
+        self.client.start(cid)
+        deadline = time.time() + self.START_TIMEOUT
+        while time.time() < deadline:
+            state = self.client.inspect_container(cid)["State"]
+            if not state["Running"]:
+                logs = self.client.logs(cid).decode("utf-8", "replace")
+                raise AssertionError("No-provision container of {} exited with code {}:\n{}".format(image, state["ExitCode"], logs))
+            try:
+                if any(self.IDLE_COMMAND in " ".join(x) for x in self.client.top(cid)["Processes"] or []):
+                    self.logger.info("No-provision container {} of {} is up".format(name, image))
+                    return cid
+            except docker.errors.APIError:
+                # Exited in between, the next inspect tells
+                pass
+            time.sleep(self.POLL_INTERVAL)
+        raise AssertionError("No-provision container {} of {} did not come up within {}s".format(name, image, self.START_TIMEOUT))
+
+    def _exec(self, cid, command, user):
+        exec_id = self.client.exec_create(cid, command, user=user or "")
+        return self.client.exec_start(exec_id).decode("utf-8", "replace")
+
+    def run(self, image, commands):
+        '''
+        Return the output of the `no-provision` container of `image` for each of `commands`, a {name: (command, user)}
+        mapping - a user of None runs the command as the image's default user
+        '''
+        with self.lock:
+            cid = self.containers.get(image) or self._start(image)
+            outputs = self.outputs[image]
+            missing = [x for x in commands if x not in outputs]
+            if missing:
+                pool = ThreadPoolExecutor(max_workers=min(self.concurrency, len(missing)))
+                try:
+                    futures = [(x, pool.submit(self._exec, cid, commands[x][0], commands[x][1])) for x in missing]
+                    for name, future in futures:
+                        outputs[name] = future.result()
+                finally:
+                    pool.shutdown(wait=True)
+            return dict((x, outputs[x]) for x in commands)
+
+    def close(self):
+        for image, cid in list(self.containers.items()):
+            try:
+                self.client.remove_container(cid, v=True, force=True)
+            except docker.errors.APIError as e:
+                self.logger.error("Unable to remove no-provision container of {}: {}".format(image, e))
+        self.containers.clear()
+        self.outputs.clear()
 
 
 class Executor(object):
@@ -46,8 +787,14 @@ class Executor(object):
     """
 
     logger = LOGGER
-    RETRY_COUNT = 3
-    RETRY_DELAY = 6 # in seconds
+    RETRY_COUNT = KhulnasoftdClient.RETRY_COUNT
+    RETRY_DELAY = KhulnasoftdClient.RETRY_DELAY
+    HTTP_POOL_SIZE = KhulnasoftdClient.POOL_SIZE
+    VERIFY_CONCURRENCY = VerificationRunner.CONCURRENCY
+    COMMAND_TIMEOUT = 900 # in seconds
+    COMMAND_KILL_GRACE = 10 # in seconds
+    COMMAND_TIMINGS_FILE = os.path.join(FILE_DIR, "..", "test-results", "command_timings.jsonl")
+    http_clients_lock = threading.Lock()
 
     FIXTURES_DIR = os.path.join(FILE_DIR, "fixtures")
     EXAMPLE_APP = os.path.join(FIXTURES_DIR, "khulnasoft_app_example")
@@ -68,6 +815,8 @@ class Executor(object):
         cls.project_name = None
         cls.DIR = None
         cls.container_id = None
+        cls.http_clients = {}
+        cls.command_timings = []
         # Wrap into custom env variable for subprocess overrides
         cls.env = {
             "KHULNASOFT_PASSWORD": cls.password,
@@ -77,34 +826,74 @@ class Executor(object):
 
     @classmethod
     def teardown_class(cls):
-        pass
+        cls.close_http_clients()
+        cls.report_command_timings()
+
+    @classmethod
+    def report_command_timings(cls):
+        if not cls.command_timings:
+            return
+        cls.logger.info("Command timings (slowest first):")
+        for timing in sorted(cls.command_timings, key=lambda x: x["duration"], reverse=True):
+            cls.logger.info("{duration:8.2f}s rc={rc} timed_out={timed_out} {command}".format(**timing))
+        # Appended line by line, so that concurrent pytest-xdist workers can share the report
+        try:
+            with open(cls.COMMAND_TIMINGS_FILE, "a") as f:
+                for timing in cls.command_timings:
+                    f.write(json.dumps(timing) + "\n")
+        except (IOError, OSError) as e:
+            cls.logger.error("Unable to write command timings: {}".format(e))
+        cls.command_timings = []
+
+    @classmethod
+    def close_http_clients(cls):
+        for base_url, client in cls.http_clients.items():
+            for endpoint, stats in sorted(client.stats().items()):
+                cls.logger.info("HTTP {}{}: {count} calls, {mean:.3f}s mean, {max:.3f}s max".format(base_url, endpoint, **stats))
+            client.close()
+        cls.http_clients.clear()
+
+    def get_http_client(self, url):
+        '''
+        Return the pooled client for the scheme/host/port of `url` - one per container port, shared across calls
+        '''
+        parts = urlsplit(url)
+        base_url = "{}://{}".format(parts.scheme, parts.netloc)
+        # Probes of the verification runner look clients up from worker threads
+        with self.http_clients_lock:
+            if base_url not in self.http_clients:
+                self.http_clients[base_url] = KhulnasoftdClient(base_url, logger=self.logger, pool_size=self.HTTP_POOL_SIZE,
+                                                                retry_count=self.RETRY_COUNT, retry_delay=self.RETRY_DELAY)
+            return self.http_clients[base_url]
+
+    def verify(self, probes):
+        return VerificationRunner(self.logger, self.VERIFY_CONCURRENCY).run(probes)
+
+    def khulnasoftd_client(self, container_id, scheme="https"):
+        khulnasoftd_port = self.client.port(container_id, 8089)[0]["HostPort"]
+        return self.get_http_client("{}://localhost:{}".format(scheme, khulnasoftd_port))
 
     @staticmethod
     def generate_random_string():
         return ''.join(choice(ascii_lowercase) for b in range(10))
 
     def handle_request_retry(self, method, url, kwargs):
-        for n in range(Executor.RETRY_COUNT):
-            try:
-                self.logger.info("Attempt #{}: running {} against {} with kwargs {}".format(n+1, method, url, kwargs))
-                resp = requests.request(method, url, **kwargs)
-                resp.raise_for_status()
-                return resp.status_code, resp.content
-            except Exception as e:
-                self.logger.error("Attempt #{} error: {}".format(n+1, str(e)))
-                if n < Executor.RETRY_COUNT-1:
-                    time.sleep(Executor.RETRY_DELAY)
-                    continue
-                raise e
+        return self.get_http_client(url).request_with_retry(method, url, **kwargs)
 
-    def get_container_logs(self, container_id):
-        stream = self.client.logs(container_id, stream=True)
-        output = ""
-        for char in stream:
-            if "Ansible playbook complete" in char:
-                break
-            output += char
-        return output
+    def stream_container_logs(self, container_id, **kwargs):
+        return LogStream(self.client, container_id, **kwargs)
+
+    def get_container_logs(self, container_id, marker=READY_MARKER, pattern=None, max_bytes=MAX_LOG_BYTES):
+        '''
+        Return the container's output up to (excluding) the first line containing `marker` or matching `pattern`;
+        at most `max_bytes` of the most recent output are kept
+        '''
+        stream = self.stream_container_logs(container_id, max_bytes=max_bytes)
+        try:
+            stream.read_until(marker, pattern)
+            return stream.getvalue()
+        finally:
+            stream.close()
 
     def cleanup_files(self, files):
         try:
@@ -116,6 +905,8 @@ class Executor(object):
             raise e
 
     def _clean_docker_env(self):
+        # Host ports get recycled between tests, so never keep connections to removed containers around
+        self.close_http_clients()
         # Remove anything spun up by docker-compose
         containers = self.client.containers(filters={"label": "com.docker.compose.project={}".format(self.project_name)})
         for container in containers:
@@ -130,38 +921,22 @@ class Executor(object):
         '''
         NOTE: This helper method can only be used for `compose up` scenarios where self.project_name is defined
         '''
-        start = time.time()
-        end = start
-        # Wait
-        while end-start < timeout:
-            filters = {}
-            if name:
-                filters["name"] = name
-            if label:
-                filters["label"] = label
+        filters = {}
+        if name:
+            filters["name"] = name
+        if label:
+            filters["label"] = label
+        watcher = ReadinessWatcher(self.client, self.logger)
+        try:
+            # Label filters are shared with the events API; names are matched differently there, so rely on the IDs below
+            watcher.subscribe({"label": label} if label else None)
             containers = self.client.containers(filters=filters)
             self.logger.info("Found {} containers, expected {}: {}".format(len(containers), count, [x["Names"][0] for x in containers]))
             if len(containers) != count:
                 return False
-            healthy_count = 0
-            for container in containers:
-                # The healthcheck on our Khulnasoft image is not reliable - resorting to checking logs
-                if container.get("Labels", {}).get("maintainer") == "support@khulnasoft.com":
-                    output = self.client.logs(container["Id"], tail=5)
-                    if "unable to" in output or "denied" in output or "khulnasoftd.pid file is unreadable" in output:
-                        self.logger.error("Container {} did not start properly, last log line: {}".format(container["Names"][0], output))
-                    elif "Ansible playbook complete" in output:
-                        self.logger.info("Container {} is ready".format(container["Names"][0]))
-                        healthy_count += 1
-                else:
-                    self.logger.info("Container {} is ready".format(container["Names"][0]))
-                    healthy_count += 1
-            if healthy_count == count:
-                self.logger.info("All containers ready to proceed")
-                break
-            time.sleep(5)
-            end = time.time()
-        return True
+            return watcher.wait(containers, timeout)
+        finally:
+            watcher.close()
 
     def check_khulnasoftd(self, username, password, name=None, scheme="https"):
         '''
@@ -173,57 +948,45 @@ class Executor(object):
         if self.project_name:
             filters["label"] = "com.docker.compose.project={}".format(self.project_name)
         containers = self.client.containers(filters=filters)
+        result = self.verify(self.khulnasoftd_probes(containers, username, password, scheme))
+        assert result.passed, result.summary()
+        return True
+
+    def khulnasoftd_probes(self, containers, username, password, scheme="https"):
+        probes = []
         for container in containers:
             # We can't check khulnasoftd on non-Khulnasoft containers
-            if "maintainer" not in container["Labels"] or container["Labels"]["maintainer"] != "support@khulnasoft.com":
+            if "maintainer" not in container["Labels"] or container["Labels"]["maintainer"] != KHULNASOFT_MAINTAINER:
                 continue
-            khulnasoftd_port = self.client.port(container["Id"], 8089)[0]["HostPort"]
-            url = "{}://localhost:{}/services/server/info".format(scheme, khulnasoftd_port)
-            kwargs = {"auth": (username, password), "verify": False}
-            status, content = self.handle_request_retry("GET", url, kwargs)
+            client = self.khulnasoftd_client(container["Id"], scheme)
+            probes.append((container["Names"][0].strip("/"), self._khulnasoftd_probe(client, username, password)))
+        return probes
+
+    def _khulnasoftd_probe(self, client, username, password):
+        def probe():
+            status, content = client.request_with_retry("GET", "/services/server/info", auth=(username, password))
             assert status == 200
-        return True
+        return probe
+
+    def run_search(self, container_id, query, username="admin", password="password", timeout=SearchJob.TIMEOUT):
+        '''
+        Create a search job and wait for it to complete - iterate over `job.iter_results()` to page through the results
+        '''
+        job = SearchJob(self.khulnasoftd_client(container_id), query, auth=(username, password), logger=self.logger)
+        self.logger.info("Search job {} created against on {}".format(job.sid, container_id))
+        job.wait(timeout)
+        return job
 
     def _run_khulnasoft_query(self, container_id, query, username="admin", password="password"):
-        khulnasoftd_port = self.client.port(container_id, 8089)[0]["HostPort"]
-        url = "https://localhost:{}/services/search/jobs?output_mode=json".format(khulnasoftd_port)
-        kwargs = {
-                    "auth": (username, password),
-                    "data": "search={}".format(urllib.quote_plus(query)),
-                    "verify": False
-                }
-        resp = requests.post(url, **kwargs)
-        assert resp.status_code == 201
-        sid = json.loads(resp.content)["sid"]
-        assert sid
-        self.logger.info("Search job {} created against on {}".format(sid, container_id))
-        # Wait for search to finish
-        job_status = None
-        url = "https://localhost:{}/services/search/jobs/{}?output_mode=json".format(khulnasoftd_port, sid)
-        kwargs = {
-                    "auth": (username, password), 
-                    "verify": False
-                }
-        for _ in range(10):
-            job_status = requests.get(url, **kwargs)
-            done = json.loads(job_status.content)["entry"][0]["content"]["isDone"]
-            self.logger.info("Search job {} done status is {}".format(sid, done))
-            if done:
-                break
-            time.sleep(3)
-        assert job_status and job_status.status_code == 200
-        # Get job metadata
-        job_metadata = json.loads(job_status.content)
-        # Check search results
-        url = "https://localhost:{}/services/search/jobs/{}/results?output_mode=json".format(khulnasoftd_port, sid)
-        job_results = requests.get(url, **kwargs)
-        assert job_results.status_code == 200
-        job_results = json.loads(job_results.content)
-        return job_metadata, job_results
-
-    def compose_up(self, defaults_url=None, apps_url=None):
+        job = self.run_search(container_id, query, username, password)
+        return job.metadata, {"results": list(job.iter_results())}
+
+    def compose_up(self, defaults_url=None, apps_url=None, override=None):
         container_count = self.get_number_of_containers(os.path.join(self.SCENARIOS_DIR, self.compose_file_name))
         command = "docker-compose -p {} -f test_scenarios/{} up -d".format(self.project_name, self.compose_file_name)
+        if override:
+            # Layered on top of the scenario, ex. to change how its services get started
+            command = command.replace(" up -d", " -f {} up -d".format(override))
         out, err, rc = self._run_command(command, defaults_url, apps_url)
         return container_count, rc
 
@@ -243,6 +1006,18 @@ class Executor(object):
             self.logger.error(e)
             return None
 
+    def extract_ansible_profile(self, container_name):
+        '''
+        Return the per-task timings recorded by containers started with KHULNASOFT_ANSIBLE_PROFILE=true, or None
+        '''
+        exec_command = self.client.exec_create(container_name, "cat /opt/container_artifact/ansible_profile.json")
+        output = self.client.exec_start(exec_command)
+        try:
+            return json.loads(output)
+        except ValueError:
+            self.logger.error("No Ansible profile found in {}: {}".format(container_name, output))
+            return None
+
     def get_number_of_containers(self, filename):
         yml = {}
         with open(filename, "r") as f:
@@ -251,16 +1026,36 @@ class Executor(object):
 
     def search_internal_distinct_hosts(self, container_id, username="admin", password="password"):
         query = "search index=_internal earliest=-1m | stats dc(host) as distinct_hosts"
-        meta, results = self._run_khulnasoft_query(container_id, query, username, password)
-        search_providers = meta["entry"][0]["content"]["searchProviders"]
-        distinct_hosts = int(results["results"][0]["distinct_hosts"])
+        job = self.run_search(container_id, query, username, password)
+        search_providers = job.content["searchProviders"]
+        distinct_hosts = int(next(job.iter_results(page_size=1))["distinct_hosts"])
         return search_providers, distinct_hosts
 
-    def _run_command(self, command, defaults_url=None, apps_url=None):
+    def _pipe_reader(self, pipe, lines, label):
+        # Each pipe is drained on its own thread, so a chatty stderr can never block a process waiting on stdout
+        for line in iter(pipe.readline, ""):
+            lines.append(line)
+            self.logger.info("{}: {}".format(label, line.rstrip("\n")))
+        pipe.close()
+
+    def _kill_process_group(self, proc):
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except OSError:
+                return
+            deadline = time.time() + self.COMMAND_KILL_GRACE
+            while proc.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if proc.poll() is not None:
+                return
+
+    def _run_command(self, command, defaults_url=None, apps_url=None, timeout=None):
         if isinstance(command, list):
             sh = command
         elif isinstance(command, str):
             sh = shlex.split(command)
+        timeout = timeout or self.COMMAND_TIMEOUT
         self.logger.info("CALL: %s" % sh)
         env = os.environ.copy()
         env["KHULNASOFT_PASSWORD"] = self.password
@@ -270,21 +1065,33 @@ class Executor(object):
             env["KHULNASOFT_DEFAULTS_URL"] = defaults_url
         if apps_url:
             env["KHULNASOFT_APPS_URL"] = apps_url
-        proc = subprocess.Popen(sh, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        start = time.time()
+        # Run in a new session so that a timeout can take down docker-compose along with everything it spawned
+        proc = subprocess.Popen(sh, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                                universal_newlines=True, preexec_fn=os.setsid)
         lines = []
         err_lines = []
-        for line in iter(proc.stdout.readline, ''):
-            lines.append(line)
-        for line in iter(proc.stderr.readline, ''):
-            err_lines.append(line)
-        proc.stdout.close()
-        proc.stderr.close()
+        readers = [threading.Thread(target=self._pipe_reader, args=(proc.stdout, lines, "STDOUT")),
+                   threading.Thread(target=self._pipe_reader, args=(proc.stderr, err_lines, "STDERR"))]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+        timed_out = False
+        while proc.poll() is None:
+            if time.time() - start > timeout:
+                self.logger.error("Command timed out after {}s, killing process group: {}".format(timeout, sh))
+                timed_out = True
+                self._kill_process_group(proc)
+                break
+            time.sleep(0.1)
+        for reader in readers:
+            reader.join(self.COMMAND_KILL_GRACE)
         proc.wait()
+        duration = time.time() - start
+        self.command_timings.append({"command": " ".join(sh), "duration": duration, "rc": proc.returncode, "timed_out": timed_out})
         out = "".join(lines)
-        self.logger.info("STDOUT: %s" % out)
         err = "".join(err_lines)
-        self.logger.info("STDERR: %s" % err)
-        self.logger.info("RC: %s" % proc.returncode)
+        self.logger.info("RC: %s (%.2fs)" % (proc.returncode, duration))
         return out, err, proc.returncode
 
     def check_common_keys(self, log_output, role):
@@ -325,58 +1132,76 @@ class Executor(object):
             assert False
 
     def check_ansible(self, output):
-        assert "ansible-playbook" in output
-        assert "config file = /opt/ansible/ansible.cfg" in output
+        expected = ("ansible-playbook", "config file = /opt/ansible/ansible.cfg")
+        if isinstance(output, LogStream):
+            try:
+                missing = output.expect(*expected)
+            finally:
+                output.close()
+            assert not missing, "Not found in logs of {}: {}".format(output.container_id, sorted(missing))
+        else:
+            for text in expected:
+                assert text in output
 
     def check_dmc(self, containers, num_peers, num_idx, num_sh, num_cm, num_lm):
+        probes = []
         for container in containers:
             container_name = container["Names"][0].strip("/")
-            khulnasoftd_port = self.client.port(container["Id"], 8089)[0]["HostPort"]
             if container_name == "dmc":
-                # check 1: curl -k https://localhost:8089/servicesNS/nobody/khulnasoft_monitoring_console/configs/conf-khulnasoft_monitoring_console_assets/settings?output_mode=json -u admin:helloworld
-                status, content = self.handle_request_retry("GET", "https://localhost:{}/servicesNS/nobody/khulnasoft_monitoring_console/configs/conf-khulnasoft_monitoring_console_assets/settings?output_mode=json".format(khulnasoftd_port), 
-                                                            {"auth": ("admin", self.password), "verify": False})
-                assert status == 200
-                output = json.loads(content)
-                assert output["entry"][0]["content"]["disabled"] == False
-                # check 2: curl -k https://localhost:8089/servicesNS/nobody/system/apps/local/khulnasoft_monitoring_console?output_mode=json -u admin:helloworld
-                status, content = self.handle_request_retry("GET", "https://localhost:{}/servicesNS/nobody/system/apps/local/khulnasoft_monitoring_console?output_mode=json".format(khulnasoftd_port), 
-                                                            {"auth": ("admin", self.password), "verify": False})
+                probes.extend(self.dmc_probes(container, num_peers, num_idx, num_sh, num_cm, num_lm))
+        result = self.verify(probes)
+        assert result.passed, result.summary()
+
+    def dmc_probes(self, container, num_peers, num_idx, num_sh, num_cm, num_lm):
+        container_name = container["Names"][0].strip("/")
+        khulnasoftd_port = self.client.port(container["Id"], 8089)[0]["HostPort"]
+        client = self.get_http_client("https://localhost:{}".format(khulnasoftd_port))
+        auth = ("admin", self.password)
+
+        def check_enabled(path):
+            def probe():
+                status, content = client.request_with_retry("GET", path, auth=auth)
                 assert status == 200
                 output = json.loads(content)
                 assert output["entry"][0]["content"]["disabled"] == False
-                # check 3: curl -k https://localhost:8089/services/search/distributed/peers?output_mode=json -u admin:helloworld
-                status, content = self.handle_request_retry("GET", "https://localhost:{}/services/search/distributed/peers?output_mode=json".format(khulnasoftd_port),
-                                                            {"auth": ("admin", self.password), "verify": False})
-                assert status == 200
-                output = json.loads(content)
-                assert num_peers == len(output["entry"])
-                for peer in output["entry"]:
-                    assert peer["content"]["status"] == "Up"
-                self.check_dmc_groups(khulnasoftd_port, num_idx, num_sh, num_cm, num_lm)
+            return probe
+
+        def check_peers():
+            status, content = client.request_with_retry("GET", "/services/search/distributed/peers?output_mode=json", auth=auth)
+            assert status == 200
+            output = json.loads(content)
+            assert num_peers == len(output["entry"])
+            for peer in output["entry"]:
+                assert peer["content"]["status"] == "Up"
+
+        probes = [
+            # check 1: curl -k https://localhost:8089/servicesNS/nobody/khulnasoft_monitoring_console/configs/conf-khulnasoft_monitoring_console_assets/settings?output_mode=json -u admin:helloworld
+            ("{}:settings".format(container_name), check_enabled("/servicesNS/nobody/khulnasoft_monitoring_console/configs/conf-khulnasoft_monitoring_console_assets/settings?output_mode=json")),
+            # check 2: curl -k https://localhost:8089/servicesNS/nobody/system/apps/local/khulnasoft_monitoring_console?output_mode=json -u admin:helloworld
+            ("{}:app".format(container_name), check_enabled("/servicesNS/nobody/system/apps/local/khulnasoft_monitoring_console?output_mode=json")),
+            # check 3: curl -k https://localhost:8089/services/search/distributed/peers?output_mode=json -u admin:helloworld
+            ("{}:peers".format(container_name), check_peers)
+        ]
+        return probes + self.dmc_group_probes(khulnasoftd_port, num_idx, num_sh, num_cm, num_lm, prefix=container_name)
 
     def check_dmc_groups(self, khulnasoftd_port, num_idx, num_sh, num_cm, num_lm):
-        # check dmc_group_indexer
-        status, content = self.handle_request_retry("GET", "https://localhost:{}/services/search/distributed/groups/dmc_group_indexer?output_mode=json".format(khulnasoftd_port), 
-                                                    {"auth": ("admin", self.password), "verify": False})
-        assert status == 200
-        output = json.loads(content)
-        assert len(output["entry"][0]["content"]["member"]) == num_idx
-        # check dmc_group_cluster_master
-        status, content = self.handle_request_retry("GET", "https://localhost:{}/services/search/distributed/groups/dmc_group_cluster_master?output_mode=json".format(khulnasoftd_port), 
-                                                    {"auth": ("admin", self.password), "verify": False})
-        assert status == 200
-        output = json.loads(content)
-        assert len(output["entry"][0]["content"]["member"]) == num_cm
-        # check dmc_group_license_master
-        status, content = self.handle_request_retry("GET", "https://localhost:{}/services/search/distributed/groups/dmc_group_license_master?output_mode=json".format(khulnasoftd_port), 
-                                                    {"auth": ("admin", self.password), "verify": False})
-        assert status == 200
-        output = json.loads(content)
-        assert len(output["entry"][0]["content"]["member"]) == num_lm
-        # check dmc_group_search_head
-        status, content = self.handle_request_retry("GET", "https://localhost:{}/services/search/distributed/groups/dmc_group_search_head?output_mode=json".format(khulnasoftd_port), 
-                                                    {"auth": ("admin", self.password), "verify": False})
-        assert status == 200
-        output = json.loads(content)
-        assert len(output["entry"][0]["content"]["member"]) == num_sh
+        result = self.verify(self.dmc_group_probes(khulnasoftd_port, num_idx, num_sh, num_cm, num_lm))
+        assert result.passed, result.summary()
+
+    def dmc_group_probes(self, khulnasoftd_port, num_idx, num_sh, num_cm, num_lm, prefix="dmc"):
+        client = self.get_http_client("https://localhost:{}".format(khulnasoftd_port))
+        expected_members = [
+            ("dmc_group_indexer", num_idx),
+            ("dmc_group_cluster_master", num_cm),
+            ("dmc_group_license_master", num_lm),
+            ("dmc_group_search_head", num_sh)
+        ]
+
+        def check_group(group, num_members):
+            def probe():
+                status, content = client.request_with_retry("GET", "/services/search/distributed/groups/{}?output_mode=json".format(group), auth=("admin", self.password))
+                assert status == 200
+                output = json.loads(content)
+                assert len(output["entry"][0]["content"]["member"]) == num_members
+            return probe
+        return [("{}:{}".format(prefix, group), check_group(group, num_members)) for group, num_members in expected_members]
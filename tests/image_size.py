@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import sys
+import json
+import argparse
+from layer_audit import read_image, open_image
+
+
+# Installation directories broken down one level deeper than the top-level directories
+PRODUCT_HOMES = ("opt/khulnasoft", "opt/khulnasoft-etc", "opt/khulnasoftforwarder", "opt/khulnasoftforwarder-etc", "opt/ansible")
+DEFAULT_TOP = 20
+
+
+def directory(path):
+    '''
+    Directory `path` is accounted to - its top-level directory, or the directory right under a product home
+    '''
+    for home in PRODUCT_HOMES:
+        if path.startswith(home + "/"):
+            return "/" + "/".join(path.split("/")[:home.count("/") + 2])
+    return "/" + path.split("/")[0] if "/" in path else "/"
+
+
+def analyze(image, top=DEFAULT_TOP):
+    '''
+    Return the size report of `image`, a local image or a `docker save` archive - bytes are uncompressed file contents,
+    counted in every layer they are stored in, since that is what a pull transfers
+    '''
+    stream, proc = open_image(image)
+    try:
+        saved = read_image(stream)[0]
+    finally:
+        stream.close()
+    if proc and proc.wait() != 0:
+        raise RuntimeError("docker save {} failed with exit code {}".format(image, proc.returncode))
+    final = {}
+    stored = {}
+    layers = []
+    directories = {}
+    for index, (layer, instruction) in enumerate(zip(saved["layers"], saved["history"])):
+        for path in layer["deleted"]:
+            prefix = path if path.endswith("/") else path + "/"
+            for x in [x for x in final if x == path or x.startswith(prefix)]:
+                del final[x]
+        for path, size in layer["files"].items():
+            final[path] = (size, index)
+            stored.setdefault(path, []).append((index, size))
+            key = directory(path)
+            directories[key] = directories.get(key, 0) + size
+        layers.append({"index": index, "instruction": instruction, "bytes": layer["size"], "files": len(layer["files"])})
+    total = sum(x["bytes"] for x in layers)
+    kept = sum(size for size, _ in final.values())
+    duplicates = []
+    for path, copies in stored.items():
+        if len(copies) > 1:
+            # Every copy but the one the container sees is dead weight
+            wasted = sum(size for _, size in copies) - (final[path][0] if path in final else 0)
+            duplicates.append({"path": "/" + path, "layers": [x for x, _ in copies], "wasted_bytes": wasted})
+    duplicates.sort(key=lambda x: (-x["wasted_bytes"], x["path"]))
+    largest = sorted(({"path": "/" + path, "bytes": size, "layer": index} for path, (size, index) in final.items()),
+                     key=lambda x: (-x["bytes"], x["path"]))
+    return {
+        "image": image,
+        "tags": saved["tags"],
+        "total_bytes": total,
+        "filesystem_bytes": kept,
+        # Stored in a layer, but deleted or replaced by a higher one
+        "shadowed_bytes": total - kept,
+        "layers": layers,
+        "directories": directories,
+        "duplicates": duplicates[:top],
+        "duplicated_paths": len(duplicates),
+        "largest_files": largest[:top],
+        "files": dict(("/" + path, size) for path, (size, _) in final.items())
+    }
+
+
+def delta(old, new):
+    return {"old": old, "new": new, "delta": new - old}
+
+
+def diff(old, new, top=DEFAULT_TOP):
+    '''
+    Return what changed from the `old` report to the `new` one - layers are matched by their instruction, since
+    their digests change on every build
+    '''
+    result = {
+        "old": old["image"],
+        "new": new["image"],
+        "total_bytes": delta(old["total_bytes"], new["total_bytes"]),
+        "filesystem_bytes": delta(old["filesystem_bytes"], new["filesystem_bytes"]),
+        "shadowed_bytes": delta(old["shadowed_bytes"], new["shadowed_bytes"]),
+        "layers": [],
+        "directories": {}
+    }
+    remaining = list(old["layers"])
+    for layer in new["layers"]:
+        match = [x for x in remaining if x["instruction"] == layer["instruction"]]
+        previous = match[0]["bytes"] if match else 0
+        if match:
+            remaining.remove(match[0])
+        if layer["bytes"] != previous:
+            result["layers"].append(dict(delta(previous, layer["bytes"]), instruction=layer["instruction"], index=layer["index"]))
+    for layer in remaining:
+        result["layers"].append(dict(delta(layer["bytes"], 0), instruction=layer["instruction"], index=None))
+    for key in set(old["directories"]) | set(new["directories"]):
+        change = delta(old["directories"].get(key, 0), new["directories"].get(key, 0))
+        if change["delta"]:
+            result["directories"][key] = change
+    files = []
+    for path in set(old["files"]) | set(new["files"]):
+        change = delta(old["files"].get(path, 0), new["files"].get(path, 0))
+        if change["delta"] or (path in old["files"]) != (path in new["files"]):
+            change["path"] = path
+            change["status"] = "added" if path not in old["files"] else "removed" if path not in new["files"] else "changed"
+            files.append(change)
+    files.sort(key=lambda x: (-abs(x["delta"]), x["path"]))
+    result["files"] = files[:top]
+    result["changed_files"] = len(files)
+    return result
+
+
+def mb(value):
+    return "{:.1f} MB".format(value / 1048576.0)
+
+
+def print_report(report):
+    print("{}: {} in {} layers, {} on the filesystem, {} shadowed".format(", ".join(report["tags"]) or report["image"],
+          mb(report["total_bytes"]), len(report["layers"]), mb(report["filesystem_bytes"]), mb(report["shadowed_bytes"])))
+    print("  Layers")
+    for layer in report["layers"]:
+        print("    {:>3} {:>10} {:>7} files  {}".format(layer["index"], mb(layer["bytes"]), layer["files"], layer["instruction"][:100]))
+    print("  Directories")
+    for key, size in sorted(report["directories"].items(), key=lambda x: (-x[1], x[0])):
+        print("    {:>10}  {}".format(mb(size), key))
+    print("  Duplicated paths ({} in total)".format(report["duplicated_paths"]))
+    for duplicate in report["duplicates"]:
+        print("    {:>10}  {}  (layers {})".format(mb(duplicate["wasted_bytes"]), duplicate["path"], ", ".join(str(x) for x in duplicate["layers"])))
+    print("  Largest files")
+    for largest in report["largest_files"]:
+        print("    {:>10}  {}  (layer {})".format(mb(largest["bytes"]), largest["path"], largest["layer"]))
+
+
+def print_diff(result):
+    signed = lambda x: "{:+.1f} MB".format(x / 1048576.0)
+    print("{} -> {}: {} in total, {} on the filesystem, {} shadowed".format(result["old"], result["new"], signed(result["total_bytes"]["delta"]),
+          signed(result["filesystem_bytes"]["delta"]), signed(result["shadowed_bytes"]["delta"])))
+    print("  Layers")
+    for layer in result["layers"]:
+        print("    {:>11}  {}".format(signed(layer["delta"]), layer["instruction"][:100]))
+    print("  Directories")
+    for key, change in sorted(result["directories"].items(), key=lambda x: (-abs(x[1]["delta"]), x[0])):
+        print("    {:>11}  {}".format(signed(change["delta"]), key))
+    print("  Files ({} changed in total)".format(result["changed_files"]))
+    for change in result["files"]:
+        print("    {:>11}  {:<8} {}".format(signed(change["delta"]), change["status"], change["path"]))
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--top", type=int, default=DEFAULT_TOP, help="Duplicated paths, files and changes listed (default: {})".format(DEFAULT_TOP))
+    common.add_argument("--json", help="Also write the report or the diff as JSON to this file, - for stdout only")
+    parser = argparse.ArgumentParser(description="Attribute the bytes of an image to its layers, directories and files, or diff two images")
+    subparsers = parser.add_subparsers(dest="command")
+    report_parser = subparsers.add_parser("report", parents=[common], help="Report the sizes of an image")
+    report_parser.add_argument("image", help="Local image, or archive written by `docker save` (gzipped or not)")
+    diff_parser = subparsers.add_parser("diff", parents=[common], help="Report what changed between two versions of an image")
+    diff_parser.add_argument("old", help="Local image, or archive written by `docker save` (gzipped or not)")
+    diff_parser.add_argument("new", help="Local image, or archive written by `docker save` (gzipped or not)")
+    args = parser.parse_args()
+    if args.command == "report":
+        result = analyze(args.image, args.top)
+        output = dict((k, v) for k, v in result.items() if k != "files")
+    elif args.command == "diff":
+        result = diff(analyze(args.old), analyze(args.new), args.top)
+        output = result
+    else:
+        parser.print_usage()
+        return 2
+    if args.json == "-":
+        print(json.dumps(output, indent=2, sort_keys=True))
+        return 0
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    (print_report if args.command == "report" else print_diff)(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import io
+import os
+import sys
+import json
+import tarfile
+import argparse
+import subprocess
+
+
+DEFAULT_MAX_REWRITE_MB = 10
+# Blobs of an OCI layout that are this small may be a config or a manifest rather than a layer
+JSON_BLOB_LIMIT = 1024 * 1024
+WHITEOUT_PREFIX = ".wh."
+OPAQUE_WHITEOUT = ".wh..wh..opq"
+TOP_FILES = 10 # rewritten files listed for a layer over the limit
+
+
+def normalize(name):
+    name = os.path.normpath(name)
+    return "" if name == "." else name.lstrip("/")
+
+
+def read_layer(fileobj):
+    '''
+    Return ({path: size} of the files of a layer tarball, [paths it deletes]) - a deleted directory's path ends with "/"
+    when only its previous contents are deleted (opaque whiteout)
+    '''
+    files = {}
+    deleted = []
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+        for member in tar:
+            name = normalize(member.name)
+            dirname, basename = os.path.split(name)
+            if basename == OPAQUE_WHITEOUT:
+                deleted.append(dirname + "/")
+            elif basename.startswith(WHITEOUT_PREFIX):
+                deleted.append(os.path.join(dirname, basename[len(WHITEOUT_PREFIX):]))
+            elif member.isfile() or member.islnk():
+                files[name] = member.size
+    return files, deleted
+
+
+def read_image(fileobj):
+    '''
+    Stream through a `docker save` archive, legacy or OCI layout, and return the images it holds as
+    [{"tags", "history", "layers"}] - layers are listed lowest first as {"name", "files", "deleted", "size"}, and
+    nothing gets extracted to disk
+    '''
+    layers = {}
+    links = {}
+    documents = {}
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            name = normalize(member.name)
+            if member.issym():
+                # Legacy archives store a layer shared by several images once, and link to it
+                links[name] = normalize(os.path.join(os.path.dirname(name), member.linkname))
+                continue
+            if not member.isfile():
+                continue
+            blob = name.startswith("blobs/")
+            if name.endswith(".json") or (blob and member.size <= JSON_BLOB_LIMIT):
+                content = archive.extractfile(member).read()
+                try:
+                    documents[name] = json.loads(content.decode("utf-8"))
+                    continue
+                except ValueError:
+                    if not blob:
+                        continue
+                fileobj = io.BytesIO(content)
+            elif blob or name.endswith("/layer.tar"):
+                fileobj = archive.extractfile(member)
+            else:
+                continue
+            files, deleted = read_layer(fileobj)
+            layers[name] = {"name": name, "files": files, "deleted": deleted, "size": sum(files.values())}
+    if "manifest.json" not in documents:
+        raise ValueError("Not a docker save archive, manifest.json is missing")
+    images = []
+    for manifest in documents["manifest.json"]:
+        config = documents.get(normalize(manifest["Config"]), {})
+        # Instructions that only change the config, like ENV or USER, have no layer of their own
+        history = [x.get("created_by", "") for x in config.get("history", []) if not x.get("empty_layer")]
+        names = [links.get(normalize(x), normalize(x)) for x in manifest["Layers"]]
+        images.append({
+            "tags": manifest.get("RepoTags") or [],
+            "history": history if len(history) == len(names) else [""] * len(names),
+            "layers": [layers[x] for x in names]
+        })
+    return images
+
+
+def rewrites(layers):
+    '''
+    Return, for every layer, the [(path, size)] of its files that a lower layer already had - a permission or
+    ownership change copies a whole file into the layer that makes it
+    '''
+    present = set()
+    result = []
+    for layer in layers:
+        for path in layer["deleted"]:
+            prefix = path if path.endswith("/") else path + "/"
+            present = set(x for x in present if x != path and not x.startswith(prefix))
+        result.append(sorted(((x, size) for x, size in layer["files"].items() if x in present), key=lambda x: -x[1]))
+        present.update(layer["files"])
+    return result
+
+
+def open_image(image):
+    '''
+    Return a stream of `image`, either a (gzipped) `docker save` archive or the name of a local image
+    '''
+    if os.path.isfile(image):
+        return open(image, "rb"), None
+    proc = subprocess.Popen(["docker", "save", image], stdout=subprocess.PIPE)
+    return proc.stdout, proc
+
+
+def layer_count(image):
+    output = subprocess.check_output(["docker", "image", "inspect", "--format", "{{len .RootFS.Layers}}", image])
+    return int(output.decode("utf-8").strip())
+
+
+def audit(image, max_rewrite, skip=0):
+    '''
+    Print the size of each layer of `image` and the bytes it rewrites, and return the number of layers above the
+    first `skip` ones that rewrite more than `max_rewrite` bytes
+    '''
+    stream, proc = open_image(image)
+    try:
+        images = read_image(stream)
+    finally:
+        stream.close()
+    if proc and proc.wait() != 0:
+        raise RuntimeError("docker save {} failed with exit code {}".format(image, proc.returncode))
+    failures = 0
+    for saved in images:
+        layers = saved["layers"]
+        print("{}: {} layers, {:.1f} MB".format(", ".join(saved["tags"]) or image, len(layers), sum(x["size"] for x in layers) / 1048576.0))
+        print("    {:>5} {:>10} {:>12}  {}".format("layer", "size", "rewritten", "instruction"))
+        for index, (layer, rewritten, instruction) in enumerate(zip(layers, rewrites(layers), saved["history"])):
+            rewritten_bytes = sum(size for _, size in rewritten)
+            over = index >= skip and rewritten_bytes > max_rewrite
+            print("    {:>5} {:>7.1f} MB {:>9.1f} MB  {}{}".format(index, layer["size"] / 1048576.0, rewritten_bytes / 1048576.0,
+                                                               instruction[:100], "  <- over the limit" if over else ""))
+            if over:
+                failures += 1
+                for path, size in rewritten[:TOP_FILES]:
+                    print("          {:>7.1f} MB  /{}".format(size / 1048576.0, path))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when a layer of an image rewrites files that a lower layer already holds, as recursive chown/chmod do")
+    parser.add_argument("images", nargs="+", help="Local images, or archives written by `docker save` (gzipped or not)")
+    parser.add_argument("--max-rewrite-mb", type=float, default=DEFAULT_MAX_REWRITE_MB,
+                        help="Bytes a single layer may rewrite, in MB (default: {})".format(DEFAULT_MAX_REWRITE_MB))
+    parser.add_argument("--since", help="Only check the layers on top of this local image, ex. the base image the audited ones are built from")
+    args = parser.parse_args()
+    skip = layer_count(args.since) if args.since else 0
+    failures = 0
+    for image in args.images:
+        failures += audit(image, args.max_rewrite_mb * 1048576, skip)
+    if failures:
+        print("{} layer(s) rewrite more than {} MB of files from lower layers - set permissions and ownership when copying instead".format(failures, args.max_rewrite_mb))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
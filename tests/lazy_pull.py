@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import sys
+import json
+import time
+import shlex
+import argparse
+import subprocess
+import docker
+from executor import Executor, LOGGER, FILE_DIR, READY_MARKER
+from benchmark import median
+from trace_minimal import MinimalTracer, TRACES_DIR, trace_paths
+from rebuild_benchmark import Registry
+import image_size
+
+
+RESULTS_DIR = os.path.join(FILE_DIR, "..", "test-results", "benchmarks")
+RECORDS_DIR = os.path.join(FILE_DIR, "..", "test-results", "lazy-pull")
+FORMATS = ("gzip", "zstd", "estargz")
+# `nerdctl image convert` flags of each variant - the gzip one is what `docker push` sends as is
+CONVERT_FLAGS = {"zstd": ["--zstd", "--oci"], "estargz": ["--estargz", "--oci"]}
+# eStargz layers only get fetched lazily when the stargz snapshotter mounts them
+SNAPSHOTTERS = {"gzip": "overlayfs", "zstd": "overlayfs", "estargz": "stargz"}
+DEFAULT_NERDCTL = "nerdctl"
+
+
+def split_image(image):
+    name, _, tag = image.partition(":")
+    return name, tag or "latest"
+
+
+def record_file(image):
+    return os.path.join(RECORDS_DIR, "{}_{}.record.json".format(*split_image(image)))
+
+
+def prioritized_files(paths, files):
+    '''
+    Return the files of the image among the accessed `paths`, once each and in the order they were first accessed
+    '''
+    seen = set()
+    result = []
+    for path in paths:
+        if path in files and path not in seen:
+            seen.add(path)
+            result.append(path)
+    return result
+
+
+def write_record(filename, paths):
+    # Same format as `ctr-remote image optimize --record-out`, which `nerdctl image convert --estargz-record-in` reads
+    with open(filename, "w") as f:
+        for path in paths:
+            f.write(json.dumps({"path": path.lstrip("/")}) + "\n")
+
+
+class StartRecorder(Executor):
+    '''
+    Runs `entrypoint.sh start` of an image under strace, and records which files of the image it opened until the
+    container was ready - eStargz puts them first, so that a lazy pull fetches them up front in one go
+    '''
+
+    READY_TIMEOUT = 1200 # in seconds, tracing slows provisioning down considerably
+    TRACE_FILE = "start.trace"
+
+    @classmethod
+    def setup_class(cls, platform, strace):
+        super(StartRecorder, cls).setup_class(platform)
+        cls.strace = os.path.abspath(strace)
+
+    def record(self, image, settle):
+        name = "lazy-pull-{}".format(self.generate_random_string())
+        trace_dir = os.path.abspath(os.path.join(TRACES_DIR, name))
+        os.makedirs(trace_dir)
+        # Root, so that sudo keeps working under ptrace; the entrypoint drops to the khulnasoft user on its own
+        host_config = self.client.create_host_config(
+            binds=["{}:{}".format(trace_dir, MinimalTracer.TRACE_DIR), "{}:{}:ro".format(self.strace, MinimalTracer.STRACE_PATH)],
+            cap_add=["SYS_PTRACE"],
+            security_opt=["seccomp:unconfined"]
+        )
+        entrypoint = [MinimalTracer.STRACE_PATH, "-f", "-qq", "-y", "-e", "trace=file", "-e", "signal=none",
+                      "-o", "{}/{}".format(MinimalTracer.TRACE_DIR, self.TRACE_FILE), "/sbin/entrypoint.sh"]
+        environment = {"KHULNASOFT_START_ARGS": "--accept-license", "KHULNASOFT_PASSWORD": self.password}
+        cid = self.client.create_container(image, name=name, entrypoint=entrypoint, command="start", user="root",
+                                           environment=environment, host_config=host_config).get("Id")
+        try:
+            self.client.start(cid)
+            if not self.wait_for_containers(1, name=name, timeout=self.READY_TIMEOUT):
+                raise RuntimeError("{} never became ready under strace".format(image))
+            time.sleep(settle)
+            # strace flushes its log when the container gets stopped
+            self.client.stop(cid)
+        finally:
+            self.client.remove_container(cid, v=True, force=True)
+        with open(os.path.join(trace_dir, self.TRACE_FILE)) as f:
+            accessed = list(trace_paths(f))
+        paths = prioritized_files(accessed, image_size.analyze(image)["files"])
+        self.logger.info("{}: {} files of the image accessed during start".format(image, len(paths)))
+        return paths
+
+
+class Variants(object):
+    '''
+    Publishes the gzip, zstd and eStargz variants of local images to a registry on localhost - the gzip one gets
+    pushed by Docker, the others are converted from it with nerdctl
+    '''
+
+    def __init__(self, registry, nerdctl=DEFAULT_NERDCTL):
+        self.registry = registry
+        self.command = shlex.split(nerdctl)
+
+    def nerdctl(self, *args, **kwargs):
+        LOGGER.info("Running: nerdctl {}".format(" ".join(args)))
+        if kwargs.get("output"):
+            return subprocess.check_output(self.command + list(args), stderr=subprocess.STDOUT).decode("utf-8", "replace")
+        if kwargs.get("check", True):
+            subprocess.check_call(self.command + list(args))
+        else:
+            subprocess.call(self.command + list(args))
+
+    def reference(self, image, fmt):
+        name, tag = split_image(image)
+        return "localhost:{}/{}:{}".format(self.registry.port, name, tag if fmt == "gzip" else "{}-{}".format(tag, fmt))
+
+    def publish(self, image, fmt, record=None):
+        '''
+        Push the `fmt` variant of `image`, with the files listed in `record` first for eStargz, and return its reference
+        '''
+        name, tag = split_image(image)
+        self.registry.push(image, name, tag)
+        source = self.reference(image, "gzip")
+        if fmt == "gzip":
+            return source
+        target = self.reference(image, fmt)
+        flags = list(CONVERT_FLAGS[fmt])
+        if fmt == "estargz" and record:
+            flags += ["--estargz-record-in", os.path.abspath(record)]
+        self.nerdctl("pull", "--insecure-registry", "--quiet", source)
+        try:
+            self.nerdctl("image", "convert", *(flags + [source, target]))
+            self.nerdctl("push", "--insecure-registry", target)
+        finally:
+            self.nerdctl("rmi", "--force", source, target, check=False)
+        return target
+
+
+class PullBenchmark(object):
+    '''
+    Measures how long a node without any layer of an image takes to pull it and bring it up, for each of its variants
+    '''
+
+    POLL_INTERVAL = 0.5 # in seconds
+    READY_TIMEOUT = 900 # in seconds
+
+    def __init__(self, variants, password):
+        self.variants = variants
+        self.password = password
+
+    def cold_start(self, reference, fmt):
+        nerdctl = self.variants.nerdctl
+        snapshotter = SNAPSHOTTERS[fmt]
+        # Nothing of the image left on the node, as on a freshly autoscaled one
+        nerdctl("--snapshotter", snapshotter, "rmi", "--force", reference, check=False)
+        t0 = time.time()
+        nerdctl("--snapshotter", snapshotter, "pull", "--insecure-registry", "--quiet", reference)
+        pulled = time.time() - t0
+        cid = nerdctl("--snapshotter", snapshotter, "run", "--detach", "--env", "KHULNASOFT_START_ARGS=--accept-license",
+                      "--env", "KHULNASOFT_PASSWORD={}".format(self.password), reference, "start", output=True).strip().splitlines()[-1]
+        try:
+            while time.time() - t0 < self.READY_TIMEOUT:
+                if READY_MARKER in nerdctl("logs", cid, output=True):
+                    return {"pull": round(pulled, 2), "ready": round(time.time() - t0, 2)}
+                if nerdctl("inspect", "--format", "{{.State.Status}}", cid, output=True).strip() != "running":
+                    raise RuntimeError("{} exited before becoming ready".format(reference))
+                time.sleep(self.POLL_INTERVAL)
+            raise RuntimeError("{} did not become ready within {}s".format(reference, self.READY_TIMEOUT))
+        finally:
+            nerdctl("rm", "--force", cid, check=False)
+            nerdctl("--snapshotter", snapshotter, "rmi", "--force", reference, check=False)
+
+    def run(self, images, formats, records, runs=1):
+        report = {"timestamp": int(time.time()), "images": {}}
+        for image in images:
+            report["images"][image] = {}
+            for fmt in formats:
+                reference = self.variants.publish(image, fmt, records.get(image))
+                name, _, tag = reference.split("/", 1)[1].rpartition(":")
+                samples = []
+                for i in range(runs):
+                    LOGGER.info("Pulling and starting {} ({}/{})".format(reference, i + 1, runs))
+                    samples.append(self.cold_start(reference, fmt))
+                report["images"][image][fmt] = {
+                    "reference": reference,
+                    "compressed_bytes": sum(size for _, size in self.variants.registry.layers(name, tag)),
+                    "pull": median([x["pull"] for x in samples]),
+                    "ready": median([x["ready"] for x in samples]),
+                    "runs": runs
+                }
+        return report
+
+
+def record_images(images, platform, strace, settle):
+    '''
+    Trace the start of every image and write its eStargz record file - returns {image: record file}
+    '''
+    if not os.path.isdir(RECORDS_DIR):
+        os.makedirs(RECORDS_DIR)
+    StartRecorder.setup_class(platform, strace)
+    recorder = StartRecorder()
+    records = {}
+    try:
+        for image in images:
+            records[image] = record_file(image)
+            write_record(records[image], recorder.record(image, settle))
+            LOGGER.info("Prioritized files of {} written to {}".format(image, records[image]))
+    finally:
+        StartRecorder.teardown_class()
+    return records
+
+
+def find_records(images, platform, strace, settle):
+    '''
+    Return {image: record file}, tracing the images that have none yet - without `strace`, those are converted to
+    eStargz without prioritized files
+    '''
+    records = dict((x, record_file(x)) for x in images if os.path.isfile(record_file(x)))
+    missing = [x for x in images if x not in records]
+    if missing and strace:
+        records.update(record_images(missing, platform, strace, settle))
+    elif missing:
+        LOGGER.warning("No prioritized files recorded for {}, pass --strace to record them".format(", ".join(missing)))
+    return records
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("images", nargs="+", help="Local images, ex. khulnasoft-debian-10:latest")
+    common.add_argument("--platform", default="debian-10", help="Platform of the images (default: debian-10)")
+    common.add_argument("--strace", help="Statically linked strace binary, bind-mounted into the containers to record the files read during start")
+    common.add_argument("--settle", type=int, default=30, help="Seconds to keep tracing once the container is ready (default: 30)")
+    common.add_argument("--registry-port", type=int, default=5000, help="Host port of the registry on localhost (default: 5000)")
+    common.add_argument("--nerdctl", default=DEFAULT_NERDCTL, help="Command running nerdctl, ex. \"sudo nerdctl\" (default: nerdctl)")
+    parser = argparse.ArgumentParser(description="Build, publish and benchmark the zstd and eStargz variants of the images")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("record", parents=[common], help="Record the files each image reads during `entrypoint.sh start`")
+    convert_parser = subparsers.add_parser("convert", parents=[common], help="Push the zstd or eStargz variant of each image to the registry")
+    convert_parser.add_argument("--format", choices=FORMATS, required=True, help="Compression of the pushed variant")
+    benchmark_parser = subparsers.add_parser("benchmark", parents=[common], help="Compare the pull-and-start time of the variants, using a throwaway registry")
+    benchmark_parser.add_argument("--format", action="append", dest="formats", choices=FORMATS, help="Variant to benchmark (default: all of them)")
+    benchmark_parser.add_argument("--runs", type=int, default=1, help="Cold starts per variant, the median is reported (default: 1)")
+    args = parser.parse_args()
+    if args.command == "record":
+        if not args.strace:
+            parser.error("record requires --strace")
+        record_images(args.images, args.platform, args.strace, args.settle)
+        return 0
+    if args.command == "convert":
+        records = find_records(args.images, args.platform, args.strace, args.settle) if args.format == "estargz" else {}
+        variants = Variants(Registry(docker.APIClient(), args.registry_port), args.nerdctl)
+        for image in args.images:
+            print(variants.publish(image, args.format, records.get(image)))
+        return 0
+    if args.command != "benchmark":
+        parser.print_usage()
+        return 2
+    formats = args.formats or list(FORMATS)
+    records = find_records(args.images, args.platform, args.strace, args.settle) if "estargz" in formats else {}
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    registry = Registry(docker.APIClient(), args.registry_port)
+    registry.start()
+    try:
+        report = PullBenchmark(Variants(registry, args.nerdctl), Executor.generate_random_string()).run(args.images, formats, records, args.runs)
+    finally:
+        registry.stop()
+    filename = os.path.join(RESULTS_DIR, "lazy_pull_{}.json".format(report["timestamp"]))
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    LOGGER.info("Benchmark results written to {}".format(filename))
+    for image, results in sorted(report["images"].items()):
+        print(image)
+        print("    {:<10} {:>11} {:>9} {:>9}".format("variant", "compressed", "pull", "ready"))
+        for fmt in formats:
+            result = results[fmt]
+            print("    {:<10} {:>8.1f} MB {:>8.1f}s {:>8.1f}s".format(fmt, result["compressed_bytes"] / 1048576.0, result["pull"], result["ready"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
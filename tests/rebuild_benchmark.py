@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import argparse
+import subprocess
+import requests
+import docker
+from executor import LOGGER, FILE_DIR, REPO_DIR
+
+sys.path.insert(0, REPO_DIR)
+import build
+
+
+RESULTS_DIR = os.path.join(FILE_DIR, "..", "test-results", "benchmarks")
+DEFAULT_TARGETS = ("khulnasoft-debian-10", "uf-debian-10")
+REGISTRY_IMAGE = "registry:2"
+REGISTRY_TIMEOUT = 60 # in seconds
+MANIFEST_TYPES = ", ".join((
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.index.v1+json"
+))
+# BuildKit keys its cache on file contents rather than modification times, so touching an input means changing it
+MARKER = "\n# rebuild benchmark {}\n"
+# Created in the directories the Dockerfile copies, since appending to a file of theirs could break it
+MARKER_FILE = ".rebuild-benchmark"
+IMAGE_TAG_PATTERN = re.compile(r"\s-t\s+(\S+)")
+
+
+def dockerfile_inputs(dockerfile):
+    '''
+    Return the files and directories of the build context that the Dockerfile copies, in order of appearance
+    '''
+    with open(dockerfile) as f:
+        instructions = re.sub(r"\\\n", " ", f.read()).splitlines()
+    inputs = []
+    for instruction in instructions:
+        if not re.match(r"COPY\s", instruction):
+            continue
+        flags, args = re.match(r"COPY\s+((?:--\w+=\S+\s+)*)(.*)", instruction).groups()
+        # Copies from other stages are covered by the inputs of those stages
+        if "--from=" in flags:
+            continue
+        sources = (json.loads(args) if args.startswith("[") else shlex.split(args))[:-1]
+        for source in sources:
+            if source not in inputs:
+                inputs.append(source)
+    return inputs
+
+
+def touch(path):
+    '''
+    Change the content of `path` under the build context - returns the function that restores it
+    '''
+    if os.path.isdir(path):
+        marker = os.path.join(path, MARKER_FILE)
+        with open(marker, "w") as f:
+            f.write(MARKER.format(time.time()))
+        return lambda: os.remove(marker)
+    with open(path, "rb") as f:
+        original = f.read()
+    with open(path, "ab") as f:
+        f.write(MARKER.format(time.time()).encode("utf-8"))
+
+    def restore():
+        with open(path, "wb") as f:
+            f.write(original)
+    return restore
+
+
+class Registry(object):
+    '''
+    Throwaway local registry - the layers a push sends it are what a rebuild costs every node pulling the image
+    '''
+
+    def __init__(self, client, port):
+        self.client = client
+        self.port = port
+        self.url = "http://localhost:{}".format(port)
+        self.container = None
+
+    def start(self):
+        self.client.pull(REGISTRY_IMAGE)
+        host_config = self.client.create_host_config(port_bindings={5000: self.port})
+        self.container = self.client.create_container(REGISTRY_IMAGE, ports=[5000], host_config=host_config).get("Id")
+        self.client.start(self.container)
+        start = time.time()
+        while time.time() - start < REGISTRY_TIMEOUT:
+            try:
+                if requests.get(self.url + "/v2/", timeout=5).status_code == 200:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(1)
+        raise RuntimeError("Registry did not come up on port {}".format(self.port))
+
+    def stop(self):
+        if self.container:
+            self.client.remove_container(self.container, v=True, force=True)
+
+    def push(self, image, name, tag="benchmark"):
+        '''
+        Push `image` as `name:tag` and return the (digest, compressed size) of each of its layers
+        '''
+        repository = "localhost:{}/{}".format(self.port, name)
+        self.client.tag(image, repository, tag)
+        try:
+            for event in self.client.push(repository, tag, stream=True, decode=True):
+                if "error" in event:
+                    raise RuntimeError("Pushing {} failed: {}".format(image, event["error"]))
+        finally:
+            self.client.remove_image("{}:{}".format(repository, tag))
+        return self.layers(name, tag)
+
+    def layers(self, name, tag):
+        '''
+        Return the (digest, compressed size) of each layer of `name:tag` - for an image index, the layers of its
+        first manifest
+        '''
+        url = "{}/v2/{}/manifests/{}".format(self.url, name, tag)
+        resp = requests.get(url, headers={"Accept": MANIFEST_TYPES}, timeout=30)
+        resp.raise_for_status()
+        manifest = resp.json()
+        if "manifests" in manifest:
+            resp = requests.get(url.rsplit("/", 1)[0] + "/" + manifest["manifests"][0]["digest"], headers={"Accept": MANIFEST_TYPES}, timeout=30)
+            resp.raise_for_status()
+            manifest = resp.json()
+        return [(x["digest"], x["size"]) for x in manifest["layers"]]
+
+
+class RebuildBenchmark(object):
+    '''
+    Rebuilds a Makefile target after changing each of its inputs in turn, and records how long the rebuild took and
+    how many bytes pushing the result sent on top of the layers pushed before
+    '''
+
+    def __init__(self, target, registry, variables=(), log_file=None):
+        self.variables = list(variables)
+        self.target = build.read_makefile(build.MAKEFILE, self.variables)[target]
+        recipe = build.dry_run(build.MAKEFILE, self.variables, self.target)
+        self.image = IMAGE_TAG_PATTERN.search(recipe).group(1).replace('"', "")
+        self.dockerfile = os.path.join(REPO_DIR, build.DOCKERFILE_PATTERN.search(recipe).group(1))
+        self.registry = registry
+        self.log_file = log_file or os.path.join(RESULTS_DIR, "rebuild_{}.log".format(target))
+
+    def build(self):
+        # Only the recipe of the target itself, its prerequisites are not what is being measured
+        command = build.make_command(build.MAKEFILE, self.variables)
+        for dep in self.target.deps:
+            command += ["-o", dep]
+        start = time.time()
+        with open(self.log_file, "ab") as log:
+            rc = subprocess.call(command + [self.target.name], stdout=log, stderr=subprocess.STDOUT, cwd=REPO_DIR)
+        if rc != 0:
+            raise RuntimeError("Building {} failed, see {}".format(self.target.name, self.log_file))
+        return time.time() - start
+
+    def run(self, inputs):
+        report = {"target": self.target.name, "image": self.image, "timestamp": int(time.time()), "inputs": []}
+        LOGGER.info("Warming up the build cache of {}".format(self.target.name))
+        self.build()
+        pushed = set(x for x, _ in self.registry.push(self.image, self.target.name))
+        report["inputs"].append({"input": None, "rebuild": self.build(), "layers": 0, "pushed_bytes": 0})
+        for path in inputs:
+            LOGGER.info("Rebuilding {} after changing {}".format(self.target.name, path))
+            restore = touch(os.path.join(REPO_DIR, path))
+            try:
+                seconds = self.build()
+                layers = self.registry.push(self.image, self.target.name)
+            finally:
+                restore()
+            new = [(x, size) for x, size in layers if x not in pushed]
+            pushed.update(x for x, _ in new)
+            report["inputs"].append({"input": path, "rebuild": seconds, "layers": len(new), "total_layers": len(layers),
+                                     "pushed_bytes": sum(size for _, size in new)})
+            # Back to the original inputs, straight from the cache
+            self.build()
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the rebuild time and the pushed bytes of image targets after changing each of their inputs")
+    parser.add_argument("targets", nargs="*", default=list(DEFAULT_TARGETS), help="Makefile targets to benchmark (default: {})".format(" ".join(DEFAULT_TARGETS)))
+    parser.add_argument("--input", action="append", dest="inputs", help="Path under the repository to change, ex. khulnasoft/common-files/entrypoint.sh (default: everything the Dockerfile copies)")
+    parser.add_argument("--registry-port", type=int, default=5000, help="Host port of the throwaway registry (default: 5000)")
+    args = parser.parse_args()
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    registry = Registry(docker.APIClient(), args.registry_port)
+    registry.start()
+    reports = []
+    try:
+        for target in args.targets:
+            benchmark = RebuildBenchmark(target, registry)
+            report = benchmark.run(args.inputs or dockerfile_inputs(benchmark.dockerfile))
+            filename = os.path.join(RESULTS_DIR, "rebuild_{}_{}.json".format(target, report["timestamp"]))
+            with open(filename, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            LOGGER.info("Benchmark results written to {}".format(filename))
+            reports.append(report)
+    finally:
+        registry.stop()
+    for report in reports:
+        print("{} ({})".format(report["target"], report["image"]))
+        print("    {:<56} {:>9} {:>8} {:>11}".format("changed input", "rebuild", "layers", "pushed"))
+        for result in report["inputs"]:
+            print("    {:<56} {:>8.1f}s {:>8} {:>8.1f} MB".format(result["input"] or "(nothing)", result["rebuild"], result["layers"],
+                                                              result["pushed_bytes"] / 1048576.0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import re
+import sys
+import json
+import time
+import errno
+import fcntl
+import inspect
+import hashlib
+import argparse
+import multiprocessing
+from executor import Executor, LOGGER, FILE_DIR
+
+
+DURATIONS_FILE = os.path.join(FILE_DIR, "..", "test-results", "test_durations.json")
+BUDGET_FILE = os.path.join(FILE_DIR, "..", "test-results", ".container_budget")
+# Rough cost model used until a test has a recorded duration
+BASE_DURATION = 60 # in seconds
+PER_CONTAINER_DURATION = 120 # in seconds
+# Host resources reserved for a single Khulnasoft container
+CONTAINER_MEMORY_MB = 2048
+CONTAINER_CPUS = 1
+# Weight of the latest run when folding it into the recorded durations
+DURATION_SMOOTHING = 0.5
+
+COMPOSE_FILE_PATTERN = re.compile(r'compose_file_name\s*=\s*"([^"]+)"')
+
+
+def count_containers(test_function):
+    '''
+    Number of containers a test brings up - the largest compose scenario it references, or a single container for
+    ad-hoc tests
+    '''
+    try:
+        source = inspect.getsource(test_function)
+    except (IOError, TypeError):
+        return 1
+    counts = [1]
+    for compose_file in COMPOSE_FILE_PATTERN.findall(source):
+        path = os.path.join(Executor.SCENARIOS_DIR, compose_file)
+        if os.path.isfile(path):
+            counts.append(Executor().get_number_of_containers(path))
+    return max(counts)
+
+
+def load_durations(filename=DURATIONS_FILE):
+    '''
+    Recorded durations (in seconds) of previous runs, keyed by test node ID
+    '''
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_durations(durations, filename=DURATIONS_FILE):
+    recorded = load_durations(filename)
+    for nodeid, duration in durations.items():
+        if nodeid in recorded:
+            duration = DURATION_SMOOTHING * duration + (1 - DURATION_SMOOTHING) * recorded[nodeid]
+        recorded[nodeid] = round(duration, 2)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(filename))):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)))
+    with open(filename, "w") as f:
+        json.dump(recorded, f, indent=2, sort_keys=True)
+
+
+def estimate_duration(containers, recorded=None):
+    if recorded is not None:
+        return recorded
+    return BASE_DURATION + PER_CONTAINER_DURATION * containers
+
+
+def host_container_budget():
+    '''
+    Number of containers this host can run at once, limited by both memory and CPUs
+    '''
+    cpus = multiprocessing.cpu_count()
+    memory_mb = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    memory_mb = int(line.split()[1]) // 1024
+    except IOError:
+        pass
+    budget = cpus // CONTAINER_CPUS
+    if memory_mb:
+        budget = min(budget, memory_mb // CONTAINER_MEMORY_MB)
+    return max(1, budget)
+
+
+def shard_key(nodeid):
+    # Tie-breaker that does not depend on collection order
+    return hashlib.sha1(nodeid.encode("utf-8")).hexdigest()
+
+
+def assign_shards(costs, num_shards):
+    '''
+    Deterministic longest-processing-time-first split of {nodeid: duration} into `num_shards` balanced shards -
+    every CI host computes the same map from the same inputs
+    '''
+    loads = [0.0] * num_shards
+    shards = {}
+    for nodeid, duration in sorted(costs.items(), key=lambda x: (-x[1], shard_key(x[0]))):
+        shard = min(range(num_shards), key=lambda x: (loads[x], x))
+        shards[nodeid] = shard
+        loads[shard] += duration
+    return shards, loads
+
+
+class ContainerBudget(object):
+    '''
+    Host-wide counting semaphore over container slots, shared by all pytest-xdist workers through a locked file -
+    a test only starts once the containers it needs fit in the budget (a test larger than the whole budget runs alone)
+    '''
+
+    POLL_INTERVAL = 1 # in seconds
+
+    def __init__(self, capacity, filename=BUDGET_FILE, logger=LOGGER):
+        self.capacity = capacity
+        self.filename = filename
+        self.logger = logger
+
+    def _update(self, change):
+        with open(self.filename, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    holders = json.loads(f.read() or "{}")
+                except ValueError:
+                    holders = {}
+                # Drop slots held by workers that died without releasing them
+                for pid in list(holders):
+                    try:
+                        os.kill(int(pid), 0)
+                    except OSError as e:
+                        if e.errno == errno.ESRCH:
+                            del holders[pid]
+                result = change(holders)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(holders))
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self, containers):
+        pid = str(os.getpid())
+
+        def take(holders):
+            in_use = sum(holders.values())
+            if in_use == 0 or in_use + containers <= self.capacity:
+                holders[pid] = holders.get(pid, 0) + containers
+                return True
+            return False
+        start = time.time()
+        while not self._update(take):
+            time.sleep(self.POLL_INTERVAL)
+        waited = time.time() - start
+        if waited > self.POLL_INTERVAL:
+            self.logger.info("Waited {:.0f}s for {} container slot(s) out of {}".format(waited, containers, self.capacity))
+
+    def release(self, containers):
+        pid = str(os.getpid())
+
+        def give(holders):
+            remaining = holders.get(pid, 0) - containers
+            if remaining > 0:
+                holders[pid] = remaining
+            else:
+                holders.pop(pid, None)
+        self._update(give)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the cost estimates and the deterministic shard map of a test module")
+    parser.add_argument("module", help="Test module, ex. tests/test_distributed_khulnasoft_image.py")
+    parser.add_argument("--num-shards", type=int, default=1)
+    args = parser.parse_args()
+    sys.path.insert(0, FILE_DIR)
+    module_name = os.path.splitext(os.path.basename(args.module))[0]
+    module = __import__(module_name)
+    recorded = load_durations()
+    costs = {}
+    containers = {}
+    for cls_name, cls in inspect.getmembers(module, inspect.isclass):
+        for name, function in inspect.getmembers(cls, inspect.isfunction if sys.version_info[0] > 2 else inspect.ismethod):
+            if not name.startswith("test_"):
+                continue
+            nodeid = "{}::{}::{}".format(os.path.relpath(args.module), cls_name, name)
+            containers[nodeid] = count_containers(function)
+            costs[nodeid] = estimate_duration(containers[nodeid], recorded.get(nodeid))
+    shards, loads = assign_shards(costs, args.num_shards)
+    print(json.dumps({
+        "container_budget": host_container_budget(),
+        "shard_loads": loads,
+        "tests": dict((nodeid, {"containers": containers[nodeid], "duration": costs[nodeid], "shard": shards[nodeid]}) for nodeid in costs)
+    }, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -88,8 +88,7 @@ class TestDockerKhulnasoft(Executor):
             container_mapping = {"cm1": "cm", "idx1": "idx", "idx2": "idx", "idx3": "idx"}
             for container in container_mapping:
                 # Check ansible version & configs
-                ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-                self.check_ansible(ansible_logs)
+                self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
                 # Check values in log output
                 inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
                 self.check_common_keys(inventory_json, container_mapping[container])
@@ -151,8 +150,7 @@ class TestDockerKhulnasoft(Executor):
             container_mapping = {"sh1": "sh", "sh2": "sh", "sh3": "sh", "cm1": "cm", "idx1": "idx", "dep1": "dep"}
             for container in container_mapping:
                 # Check ansible version & configs
-                ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-                self.check_ansible(ansible_logs)
+                self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
                 # Check values in log output
                 inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
                 self.check_common_keys(inventory_json, container_mapping[container])
@@ -229,8 +227,7 @@ class TestDockerKhulnasoft(Executor):
         container_mapping = {"so1": "so", "uf1": "uf"}
         for container in container_mapping:
             # Check ansible version & configs
-            ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-            self.check_ansible(ansible_logs)
+            self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
             # Check values in log output
             inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
             self.check_common_keys(inventory_json, container_mapping[container])
@@ -270,8 +267,7 @@ class TestDockerKhulnasoft(Executor):
             container_mapping = {"cm1": "cm", "idx1": "idx", "idx2": "idx", "idx3": "idx"}
             for container in container_mapping:
                 # Check ansible version & configs
-                ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-                self.check_ansible(ansible_logs)
+                self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
                 # Check values in log output
                 inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
                 self.check_common_keys(inventory_json, container_mapping[container])
@@ -318,8 +314,7 @@ class TestDockerKhulnasoft(Executor):
         container_mapping = {"so1": "so", "cm1": "cm"}
         for container in container_mapping:
             # Check ansible version & configs
-            ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-            self.check_ansible(ansible_logs)
+            self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
             # Check values in log output
             inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
             self.check_common_keys(inventory_json, container_mapping[container])
@@ -352,8 +347,7 @@ class TestDockerKhulnasoft(Executor):
         container_mapping = {"so1": "so", "cm1": "cm"}
         for container in container_mapping:
             # Check ansible version & configs
-            ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-            self.check_ansible(ansible_logs)
+            self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
             # Check values in log output
             inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
             self.check_common_keys(inventory_json, container_mapping[container])
@@ -500,8 +494,7 @@ class TestDockerKhulnasoft(Executor):
         container_mapping = {"sh1": "sh", "cm1": "cm"}
         for container in container_mapping:
             # Check ansible version & configs
-            ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-            self.check_ansible(ansible_logs)
+            self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
             # Check values in log output
             inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
             self.check_common_keys(inventory_json, container_mapping[container])
@@ -601,8 +594,7 @@ class TestDockerKhulnasoft(Executor):
         container_mapping = {"sh1": "sh", "sh2": "sh", "idx1": "idx", "idx2": "idx"}
         for container in container_mapping:
             # Check ansible version & configs
-            ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-            self.check_ansible(ansible_logs)
+            self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
             # Check values in log output
             inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
             self.check_common_keys(inventory_json, container_mapping[container])
@@ -647,8 +639,7 @@ class TestDockerKhulnasoft(Executor):
         container_mapping = {"sh1": "sh", "sh2": "sh", "idx1": "idx", "idx2": "idx", "cm1": "cm"}
         for container in container_mapping:
             # Check ansible version & configs
-            ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-            self.check_ansible(ansible_logs)
+            self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
             # Check values in log output
             inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
             self.check_common_keys(inventory_json, container_mapping[container])
@@ -749,8 +740,7 @@ class TestDockerKhulnasoft(Executor):
             container_mapping = {"cm1": "cm", "depserver1": "deployment_server"}
             for container in container_mapping:
                 # Check ansible version & configs
-                ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-                self.check_ansible(ansible_logs)
+                self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
                 # Check values in log output
                 inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
                 self.check_common_keys(inventory_json, container_mapping[container])
@@ -845,8 +835,7 @@ class TestDockerKhulnasoft(Executor):
             container_mapping = {"{}_so1_1".format(self.project_name): "so", "{}_depserver1_1".format(self.project_name): "deployment_server"}
             for container in container_mapping:
                 # Check ansible version & configs
-                ansible_logs = self.get_container_logs(container)
-                self.check_ansible(ansible_logs)
+                self.check_ansible(self.stream_container_logs(container))
                 # Check values in log output
                 inventory_json = self.extract_json(container)
                 self.check_common_keys(inventory_json, container_mapping[container])
@@ -932,8 +921,7 @@ class TestDockerKhulnasoft(Executor):
             container_mapping = {"{}_uf1_1".format(self.project_name): "uf", "{}_depserver1_1".format(self.project_name): "deployment_server"}
             for container in container_mapping:
                 # Check ansible version & configs
-                ansible_logs = self.get_container_logs(container)
-                self.check_ansible(ansible_logs)
+                self.check_ansible(self.stream_container_logs(container))
                 # Check values in log output
                 inventory_json = self.extract_json(container)
                 self.check_common_keys(inventory_json, container_mapping[container])
@@ -1049,8 +1037,7 @@ class TestDockerKhulnasoft(Executor):
             container_mapping = {"cm1": "cm", "idx1": "idx", "idx2": "idx", "idx3": "idx"}
             for container in container_mapping:
                 # Check ansible version & configs
-                ansible_logs = self.get_container_logs("{}_{}_1".format(self.project_name, container))
-                self.check_ansible(ansible_logs)
+                self.check_ansible(self.stream_container_logs("{}_{}_1".format(self.project_name, container)))
                 # Check values in log output
                 inventory_json = self.extract_json("{}_{}_1".format(self.project_name, container))
                 self.check_common_keys(inventory_json, container_mapping[container])
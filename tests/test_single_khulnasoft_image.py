@@ -24,6 +24,34 @@ urllib3.disable_warnings(SubjectAltNameWarning)
 global PLATFORM
 PLATFORM = "debian-9"
 OLD_KHULNASOFT_VERSION = "7.3.4"
+# Environments of the pre-provisioned containers handed out by the `warm_pool` fixture to tests that only read state.
+# Tests share the "shared" standalone, whose settings don't get in each other's way - a test only gets an environment
+# of its own when it conflicts with them
+WARM_ENVIRONMENTS = {
+    # khulnasoft.secret is left to the image to generate, so that pass4SymmKey gets encrypted with it
+    "shared": {
+        "DEBUG": "true",
+        "KHULNASOFT_START_ARGS": "--accept-license",
+        "KHULNASOFT_PASS4SYMMKEY": "wubbalubbadubdub",
+        "KHULNASOFT_LAUNCH_CONF": "OPTIMISTIC_ABOUT_FILE_LOCKING=1,HELLO=WORLD",
+        "KHULNASOFT_HEC_TOKEN": "get-schwifty",
+        "KHULNASOFT_HEC_SSL": "false"
+    },
+    "secret": {
+        "DEBUG": "true",
+        "KHULNASOFT_START_ARGS": "--accept-license",
+        "KHULNASOFT_SECRET": "wubbalubbadubdub"
+    }
+}
+# Read-only commands exec'ed into the `no-provision` container each image shares through the `no_provision` fixture -
+# all of them run at once for the first test that needs one, as (command, user) with None for the image's default user
+NO_PROVISION_COMMANDS = {
+    "help": ("/sbin/entrypoint.sh help", None),
+    "ulimit": ("sudo -u khulnasoft bash -c 'ulimit -u'", None),
+    "ansible_version": ("cat /opt/ansible/version.txt", None),
+    "ansible_dir": ("ls /opt/ansible/", None),
+    "id": ("id", "khulnasoft")
+}
 
 def pytest_generate_tests(metafunc):
     # This is called for every test. Only get/set command line arguments
@@ -61,35 +89,15 @@ class TestDockerKhulnasoft(Executor):
                 pass
         self.compose_file_name, self.project_name, self.DIR = None, None, None
 
-    def test_khulnasoft_entrypoint_help(self):
-        # Run container
-        cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, command="help")
-        self.client.start(cid.get("Id"))
-        output = self.get_container_logs(cid.get("Id"))
-        self.client.remove_container(cid.get("Id"), v=True, force=True)
+    def test_khulnasoft_entrypoint_help(self, no_provision):
+        output = no_provision.run(self.KHULNASOFT_IMAGE_NAME, NO_PROVISION_COMMANDS)["help"]
         assert "KHULNASOFT_HOME - home directory where Khulnasoft gets installed (default: /opt/khulnasoft)" in output
         assert "Examples:" in output
     
-    def test_khulnasoft_ulimit(self):
-        cid = None
-        try:
-            # Run container
-            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, command="no-provision")
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Wait a bit
-            time.sleep(5)
-            # If the container is still running, we should be able to exec inside
-            # Check that nproc limits are unlimited
-            exec_command = self.client.exec_create(cid, "sudo -u khulnasoft bash -c 'ulimit -u'")
-            std_out = self.client.exec_start(exec_command)
-            assert "unlimited" in std_out
-        except Exception as e:
-            self.logger.error(e)
-            raise e
-        finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+    def test_khulnasoft_ulimit(self, no_provision):
+        # Check that nproc limits are unlimited
+        output = no_provision.run(self.KHULNASOFT_IMAGE_NAME, NO_PROVISION_COMMANDS)["ulimit"]
+        assert "unlimited" in output
 
     def test_khulnasoft_entrypoint_create_defaults(self):
         # Run container
@@ -119,51 +127,18 @@ class TestDockerKhulnasoft(Executor):
         self.client.remove_container(cid.get("Id"), v=True, force=True)
         assert "License not accepted, please ensure the environment variable KHULNASOFT_START_ARGS contains the '--accept-license' flag" in output
 
-    def test_khulnasoft_entrypoint_no_provision(self):
-        cid = None
-        try:
-            # Run container
-            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, command="no-provision")
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Wait a bit
-            time.sleep(5)
-            # If the container is still running, we should be able to exec inside
-            # Check that the git SHA exists in /opt/ansible
-            exec_command = self.client.exec_create(cid, "cat /opt/ansible/version.txt")
-            std_out = self.client.exec_start(exec_command)
-            assert len(std_out.strip()) == 40
-            # Check that the wrapper-example directory does not exist
-            exec_command = self.client.exec_create(cid, "ls /opt/ansible/")
-            std_out = self.client.exec_start(exec_command)
-            assert "wrapper-example" not in std_out
-            assert "docs" not in std_out
-        except Exception as e:
-            self.logger.error(e)
-            raise e
-        if cid:
-            self.client.remove_container(cid, v=True, force=True)
+    def test_khulnasoft_entrypoint_no_provision(self, no_provision):
+        outputs = no_provision.run(self.KHULNASOFT_IMAGE_NAME, NO_PROVISION_COMMANDS)
+        # Check that the git SHA exists in /opt/ansible
+        assert len(outputs["ansible_version"].strip()) == 40
+        # Check that the wrapper-example directory does not exist
+        assert "wrapper-example" not in outputs["ansible_dir"]
+        assert "docs" not in outputs["ansible_dir"]
 
-    def test_khulnasoft_uid_gid(self):
-        cid = None
-        try:
-            # Run container
-            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, command="no-provision")
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Wait a bit
-            time.sleep(5)
-            # If the container is still running, we should be able to exec inside
-            # Check that the git SHA exists in /opt/ansible
-            exec_command = self.client.exec_create(cid, "id", user="khulnasoft")
-            std_out = self.client.exec_start(exec_command)
-            assert "uid=41812" in std_out
-            assert "gid=41812" in std_out
-        except Exception as e:
-            self.logger.error(e)
-            raise e
-        if cid:
-            self.client.remove_container(cid, v=True, force=True)
+    def test_khulnasoft_uid_gid(self, no_provision):
+        output = no_provision.run(self.KHULNASOFT_IMAGE_NAME, NO_PROVISION_COMMANDS)["id"]
+        assert "uid=41812" in output
+        assert "gid=41812" in output
 
     def test_compose_1so_trial(self):
         # Standup deployment
@@ -176,8 +151,7 @@ class TestDockerKhulnasoft(Executor):
         log_json = self.extract_json("{}_so1_1".format(self.project_name))
         self.check_common_keys(log_json, "so")
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
 
@@ -192,8 +166,7 @@ class TestDockerKhulnasoft(Executor):
         log_json = self.extract_json("{}_so1_1".format(self.project_name))
         self.check_common_keys(log_json, "so")
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
 
@@ -210,8 +183,7 @@ class TestDockerKhulnasoft(Executor):
         log_json = self.extract_json("{}_so1_1".format(self.project_name))
         self.check_common_keys(log_json, "so")
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
 
@@ -228,8 +200,7 @@ class TestDockerKhulnasoft(Executor):
         log_json = self.extract_json("{}_so1_1".format(self.project_name))
         self.check_common_keys(log_json, "so")
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check Khulnasoftd using the new users
@@ -249,8 +220,7 @@ class TestDockerKhulnasoft(Executor):
         log_json = self.extract_json("{}_so1_1".format(self.project_name))
         self.check_common_keys(log_json, "so")
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check Khulnasoftd using the new users
@@ -304,28 +274,14 @@ class TestDockerKhulnasoft(Executor):
             except OSError:
                 pass
 
-    def test_adhoc_1so_khulnasoft_launch_conf(self):
-        # Create a khulnasoft container
-        cid = None
+    def test_adhoc_1so_khulnasoft_launch_conf(self, warm_pool):
+        container = warm_pool.checkout(self.KHULNASOFT_IMAGE_NAME, WARM_ENVIRONMENTS["shared"])
         try:
-            khulnasoft_container_name = self.generate_random_string()
-            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, ports=[8089], name=khulnasoft_container_name,
-                                            environment={
-                                                            "DEBUG": "true", 
-                                                            "KHULNASOFT_START_ARGS": "--accept-license",
-                                                            "KHULNASOFT_PASSWORD": self.password,
-                                                            "KHULNASOFT_LAUNCH_CONF": "OPTIMISTIC_ABOUT_FILE_LOCKING=1,HELLO=WORLD"
-                                                        },
-                                            host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)})
-                                            )
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Poll for the container to be ready
-            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            cid = container.id
             # Check khulnasoftd
             khulnasoftd_port = self.client.port(cid, 8089)[0]["HostPort"]
             url = "https://localhost:{}/services/server/info".format(khulnasoftd_port)
-            kwargs = {"auth": ("admin", self.password), "verify": False}
+            kwargs = {"auth": ("admin", container.password), "verify": False}
             status, content = self.handle_request_retry("GET", url, kwargs)
             assert status == 200
             # Check khulnasoft-launch.conf
@@ -337,8 +293,7 @@ class TestDockerKhulnasoft(Executor):
             self.logger.error(e)
             raise e
         finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+            warm_pool.checkin(container)
 
     def test_adhoc_1so_change_tailed_files(self):
         # Create a khulnasoft container
@@ -376,6 +331,161 @@ class TestDockerKhulnasoft(Executor):
             if cid:
                 self.client.remove_container(cid, v=True, force=True)
 
+    def test_adhoc_1so_ansible_profile(self):
+        # Create a khulnasoft container
+        cid = None
+        try:
+            khulnasoft_container_name = self.generate_random_string()
+            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, name=khulnasoft_container_name,
+                                            environment={
+                                                            "KHULNASOFT_START_ARGS": "--accept-license",
+                                                            "KHULNASOFT_PASSWORD": self.password,
+                                                            "KHULNASOFT_ANSIBLE_PROFILE": "true"
+                                                        })
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            # Check the summary printed before the playbook completes
+            output = self.get_container_logs(cid)
+            assert "Slowest provisioning tasks of site.yml" in output
+            # Check the profile written next to the inventory
+            profile = self.extract_ansible_profile(cid)
+            assert profile
+            assert len(profile["runs"]) == 1
+            run = profile["runs"][0]
+            assert run["playbook"] == "site.yml"
+            assert run["tasks"]
+            for task in run["tasks"]:
+                assert task["duration"] >= 0
+                assert task["start"] + task["duration"] <= run["duration"]
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
+    def test_adhoc_1so_warm_restart(self):
+        # Create a khulnasoft container
+        cid = None
+        try:
+            khulnasoft_container_name = self.generate_random_string()
+            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, ports=[8089], name=khulnasoft_container_name,
+                                            environment={
+                                                            "KHULNASOFT_START_ARGS": "--accept-license",
+                                                            "KHULNASOFT_PASSWORD": self.password,
+                                                            "KHULNASOFT_WARM_RESTART": "true"
+                                                        },
+                                            host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)})
+                                            )
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            # Check that the fingerprint was saved after provisioning
+            exec_command = self.client.exec_create(cid, "cat /opt/container_artifact/provision.fingerprint")
+            std_out = self.client.exec_start(exec_command)
+            assert len(std_out.strip()) == 128
+            # Restart the container - nothing changed, so Ansible should be skipped
+            self.client.restart(khulnasoft_container_name)
+            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            assert self.check_khulnasoftd("admin", self.password, name=khulnasoft_container_name)
+            logs = self.client.logs(cid)
+            assert logs.count("Configuration unchanged since the last provisioning") == 1
+            assert logs.count("PLAY [") == 1
+            # Change the defaults and restart the container - the playbook should run again
+            exec_command = self.client.exec_create(cid, '''bash -c 'mkdir -p /tmp/defaults && echo "khulnasoft: {}" > /tmp/defaults/default.yml' ''')
+            self.client.exec_start(exec_command)
+            self.client.restart(khulnasoft_container_name)
+            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            assert self.check_khulnasoftd("admin", self.password, name=khulnasoft_container_name)
+            logs = self.client.logs(cid)
+            assert logs.count("Configuration changed since the last provisioning") == 1
+            assert logs.count("PLAY [") == 2
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
+    def test_adhoc_1so_inventory_cache(self):
+        # Create a khulnasoft container
+        cid = None
+        try:
+            khulnasoft_container_name = self.generate_random_string()
+            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, name=khulnasoft_container_name,
+                                            environment={
+                                                            "DEBUG": "true",
+                                                            "KHULNASOFT_START_ARGS": "--accept-license",
+                                                            "KHULNASOFT_PASSWORD": self.password,
+                                                            "KHULNASOFT_WARM_RESTART": "true"
+                                                        }
+                                            )
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            # Change the defaults and restart the container - the warm restart check fills the cache, Ansible then
+            # has to hit the same entry instead of running environ.py in an environment of its own
+            exec_command = self.client.exec_create(cid, '''bash -c 'mkdir -p /tmp/defaults && echo "khulnasoft: {}" > /tmp/defaults/default.yml' ''')
+            self.client.exec_start(exec_command)
+            self.client.restart(khulnasoft_container_name)
+            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            assert "Configuration changed since the last provisioning" in self.client.logs(cid).decode("utf-8")
+            exec_command = self.client.exec_create(cid, "find /opt/container_artifact/inventory_cache -type f -printf '%m %f\n'")
+            entries = self.client.exec_start(exec_command).decode("utf-8").strip().splitlines()
+            assert len(entries) == 1
+            # The cache holds the secrets in clear
+            assert entries[0].startswith("600 ")
+            # The DEBUG dump goes through the masking of environ.py
+            exec_command = self.client.exec_create(cid, "cat /opt/container_artifact/ansible_inventory.json")
+            std_out = self.client.exec_start(exec_command).decode("utf-8")
+            assert "khulnasoft" in std_out
+            assert self.password not in std_out
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
+    def test_adhoc_1so_metrics_exporter(self):
+        # Create a khulnasoft container
+        cid = None
+        try:
+            khulnasoft_container_name = self.generate_random_string()
+            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, ports=[8089], name=khulnasoft_container_name,
+                                            environment={
+                                                            "KHULNASOFT_START_ARGS": "--accept-license",
+                                                            "KHULNASOFT_PASSWORD": self.password,
+                                                            "KHULNASOFT_METRICS_EXPORTER": "true"
+                                                        },
+                                            host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)})
+                                            )
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            # Run the healthcheck once so that its outcome gets exported, then scrape the exporter from inside the container
+            exec_command = self.client.exec_create(cid, "checkstate.sh")
+            self.client.exec_start(exec_command)
+            exec_command = self.client.exec_create(cid, "curl -s http://localhost:9110/metrics")
+            std_out = self.client.exec_start(exec_command)
+            assert 'khulnasoft_container_state{state="started"} 1' in std_out
+            assert "khulnasoft_container_restarts_total 0" in std_out
+            assert 'khulnasoft_provisioning_duration_seconds{mode="ansible"}' in std_out
+            assert "khulnasoft_khulnasoftd_rest_up 1" in std_out
+            assert "khulnasoft_khulnasoftd_rest_latency_seconds" in std_out
+            assert "khulnasoft_healthcheck_up 1" in std_out
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
     def test_adhoc_1so_password_from_file(self):
         # Create a khulnasoft container
         cid = None
@@ -446,28 +556,14 @@ class TestDockerKhulnasoft(Executor):
             if cid:
                 self.client.remove_container(cid, v=True, force=True)
 
-    def test_adhoc_1so_khulnasoft_pass4symmkey(self):
-        # Create a khulnasoft container
-        cid = None
+    def test_adhoc_1so_khulnasoft_pass4symmkey(self, warm_pool):
+        container = warm_pool.checkout(self.KHULNASOFT_IMAGE_NAME, WARM_ENVIRONMENTS["shared"])
         try:
-            khulnasoft_container_name = self.generate_random_string()
-            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, ports=[8089], name=khulnasoft_container_name,
-                                               environment={
-                                                            "DEBUG": "true", 
-                                                            "KHULNASOFT_START_ARGS": "--accept-license",
-                                                            "KHULNASOFT_PASSWORD": self.password,
-                                                            "KHULNASOFT_PASS4SYMMKEY": "wubbalubbadubdub"
-                                                        },
-                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)})
-                                            )
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Poll for the container to be ready
-            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            cid = container.id
             # Check khulnasoftd
             khulnasoftd_port = self.client.port(cid, 8089)[0]["HostPort"]
             url = "https://localhost:{}/services/server/info".format(khulnasoftd_port)
-            kwargs = {"auth": ("admin", self.password), "verify": False}
+            kwargs = {"auth": ("admin", container.password), "verify": False}
             status, content = self.handle_request_retry("GET", url, kwargs)
             assert status == 200
             # Check the decrypted pass4SymmKey
@@ -481,31 +577,16 @@ class TestDockerKhulnasoft(Executor):
             self.logger.error(e)
             raise e
         finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+            warm_pool.checkin(container)
 
-    def test_adhoc_1so_khulnasoft_secret_env(self):
-        # Create a khulnasoft container
-        cid = None
+    def test_adhoc_1so_khulnasoft_secret_env(self, warm_pool):
+        container = warm_pool.checkout(self.KHULNASOFT_IMAGE_NAME, WARM_ENVIRONMENTS["secret"])
         try:
-            khulnasoft_container_name = self.generate_random_string()
-            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, ports=[8089], name=khulnasoft_container_name,
-                                               environment={
-                                                            "DEBUG": "true", 
-                                                            "KHULNASOFT_START_ARGS": "--accept-license",
-                                                            "KHULNASOFT_PASSWORD": self.password,
-                                                            "KHULNASOFT_SECRET": "wubbalubbadubdub"
-                                                        },
-                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)})
-                                            )
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Poll for the container to be ready
-            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            cid = container.id
             # Check khulnasoftd
             khulnasoftd_port = self.client.port(cid, 8089)[0]["HostPort"]
             url = "https://localhost:{}/services/server/info".format(khulnasoftd_port)
-            kwargs = {"auth": ("admin", self.password), "verify": False}
+            kwargs = {"auth": ("admin", container.password), "verify": False}
             status, content = self.handle_request_retry("GET", url, kwargs)
             assert status == 200
             # Check if the created file exists
@@ -516,8 +597,7 @@ class TestDockerKhulnasoft(Executor):
             self.logger.error(e)
             raise e
         finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+            warm_pool.checkin(container)
 
     def test_compose_1so_hec(self):
         # Standup deployment
@@ -537,8 +617,7 @@ class TestDockerKhulnasoft(Executor):
             self.logger.error(e)
             raise e
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check HEC works - note the token "abcd1234" is hard-coded within the 1so_hec.yaml compose
@@ -991,9 +1070,6 @@ EOL'
             self.client.exec_start(exec_command)
             # Restart the container - it should pick up the new HEC settings in /tmp/defaults/default.yml
             self.client.restart(khulnasoft_container_name)
-            # After restart, a container's logs are preserved. So, sleep in order for the self.wait_for_containers()
-            # to avoid seeing the prior entrypoint's "Ansible playbook complete" string 
-            time.sleep(15)
             assert self.wait_for_containers(1, name=khulnasoft_container_name)
             assert self.check_khulnasoftd("admin", self.password, name=khulnasoft_container_name)
             # Check the new HEC settings
@@ -1027,9 +1103,6 @@ EOL'
             self.client.exec_start(exec_command)
             # Restart the container - it should pick up the new HEC settings in /tmp/defaults/default.yml
             self.client.restart(khulnasoft_container_name)
-            # After restart, a container's logs are preserved. So, sleep in order for the self.wait_for_containers()
-            # to avoid seeing the prior entrypoint's "Ansible playbook complete" string 
-            time.sleep(15)
             assert self.wait_for_containers(1, name=khulnasoft_container_name)
             assert self.check_khulnasoftd("admin", self.password, name=khulnasoft_container_name)
             # Check the new HEC settings
@@ -1061,9 +1134,6 @@ EOL'
             self.client.exec_start(exec_command)
             # Restart the container - it should pick up the new HEC settings in /tmp/defaults/default.yml
             self.client.restart(khulnasoft_container_name)
-            # After restart, a container's logs are preserved. So, sleep in order for the self.wait_for_containers()
-            # to avoid seeing the prior entrypoint's "Ansible playbook complete" string 
-            time.sleep(15)
             assert self.wait_for_containers(1, name=khulnasoft_container_name)
             assert self.check_khulnasoftd("admin", self.password, name=khulnasoft_container_name)
             # Check the new HEC settings
@@ -1088,9 +1158,6 @@ EOL'
             self.client.exec_start(exec_command)
             # Restart the container - it should pick up the new HEC settings in /tmp/defaults/default.yml
             self.client.restart(khulnasoft_container_name)
-            # After restart, a container's logs are preserved. So, sleep in order for the self.wait_for_containers()
-            # to avoid seeing the prior entrypoint's "Ansible playbook complete" string 
-            time.sleep(15)
             assert self.wait_for_containers(1, name=khulnasoft_container_name)
             assert self.check_khulnasoftd("admin", self.password, name=khulnasoft_container_name)
             # Check the new HEC settings
@@ -1108,28 +1175,16 @@ disabled = 1''' in std_out
             if cid:
                 self.client.remove_container(cid, v=True, force=True)
 
-    def test_adhoc_1so_hec_ssl_disabled(self):
-        # Create the container
-        cid = None
+    def test_adhoc_1so_hec_ssl_disabled(self, warm_pool):
+        container = warm_pool.checkout(self.KHULNASOFT_IMAGE_NAME, WARM_ENVIRONMENTS["shared"])
         try:
-            khulnasoft_container_name = self.generate_random_string()
-            cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, ports=[8089, 8088], 
-                                            name=khulnasoft_container_name,
-                                            environment={
-                                                "DEBUG": "true", 
-                                                "KHULNASOFT_START_ARGS": "--accept-license",
-                                                "KHULNASOFT_HEC_TOKEN": "get-schwifty",
-                                                "KHULNASOFT_HEC_SSL": "False",
-                                                "KHULNASOFT_PASSWORD": self.password
-                                            },
-                                            host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",), 8088: ("0.0.0.0",)})
-                                            )
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Poll for the container to be ready
-            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            cid = container.id
             # Check khulnasoftd
-            assert self.check_khulnasoftd("admin", self.password, name=khulnasoft_container_name)
+            khulnasoftd_port = self.client.port(cid, 8089)[0]["HostPort"]
+            url = "https://localhost:{}/services/server/info".format(khulnasoftd_port)
+            kwargs = {"auth": ("admin", container.password), "verify": False}
+            status, content = self.handle_request_retry("GET", url, kwargs)
+            assert status == 200
             # Check HEC
             hec_port = self.client.port(cid, 8088)[0]["HostPort"]
             url = "http://localhost:{}/services/collector/event".format(hec_port)
@@ -1140,8 +1195,7 @@ disabled = 1''' in std_out
             self.logger.error(e)
             raise e
         finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+            warm_pool.checkin(container)
 
     def test_adhoc_1so_khulnasoftd_no_ssl(self):
         # Generate default.yml
@@ -1267,8 +1321,7 @@ disabled = 1''' in std_out
             self.logger.error(e)
             raise e
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check if java is installed
@@ -1277,9 +1330,6 @@ disabled = 1''' in std_out
         assert "java version \"1.8.0" in std_out
         # Restart the container and make sure java is still installed
         self.client.restart("{}_so1_1".format(self.project_name))
-        # After restart, a container's logs are preserved. So, sleep in order for the self.wait_for_containers()
-        # to avoid seeing the prior entrypoint's "Ansible playbook complete" string 
-        time.sleep(15)
         assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name))
         assert self.check_khulnasoftd("admin", self.password)
         exec_command = self.client.exec_create("{}_so1_1".format(self.project_name), "java -version")
@@ -1303,8 +1353,7 @@ disabled = 1''' in std_out
             self.logger.error(e)
             raise e
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check if java is installed
@@ -1313,9 +1362,6 @@ disabled = 1''' in std_out
         assert "openjdk version \"1.8.0" in std_out
         # Restart the container and make sure java is still installed
         self.client.restart("{}_so1_1".format(self.project_name))
-        # After restart, a container's logs are preserved. So, sleep in order for the self.wait_for_containers()
-        # to avoid seeing the prior entrypoint's "Ansible playbook complete" string 
-        time.sleep(15)
         assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name))
         assert self.check_khulnasoftd("admin", self.password)
         exec_command = self.client.exec_create("{}_so1_1".format(self.project_name), "java -version")
@@ -1340,8 +1386,7 @@ disabled = 1''' in std_out
             self.logger.error(e)
             raise e
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check if java is installed
@@ -1350,9 +1395,6 @@ disabled = 1''' in std_out
         assert "openjdk version \"11.0.2" in std_out
         # Restart the container and make sure java is still installed
         self.client.restart("{}_so1_1".format(self.project_name))
-        # After restart, a container's logs are preserved. So, sleep in order for the self.wait_for_containers()
-        # to avoid seeing the prior entrypoint's "Ansible playbook complete" string 
-        time.sleep(15)
         assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name))
         assert self.check_khulnasoftd("admin", self.password)
         exec_command = self.client.exec_create("{}_so1_1".format(self.project_name), "java -version")
@@ -1377,8 +1419,7 @@ disabled = 1''' in std_out
             self.logger.error(e)
             raise e
         # Check container logs
-        output = self.get_container_logs("{}_so1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_so1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check if service is registered
@@ -1874,12 +1915,8 @@ disabled = 1''' in std_out
         except OSError:
             pass
 
-    def test_uf_entrypoint_help(self):
-        # Run container
-        cid = self.client.create_container(self.UF_IMAGE_NAME, tty=True, command="help")
-        self.client.start(cid.get("Id"))
-        output = self.get_container_logs(cid.get("Id"))
-        self.client.remove_container(cid.get("Id"), v=True, force=True)
+    def test_uf_entrypoint_help(self, no_provision):
+        output = no_provision.run(self.UF_IMAGE_NAME, NO_PROVISION_COMMANDS)["help"]
         assert "KHULNASOFT_CMD - 'any khulnasoft command' - execute any khulnasoft commands separated by commas" in output
 
     def test_uf_entrypoint_create_defaults(self):
@@ -1909,53 +1946,18 @@ disabled = 1''' in std_out
         self.client.remove_container(cid.get("Id"), v=True, force=True)
         assert "License not accepted, please ensure the environment variable KHULNASOFT_START_ARGS contains the '--accept-license' flag" in output
 
-    def test_uf_entrypoint_no_provision(self):
-        cid = None
-        try:
-            # Run container
-            cid = self.client.create_container(self.UF_IMAGE_NAME, tty=True, command="no-provision")
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Wait a bit
-            time.sleep(5)
-            # If the container is still running, we should be able to exec inside
-            # Check that the git SHA exists in /opt/ansible
-            exec_command = self.client.exec_create(cid, "cat /opt/ansible/version.txt")
-            std_out = self.client.exec_start(exec_command)
-            assert len(std_out.strip()) == 40
-            # Check that the wrapper-example directory does not exist
-            exec_command = self.client.exec_create(cid, "ls /opt/ansible/")
-            std_out = self.client.exec_start(exec_command)
-            assert "wrapper-example" not in std_out
-            assert "docs" not in std_out
-        except Exception as e:
-            self.logger.error(e)
-            raise e
-        finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+    def test_uf_entrypoint_no_provision(self, no_provision):
+        outputs = no_provision.run(self.UF_IMAGE_NAME, NO_PROVISION_COMMANDS)
+        # Check that the git SHA exists in /opt/ansible
+        assert len(outputs["ansible_version"].strip()) == 40
+        # Check that the wrapper-example directory does not exist
+        assert "wrapper-example" not in outputs["ansible_dir"]
+        assert "docs" not in outputs["ansible_dir"]
 
-    def test_uf_uid_gid(self):
-        cid = None
-        try:
-            # Run container
-            cid = self.client.create_container(self.UF_IMAGE_NAME, tty=True, command="no-provision")
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Wait a bit
-            time.sleep(5)
-            # If the container is still running, we should be able to exec inside
-            # Check that the git SHA exists in /opt/ansible
-            exec_command = self.client.exec_create(cid, "id", user="khulnasoft")
-            std_out = self.client.exec_start(exec_command)
-            assert "uid=41812" in std_out
-            assert "gid=41812" in std_out
-        except Exception as e:
-            self.logger.error(e)
-            raise e
-        finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+    def test_uf_uid_gid(self, no_provision):
+        output = no_provision.run(self.UF_IMAGE_NAME, NO_PROVISION_COMMANDS)["id"]
+        assert "uid=41812" in output
+        assert "gid=41812" in output
 
     def test_adhoc_1uf_khulnasofttcp_ssl(self):
         # Generate default.yml
@@ -2191,8 +2193,7 @@ disabled = 1''' in std_out
             self.logger.error(e)
             raise e
         # Check container logs
-        output = self.get_container_logs("{}_uf1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_uf1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check if service is registered
@@ -2278,8 +2279,7 @@ disabled = 1''' in std_out
         log_json = self.extract_json("{}_uf1_1".format(self.project_name))
         self.check_common_keys(log_json, "uf")
         # Check container logs
-        output = self.get_container_logs("{}_uf1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_uf1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check Khulnasoftd using the new users
@@ -2298,8 +2298,7 @@ disabled = 1''' in std_out
         log_json = self.extract_json("{}_uf1_1".format(self.project_name))
         self.check_common_keys(log_json, "uf")
         # Check container logs
-        output = self.get_container_logs("{}_uf1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_uf1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check Khulnasoftd using the new users
@@ -2319,8 +2318,7 @@ disabled = 1''' in std_out
         log_json = self.extract_json("{}_uf1_1".format(self.project_name))
         self.check_common_keys(log_json, "uf")
         # Check container logs
-        output = self.get_container_logs("{}_uf1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_uf1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check Khulnasoftd using the new users
@@ -2375,28 +2373,16 @@ disabled = 1''' in std_out
             except OSError:
                 pass
 
-    def test_adhoc_1uf_hec_ssl_disabled(self):
-        # Create the container
-        cid = None
+    def test_adhoc_1uf_hec_ssl_disabled(self, warm_pool):
+        container = warm_pool.checkout(self.UF_IMAGE_NAME, WARM_ENVIRONMENTS["shared"])
         try:
-            khulnasoft_container_name = self.generate_random_string()
-            cid = self.client.create_container(self.UF_IMAGE_NAME, tty=True, ports=[8089, 8088], 
-                                            name=khulnasoft_container_name,
-                                            environment={
-                                                "DEBUG": "true", 
-                                                "KHULNASOFT_START_ARGS": "--accept-license",
-                                                "KHULNASOFT_HEC_TOKEN": "get-schwifty",
-                                                "KHULNASOFT_HEC_SSL": "false",
-                                                "KHULNASOFT_PASSWORD": self.password
-                                            },
-                                            host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",), 8088: ("0.0.0.0",)})
-                                            )
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Poll for the container to be ready
-            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            cid = container.id
             # Check khulnasoftd
-            assert self.check_khulnasoftd("admin", self.password, name=khulnasoft_container_name)
+            khulnasoftd_port = self.client.port(cid, 8089)[0]["HostPort"]
+            url = "https://localhost:{}/services/server/info".format(khulnasoftd_port)
+            kwargs = {"auth": ("admin", container.password), "verify": False}
+            status, content = self.handle_request_retry("GET", url, kwargs)
+            assert status == 200
             # Check HEC
             hec_port = self.client.port(cid, 8088)[0]["HostPort"]
             url = "http://localhost:{}/services/collector/event".format(hec_port)
@@ -2406,6 +2392,40 @@ disabled = 1''' in std_out
         except Exception as e:
             self.logger.error(e)
             raise e
+        finally:
+            warm_pool.checkin(container)
+
+    def test_adhoc_1uf_ansible_profile(self):
+        # Create a uf container
+        cid = None
+        try:
+            khulnasoft_container_name = self.generate_random_string()
+            cid = self.client.create_container(self.UF_IMAGE_NAME, tty=True, name=khulnasoft_container_name,
+                                            environment={
+                                                            "KHULNASOFT_START_ARGS": "--accept-license",
+                                                            "KHULNASOFT_PASSWORD": self.password,
+                                                            "KHULNASOFT_ANSIBLE_PROFILE": "true"
+                                                        })
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            # Check the summary printed before the playbook completes
+            output = self.get_container_logs(cid)
+            assert "Slowest provisioning tasks of site.yml" in output
+            # Check the profile written next to the inventory
+            profile = self.extract_ansible_profile(cid)
+            assert profile
+            assert len(profile["runs"]) == 1
+            run = profile["runs"][0]
+            assert run["playbook"] == "site.yml"
+            assert run["tasks"]
+            for task in run["tasks"]:
+                assert task["duration"] >= 0
+                assert task["start"] + task["duration"] <= run["duration"]
+        except Exception as e:
+            self.logger.error(e)
+            raise e
         finally:
             if cid:
                 self.client.remove_container(cid, v=True, force=True)
@@ -2498,8 +2518,7 @@ disabled = 1''' in std_out
             self.logger.error(e)
             raise e
         # Check container logs
-        output = self.get_container_logs("{}_uf1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_uf1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check HEC works - note the token "abcd1234" is hard-coded within the 1so_hec.yaml compose
@@ -2512,28 +2531,14 @@ disabled = 1''' in std_out
         status, content = self.handle_request_retry("POST", url, kwargs)
         assert status == 200
 
-    def test_adhoc_1uf_khulnasoft_pass4symmkey(self):
-        # Create a khulnasoft container
-        cid = None
+    def test_adhoc_1uf_khulnasoft_pass4symmkey(self, warm_pool):
+        container = warm_pool.checkout(self.UF_IMAGE_NAME, WARM_ENVIRONMENTS["shared"])
         try:
-            khulnasoft_container_name = self.generate_random_string()
-            cid = self.client.create_container(self.UF_IMAGE_NAME, tty=True, ports=[8089], name=khulnasoft_container_name,
-                                               environment={
-                                                            "DEBUG": "true", 
-                                                            "KHULNASOFT_START_ARGS": "--accept-license",
-                                                            "KHULNASOFT_PASSWORD": self.password,
-                                                            "KHULNASOFT_PASS4SYMMKEY": "wubbalubbadubdub"
-                                                        },
-                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)})
-                                            )
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Poll for the container to be ready
-            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            cid = container.id
             # Check khulnasoftd
             khulnasoftd_port = self.client.port(cid, 8089)[0]["HostPort"]
             url = "https://localhost:{}/services/server/info".format(khulnasoftd_port)
-            kwargs = {"auth": ("admin", self.password), "verify": False}
+            kwargs = {"auth": ("admin", container.password), "verify": False}
             status, content = self.handle_request_retry("GET", url, kwargs)
             assert status == 200
             # Check the decrypted pass4SymmKey
@@ -2547,31 +2552,16 @@ disabled = 1''' in std_out
             self.logger.error(e)
             raise e
         finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+            warm_pool.checkin(container)
 
-    def test_adhoc_1uf_khulnasoft_secret_env(self):
-        # Create a uf container
-        cid = None
+    def test_adhoc_1uf_khulnasoft_secret_env(self, warm_pool):
+        container = warm_pool.checkout(self.UF_IMAGE_NAME, WARM_ENVIRONMENTS["secret"])
         try:
-            khulnasoft_container_name = self.generate_random_string()
-            cid = self.client.create_container(self.UF_IMAGE_NAME, tty=True, ports=[8089], name=khulnasoft_container_name,
-                                               environment={
-                                                            "DEBUG": "true", 
-                                                            "KHULNASOFT_START_ARGS": "--accept-license",
-                                                            "KHULNASOFT_PASSWORD": self.password,
-                                                            "KHULNASOFT_SECRET": "wubbalubbadubdub"
-                                                        },
-                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)})
-                                            )
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Poll for the container to be ready
-            assert self.wait_for_containers(1, name=khulnasoft_container_name)
+            cid = container.id
             # Check khulnasoftd
             khulnasoftd_port = self.client.port(cid, 8089)[0]["HostPort"]
             url = "https://localhost:{}/services/server/info".format(khulnasoftd_port)
-            kwargs = {"auth": ("admin", self.password), "verify": False}
+            kwargs = {"auth": ("admin", container.password), "verify": False}
             status, content = self.handle_request_retry("GET", url, kwargs)
             assert status == 200
             # Check if the created file exists
@@ -2582,8 +2572,7 @@ disabled = 1''' in std_out
             self.logger.error(e)
             raise e
         finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+            warm_pool.checkin(container)
 
     def test_adhoc_1uf_bind_mount_apps(self):
         # Generate default.yml
@@ -2640,26 +2629,10 @@ disabled = 1''' in std_out
             except OSError:
                 pass
 
-    def test_uf_ulimit(self):
-        cid = None
-        try:
-            # Run container
-            cid = self.client.create_container(self.UF_IMAGE_NAME, tty=True, command="no-provision")
-            cid = cid.get("Id")
-            self.client.start(cid)
-            # Wait a bit
-            time.sleep(5)
-            # If the container is still running, we should be able to exec inside
-            # Check that nproc limits are unlimited
-            exec_command = self.client.exec_create(cid, "sudo -u khulnasoft bash -c 'ulimit -u'")
-            std_out = self.client.exec_start(exec_command)
-            assert "unlimited" in std_out
-        except Exception as e:
-            self.logger.error(e)
-            raise e
-        finally:
-            if cid:
-                self.client.remove_container(cid, v=True, force=True)
+    def test_uf_ulimit(self, no_provision):
+        # Check that nproc limits are unlimited
+        output = no_provision.run(self.UF_IMAGE_NAME, NO_PROVISION_COMMANDS)["ulimit"]
+        assert "unlimited" in output
 
     def test_adhoc_1uf_custom_conf(self):
         khulnasoft_container_name = self.generate_random_string()
@@ -2772,8 +2745,7 @@ disabled = 1''' in std_out
         log_json = self.extract_json("{}_hf1_1".format(self.project_name))
         self.check_common_keys(log_json, "hf")
         # Check container logs
-        output = self.get_container_logs("{}_hf1_1".format(self.project_name))
-        self.check_ansible(output)
+        self.check_ansible(self.stream_container_logs("{}_hf1_1".format(self.project_name)))
         # Check Khulnasoftd on all the containers
         assert self.check_khulnasoftd("admin", self.password)
         # Check Khulnasoftd using the new users
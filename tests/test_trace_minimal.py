@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+from trace_minimal import trace_paths, exclude_patterns
+
+
+LISTING = {
+    "bin": ("d", 0, ""),
+    "bin/khulnasoft": ("f", 100, ""),
+    "etc": ("d", 0, ""),
+    "etc/apps": ("d", 0, ""),
+    "etc/apps/a": ("d", 0, ""),
+    "etc/apps/a/lib": ("d", 0, ""),
+    "etc/apps/a/lib/libbar.so": ("f", 10, ""),
+    "lib": ("d", 0, ""),
+    "lib/libbar.so": ("f", 1000, ""),
+    "lib/libfoo.so": ("f", 2000, ""),
+    "share": ("d", 0, ""),
+    "share/docs": ("d", 0, ""),
+    "share/docs/index.html": ("f", 30, ""),
+    "share/docs/search.js": ("f", 40, "")
+}
+
+
+def test_exclude_patterns_anchored():
+    '''
+    An untraced lib/libbar.so must not take etc/apps/a/lib/libbar.so along with it
+    '''
+    patterns, saved = exclude_patterns(LISTING, {"bin/khulnasoft", "lib/libfoo.so"}, root="khulnasoftforwarder")
+    assert patterns == ["khulnasoftforwarder/lib/libbar.so", "khulnasoftforwarder/share"]
+    assert saved == 1070
+
+
+def test_exclude_patterns_keep_directories():
+    '''
+    A directory holding a kept path can't be excluded as a whole
+    '''
+    patterns, saved = exclude_patterns(LISTING, {"bin/khulnasoft"}, keep=("etc", "share/docs/index.html"))
+    assert patterns == ["khulnasoft/lib", "khulnasoft/share/docs/search.js"]
+    assert saved == 3040
+
+
+def test_exclude_patterns_unresolved():
+    '''
+    A relative access from an unknown working directory keeps every file it may refer to
+    '''
+    patterns, saved = exclude_patterns(LISTING, {"bin/khulnasoft"}, unresolved=["../lib/libbar.so", "docs/./search.js"])
+    assert patterns == ["khulnasoft/lib/libfoo.so", "khulnasoft/share/docs/index.html"]
+    assert saved == 2030
+
+
+def test_trace_paths_cwd():
+    '''
+    Relative paths resolve against the dirfd, else against the directory the process changed to last
+    '''
+    lines = [
+        '10 openat(AT_FDCWD, "etc/khulnasoft.version", O_RDONLY) = 3</opt/khulnasoft/etc/khulnasoft.version>\n',
+        '10 chdir("/opt/khulnasoft") = 0\n',
+        '11 chdir("/nonexistent") = -1 ENOENT (No such file or directory)\n',
+        '10 openat(AT_FDCWD, "etc/khulnasoft.version", O_RDONLY) = 3</opt/khulnasoft/etc/khulnasoft.version>\n',
+        '10 chdir("bin") = 0\n',
+        '10 stat("../lib/libfoo.so", {st_mode=S_IFREG|0755, st_size=2000, ...}) = 0\n',
+        '11 openat(3</opt/khulnasoft/share>, "docs/index.html", O_RDONLY) = 4\n',
+        '11 access("var/run", F_OK) = -1 ENOENT (No such file or directory)\n'
+    ]
+    unresolved = []
+    paths = list(trace_paths(lines, unresolved))
+    assert paths == ["/opt/khulnasoft", "/nonexistent", "/opt/khulnasoft/etc/khulnasoft.version", "/opt/khulnasoft/bin",
+                     "/opt/khulnasoft/lib/libfoo.so", "/opt/khulnasoft/share/docs/index.html"]
+    assert unresolved == ["etc/khulnasoft.version", "var/run"]
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import re
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import yaml
+from executor import Executor, LOGGER, FILE_DIR, REPO_DIR, KHULNASOFT_MAINTAINER
+
+
+TRACES_DIR = os.path.join(FILE_DIR, "..", "test-results", "traces")
+# Representative deployments - together they cover the standalone, indexer, search head, cluster master and UF roles
+DEFAULT_SCENARIOS = ("1so_hec.yaml", "3idx1cm.yaml", "1sh1cm.yaml", "1uf1so.yaml")
+# Trace-based lists end up next to the Dockerfile that consumes them, keyed by the image's KHULNASOFT_HOME
+LISTS_DIRS = {
+    "/opt/khulnasoft": os.path.join(REPO_DIR, "khulnasoft", "common-files", "minimal-exclude"),
+    "/opt/khulnasoftforwarder": os.path.join(REPO_DIR, "uf", "common-files", "minimal-exclude")
+}
+# Needed outside of what a trace can observe: the default configuration gets copied wholesale by updateetc.sh, var is
+# seeded into a volume, and bin holds the CLI tools users run by hand
+DEFAULT_KEEP = ("etc", "var", "bin")
+# `<pid> syscall(<dirfd>, "<path>", ...` - with -y, a dirfd is printed along with the path it refers to
+TRACE_LINE = re.compile(r'^(?:(\d+) +)?(\w+)\((?:(?:\d+|AT_FDCWD)(?:<([^>]*)>)?, )?"((?:[^"\\]|\\.)*)"(.*)$')
+
+
+def trace_paths(lines, unresolved=None):
+    '''
+    Yield the absolute paths touched by the file syscalls of an `strace -f -y -e trace=file` log, in the order the
+    syscalls were made - a path shows up once per syscall. Relative paths are resolved against the dirfd, or against
+    the working directory the process last changed to; those neither tells are appended to `unresolved`.
+    '''
+    cwds = {}
+    for line in lines:
+        match = TRACE_LINE.match(line)
+        if not match:
+            continue
+        pid, syscall, dirname, path, result = match.groups()
+        if not path.startswith("/"):
+            dirname = dirname or cwds.get(pid)
+            if not dirname:
+                if unresolved is not None:
+                    unresolved.append(path)
+                continue
+            path = os.path.join(dirname, path)
+        path = os.path.normpath(path)
+        if syscall == "chdir" and result.strip().startswith(") = 0"):
+            cwds[pid] = path
+        yield path
+
+
+def parse_trace(lines, unresolved=None):
+    '''
+    Return the absolute paths touched by the file syscalls of an `strace -f -y -e trace=file` log
+    '''
+    return set(trace_paths(lines, unresolved))
+
+
+def relative_paths(paths, home):
+    '''
+    Map container paths onto paths relative to the root of the Khulnasoft tarball
+    '''
+    relative = set()
+    for path in paths:
+        if path.startswith(home + "-etc/"):
+            relative.add("etc/" + path[len(home) + 5:])
+        elif path.startswith(home + "/"):
+            relative.add(path[len(home) + 1:])
+    return relative
+
+
+def parents(path):
+    while "/" in path:
+        path = path.rsplit("/", 1)[0]
+        yield path
+
+
+def escape(path):
+    return re.sub(r"([*?\[\\])", r"\\\1", path)
+
+
+def suffix_matches(listing, unresolved):
+    '''
+    Return the paths of `listing` that a relative path of `unresolved` may have referred to, whatever the working
+    directory of the process was
+    '''
+    by_name = {}
+    for path in listing:
+        by_name.setdefault(path.rsplit("/", 1)[-1], []).append(path)
+    matches = set()
+    for path in unresolved:
+        parts = [x for x in os.path.normpath(path).split("/") if x not in ("", ".", "..")]
+        if not parts:
+            continue
+        suffix = "/".join(parts)
+        matches.update(x for x in by_name.get(parts[-1], []) if x == suffix or x.endswith("/" + suffix))
+    return matches
+
+
+def exclude_patterns(listing, accessed, keep=DEFAULT_KEEP, root="khulnasoft", unresolved=()):
+    '''
+    Compute the tar exclude patterns that drop everything in `listing` (relative path -> (type, size, link target))
+    the traces never accessed - whole directories collapse into a single pattern. Patterns are anchored at `root`, the
+    top directory of the tarball, and must be applied anchored (`tar --anchored`).
+    '''
+    needed = set()
+    # Directories holding a kept path can't collapse into a pattern of their own
+    for path in listing:
+        if any(fnmatch.fnmatch(path, pattern) for pattern in keep):
+            needed.add(path)
+            needed.update(parents(path))
+    for path in set(accessed) | suffix_matches(listing, unresolved):
+        if path not in listing:
+            continue
+        needed.add(path)
+        needed.update(parents(path))
+        # Opening a symlink requires its target too
+        kind, size, target = listing[path]
+        if kind == "l" and not target.startswith("/"):
+            target = os.path.normpath(os.path.join(os.path.dirname(path), target))
+            needed.add(target)
+            needed.update(parents(target))
+    patterns = []
+    excluded = set()
+    saved = 0
+    for path in sorted(listing):
+        if path in needed or any(x in excluded for x in parents(path)):
+            continue
+        if any(fnmatch.fnmatch(x, pattern) for x in [path] + list(parents(path)) for pattern in keep):
+            continue
+        excluded.add(path)
+        patterns.append("{}/{}".format(root, escape(path)))
+    for path, (kind, size, target) in listing.items():
+        if kind == "f" and (path in excluded or any(x in excluded for x in parents(path))):
+            saved += size
+    return patterns, saved
+
+
+class MinimalTracer(Executor):
+    '''
+    Runs compose scenarios with every Khulnasoft container under strace, and records which files of the Khulnasoft
+    installation each role accessed while provisioning, starting and serving requests
+    '''
+
+    READY_TIMEOUT = 1200 # in seconds, tracing slows provisioning down considerably
+    TRACE_DIR = "/trace"
+    STRACE_PATH = "/usr/local/bin/strace"
+
+    @classmethod
+    def setup_class(cls, platform, strace):
+        super(MinimalTracer, cls).setup_class(platform)
+        cls.strace = os.path.abspath(strace)
+
+    def _compose_override(self, compose_file_name, trace_dir):
+        with open(os.path.join(self.SCENARIOS_DIR, compose_file_name)) as f:
+            scenario = yaml.safe_load(f)
+        services = {}
+        for name, service in scenario["services"].items():
+            image = service.get("image", "")
+            if "KHULNASOFT_IMAGE" not in image and "UF_IMAGE" not in image:
+                continue
+            command = service.get("command", "start-service")
+            # Root, so that sudo keeps working under ptrace; the entrypoint drops to the khulnasoft user on its own
+            services[name] = {
+                "entrypoint": [self.STRACE_PATH, "-f", "-qq", "-y", "-e", "trace=file", "-e", "signal=none",
+                               "-o", "{}/{}.trace".format(self.TRACE_DIR, name), "/sbin/entrypoint.sh"],
+                "command": command if isinstance(command, list) else command.split(),
+                "user": "root",
+                "cap_add": ["SYS_PTRACE"],
+                "security_opt": ["seccomp:unconfined"],
+                "volumes": ["{}:{}".format(trace_dir, self.TRACE_DIR), "{}:{}:ro".format(self.strace, self.STRACE_PATH)]
+            }
+        filename = os.path.join(trace_dir, "docker-compose.trace.yaml")
+        with open(filename, "w") as f:
+            json.dump({"version": scenario["version"], "services": services}, f, indent=2)
+        return filename
+
+    def _run_in_image(self, image, script):
+        cid = self.client.create_container(image, entrypoint=["/bin/sh", "-c", script], user="root")
+        try:
+            self.client.start(cid.get("Id"))
+            self.client.wait(cid.get("Id"))
+            return self.client.logs(cid.get("Id"), stderr=False).decode("utf-8", "replace")
+        finally:
+            self.client.remove_container(cid.get("Id"), v=True, force=True)
+
+    def image_listing(self, image, home):
+        '''
+        Return the build of Khulnasoft in `image`, and its files relative to the tarball root
+        '''
+        version = self._run_in_image(image, "cat {}-etc/khulnasoft.version".format(home))
+        fields = dict(x.split("=", 1) for x in version.splitlines() if "=" in x)
+        listing = {}
+        output = self._run_in_image(image, "find {0} {0}-etc -mindepth 1 -printf '%y\\t%s\\t%l\\t%p\\n'".format(home))
+        for line in output.splitlines():
+            kind, size, target, path = line.split("\t", 3)
+            relative = relative_paths([path], home)
+            if relative:
+                listing[relative.pop()] = (kind, int(size), target)
+        return "{}-{}".format(fields.get("VERSION"), fields.get("BUILD")), listing
+
+    def _generate_defaults(self):
+        cid = self.client.create_container(self.KHULNASOFT_IMAGE_NAME, tty=True, command="create-defaults")
+        self.client.start(cid.get("Id"))
+        output = self.get_container_logs(cid.get("Id"))
+        self.client.remove_container(cid.get("Id"), v=True, force=True)
+        with open(os.path.join(self.DEFAULTS_DIR, "{}.yml".format(self.project_name)), "w") as f:
+            f.write(output)
+
+    def trace_scenario(self, compose_file_name, settle):
+        '''
+        Bring up `compose_file_name` under strace, and return the accessed paths and the relative paths accessed from
+        an unknown working directory, both as {(image, home, role): paths} for its containers
+        '''
+        self.compose_file_name = compose_file_name
+        self.project_name = self.generate_random_string()
+        label = "com.docker.compose.project={}".format(self.project_name)
+        trace_dir = os.path.abspath(os.path.join(TRACES_DIR, self.project_name))
+        os.makedirs(trace_dir)
+        override = self._compose_override(compose_file_name, trace_dir)
+        self._generate_defaults()
+        try:
+            container_count, rc = self.compose_up(defaults_url="/tmp/defaults/{}.yml".format(self.project_name), override=override)
+            if rc != 0 or not self.wait_for_containers(container_count, label=label, timeout=self.READY_TIMEOUT):
+                self.logger.error("Scenario {} never became ready".format(compose_file_name))
+                return {}, {}
+            # Exercise the REST API, then leave some time to the scheduler, the KV store and the like
+            self.check_khulnasoftd("admin", self.password)
+            time.sleep(settle)
+            containers = self.client.containers(filters={"label": label})
+            # strace flushes its log when the containers get stopped
+            self._run_command("docker-compose -p {} -f test_scenarios/{} -f {} stop".format(self.project_name, compose_file_name, override))
+            accessed = {}
+            unresolved = {}
+            for container in containers:
+                if container["Labels"].get("maintainer") != KHULNASOFT_MAINTAINER:
+                    continue
+                service = container["Labels"]["com.docker.compose.service"]
+                env = dict(x.split("=", 1) for x in self.client.inspect_container(container["Id"])["Config"]["Env"])
+                key = (container["Image"], env["KHULNASOFT_HOME"], env["KHULNASOFT_ROLE"].replace("khulnasoft_", "", 1))
+                relative = []
+                with open(os.path.join(trace_dir, "{}.trace".format(service))) as f:
+                    paths = relative_paths(parse_trace(f, relative), env["KHULNASOFT_HOME"])
+                self.logger.info("{} ({}) accessed {} files".format(service, key[2], len(paths)))
+                if relative:
+                    self.logger.warning("{} ({}) accessed {} relative paths from an unknown working directory, every file they may refer to is kept".format(
+                                        service, key[2], len(set(relative))))
+                accessed.setdefault(key, set()).update(paths)
+                unresolved.setdefault(key, set()).update(relative)
+            return accessed, unresolved
+        finally:
+            self._run_command("docker-compose -p {} -f test_scenarios/{} down --volumes --remove-orphans".format(self.project_name, compose_file_name))
+            self._clean_docker_env()
+            self.cleanup_files([os.path.join(self.DEFAULTS_DIR, "{}.yml".format(self.project_name))])
+
+    def run(self, scenarios, keep, settle):
+        '''
+        Trace every scenario, merge the accessed files per role and write one exclude list per role
+        '''
+        accessed = {}
+        unresolved = {}
+        for scenario in scenarios:
+            traced, relative = self.trace_scenario(scenario, settle)
+            for key, paths in traced.items():
+                accessed.setdefault(key, set()).update(paths)
+                unresolved.setdefault(key, set()).update(relative[key])
+        listings = {}
+        written = []
+        for (image, home, role), paths in sorted(accessed.items()):
+            if image not in listings:
+                listings[image] = self.image_listing(image, home)
+            build, listing = listings[image]
+            patterns, saved = exclude_patterns(listing, paths, keep, os.path.basename(home), unresolved[(image, home, role)])
+            filename = os.path.join(LISTS_DIRS[home], "{}.list".format(role))
+            with open(filename, "w") as f:
+                f.write("# Files of the {} role that no trace of {} accessed, generated by tests/trace_minimal.py\n".format(role, ", ".join(scenarios)))
+                f.write("# build: {}\n".format(build))
+                f.write("".join("# kept, accessed from an unknown working directory: {}\n".format(x) for x in sorted(unresolved[(image, home, role)])))
+                f.write("".join(x + "\n" for x in patterns))
+            self.logger.info("{}: {} patterns excluding {:.1f} MB".format(filename, len(patterns), saved / 1048576.0))
+            written.append((role, filename, len(patterns), saved))
+        return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate per-role minimal exclude lists from file-access traces of the compose scenarios")
+    parser.add_argument("scenarios", nargs="*", default=list(DEFAULT_SCENARIOS),
+                        help="Compose files to trace (default: {})".format(" ".join(DEFAULT_SCENARIOS)))
+    parser.add_argument("--platform", default="debian-10", help="Platform of the images to trace (default: debian-10)")
+    parser.add_argument("--strace", required=True, help="Statically linked strace binary, bind-mounted into the containers")
+    parser.add_argument("--keep", action="append", default=list(DEFAULT_KEEP),
+                        help="Glob of tarball paths to keep even if never accessed, in addition to: {}".format(" ".join(DEFAULT_KEEP)))
+    parser.add_argument("--settle", type=int, default=120, help="Seconds to keep tracing once the scenario is ready (default: 120)")
+    args = parser.parse_args()
+    os.chdir(REPO_DIR)
+    MinimalTracer.setup_class(args.platform, args.strace)
+    tracer = MinimalTracer()
+    try:
+        written = tracer.run(args.scenarios, args.keep, args.settle)
+    finally:
+        MinimalTracer.teardown_class()
+    for role, filename, count, saved in written:
+        print("{:<24} {:>6} patterns {:>8.1f} MB  {}".format(role, count, saved / 1048576.0, os.path.relpath(filename, REPO_DIR)))
+    return 0 if written else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -28,8 +28,19 @@ then
 
 	case "$state" in
 	running|started)
-	    curl -m 30 -f -k https://localhost:8089/
-	    exit $?
+	    #Answer from the status cached by healthresponder.py (KHULNASOFT_HEALTH_RESPONDER=true) while it is fresh
+	    if read -r checked rc latency 2>/dev/null < $CONTAINER_ARTIFACT_DIR/khulnasoftd.health; then
+	        printf -v now '%(%s)T' -1
+	        if (( now - checked <= ${KHULNASOFT_HEALTH_MAX_AGE:-60} )); then
+	            exit $rc
+	        fi
+	    fi
+	    OUTPUT="$(curl -m 30 -f -k --write-out '\n%{time_total}' https://localhost:8089/)"
+	    rc=$?
+	    printf '%s' "${OUTPUT%$'\n'*}"
+	    #The outcome and latency of the probe are exposed by metricsexporter.py
+	    printf '%(%s)T %s %s\n' -1 $rc "${OUTPUT##*$'\n'}" 2>/dev/null > $CONTAINER_ARTIFACT_DIR/khulnasoftd.healthcheck
+	    exit $rc
 	;;
 	*)
 	    exit 1
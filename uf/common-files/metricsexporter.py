@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# Copyright 2018-2021 Khulnasoft
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Serves the container lifecycle and khulnasoftd health in the Prometheus text exposition format on
+http://<container>:${KHULNASOFT_METRICS_PORT}/metrics - everything but the REST latency is read from the files the
+entrypoint and the healthcheck leave in the container artifact directory
+"""
+import os
+import ssl
+import time
+try:
+    from http.client import HTTPConnection, HTTPSConnection
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from httplib import HTTPConnection, HTTPSConnection
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+CONTAINER_ARTIFACT_DIR = os.environ.get("CONTAINER_ARTIFACT_DIR", "/opt/container_artifact")
+PORT = int(os.environ.get("KHULNASOFT_METRICS_PORT", 9110))
+REST_TIMEOUT = 5 # in seconds, a scrape should never hang on khulnasoftd
+STATES = ("starting", "restarting", "started")
+# Written by healthresponder.py and by checkstate.sh respectively, as "<epoch> <rc> <latency>"
+HEALTH_FILES = ("khulnasoftd.health", "khulnasoftd.healthcheck")
+
+
+def read_fields(name):
+    try:
+        with open(os.path.join(CONTAINER_ARTIFACT_DIR, name)) as f:
+            return f.read().split()
+    except (IOError, OSError):
+        return []
+
+
+def last_healthcheck():
+    """
+    Return (timestamp, rc, latency) of the most recent khulnasoftd probe, whichever of the two wrote it
+    """
+    latest = None
+    for name in HEALTH_FILES:
+        fields = read_fields(name)
+        try:
+            probe = (int(fields[0]), int(fields[1]), float(fields[2]))
+        except (IndexError, ValueError):
+            continue
+        if not latest or probe[0] > latest[0]:
+            latest = probe
+    return latest
+
+
+def probe_rest():
+    """
+    Time an unauthenticated REST request - any answer, including 401, proves that khulnasoftd is serving requests
+    """
+    scheme = (read_fields("khulnasoftd.scheme") or ["https"])[0]
+    if scheme == "http":
+        conn = HTTPConnection("localhost", 8089, timeout=REST_TIMEOUT)
+    else:
+        conn = HTTPSConnection("localhost", 8089, timeout=REST_TIMEOUT, context=ssl._create_unverified_context())
+    start = time.time()
+    try:
+        conn.request("GET", "/services/server/info")
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status < 500, time.time() - start
+    except Exception:
+        return False, None
+    finally:
+        conn.close()
+
+
+def collect():
+    metrics = []
+
+    def add(name, kind, doc, samples):
+        metrics.append("# HELP {} {}".format(name, doc))
+        metrics.append("# TYPE {} {}".format(name, kind))
+        for labels, value in samples:
+            metrics.append("{}{} {}".format(name, labels, value))
+
+    state = (read_fields("khulnasoft-container.state") or [""])[0]
+    add("khulnasoft_container_state", "gauge", "Lifecycle phase of the container, 1 for the current one",
+        [('{{state="{}"}}'.format(x), int(x == state)) for x in STATES])
+    restarts = read_fields("restart.count")
+    add("khulnasoft_container_restarts_total", "counter", "Times the container was started again after its first start",
+        [("", int(restarts[0]) if restarts else 0)])
+    # "<start>" while provisioning, "<start> <end> <ansible|warm>" once it completed
+    timing = read_fields("provision.timing")
+    if timing:
+        add("khulnasoft_provisioning_start_timestamp_seconds", "gauge", "Start of the current or last provisioning",
+            [("", int(timing[0]))])
+    if len(timing) == 3:
+        add("khulnasoft_provisioning_duration_seconds", "gauge", "Duration of the last completed provisioning",
+            [('{{mode="{}"}}'.format(timing[2]), int(timing[1]) - int(timing[0]))])
+    health = last_healthcheck()
+    if health:
+        add("khulnasoft_healthcheck_timestamp_seconds", "gauge", "Time of the last khulnasoftd health probe", [("", health[0])])
+        add("khulnasoft_healthcheck_up", "gauge", "Whether the last khulnasoftd health probe succeeded", [("", int(health[1] == 0))])
+        add("khulnasoft_healthcheck_latency_seconds", "gauge", "Latency of the last khulnasoftd health probe", [("", health[2])])
+    # khulnasoftd is only expected to answer once provisioning completed
+    if state == "started":
+        up, latency = probe_rest()
+        add("khulnasoft_khulnasoftd_rest_up", "gauge", "Whether the khulnasoftd REST API answered this scrape", [("", int(up))])
+        if latency is not None:
+            add("khulnasoft_khulnasoftd_rest_latency_seconds", "gauge", "Latency of a khulnasoftd REST request during this scrape",
+                [("", round(latency, 6))])
+    return "\n".join(metrics) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = collect().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise flood the container's stdout
+        pass
+
+
+def main():
+    HTTPServer(("", PORT), MetricsHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
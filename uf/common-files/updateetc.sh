@@ -16,6 +16,62 @@
 #
 
 KHULNASOFT_ETC_BAK="${KHULNASOFT_ETC_BAK:-/opt/khulnasoftforwarder-etc}"
+# Content manifest of ${KHULNASOFT_ETC_BAK}, generated at image build time with: updateetc.sh --manifest <dir>
+KHULNASOFT_ETC_MANIFEST="${KHULNASOFT_ETC_MANIFEST:-${KHULNASOFT_ETC_BAK}.manifest}"
+
+# One tab-separated line per entry: type (f/d/l), size, mtime, sha512 (or symlink target), relative path
+generate_manifest() {
+	(cd $1; find . -mindepth 1 -type f -print0 | xargs -0 -r sha512sum) > /tmp/updateetc.hashes
+	(cd $1; find . -mindepth 1 -printf '%y\t%s\t%T@\t%l\t%P\n') | awk -F '\t' -v OFS='\t' '
+		FILENAME == ARGV[1] { hash[substr($0, 131)] = substr($0, 1, 128); next }
+		{ print $1, $2, $3, ($1 == "f" ? hash["./" $5] : ($1 == "l" ? $4 : "-")), $5 }' /tmp/updateetc.hashes -
+	rm -f /tmp/updateetc.hashes
+}
+
+# Copy only the entries of the manifest that are missing or different in ${KHULNASOFT_HOME}/etc
+sync_etc() {
+	ETC_DIR=${KHULNASOFT_HOME}/etc
+	WORK_DIR=`mktemp -d`
+	(cd ${ETC_DIR}; find . -mindepth 1 -printf '%y\t%s\t%T@\t%l\t%P\n') > ${WORK_DIR}/current
+	# Sizes and mtimes (preserved by every previous sync) settle most files; only the rest get hashed
+	awk -F '\t' -v OFS='\t' -v work=${WORK_DIR} '
+		FILENAME == ARGV[1] { type[$5] = $1; size[$5] = $2; mtime[$5] = int($3); target[$5] = $4; next }
+		!($5 in type) || type[$5] != $1 { print ($1 == "f" ? $2 : 0), $5 > (work "/copy"); next }
+		$1 == "d" { next }
+		$1 == "l" { if (target[$5] != $4) print 0, $5 > (work "/copy"); next }
+		size[$5] != $2 { print $2, $5 > (work "/copy"); next }
+		mtime[$5] != int($3) { print $4 "  ./" $5 > (work "/verify"); print $2, $5 > (work "/sizes") }' ${WORK_DIR}/current ${KHULNASOFT_ETC_MANIFEST}
+	if [[ -s ${WORK_DIR}/verify ]]; then
+		(cd ${ETC_DIR}; sha512sum --check ${WORK_DIR}/verify 2>/dev/null) | awk -F ': ' '$2 != "OK" { sub(/^\.\//, "", $1); print $1 }' > ${WORK_DIR}/changed
+		awk -F '\t' -v OFS='\t' 'FILENAME == ARGV[1] { changed[$0] = 1; next } ($2 in changed) { print $1, $2 }' ${WORK_DIR}/changed ${WORK_DIR}/sizes >> ${WORK_DIR}/copy
+	fi
+	touch ${WORK_DIR}/copy
+	FILES=`grep -c . ${WORK_DIR}/copy`
+	BYTES=`awk -F '\t' '{ total += $1 } END { print total + 0 }' ${WORK_DIR}/copy`
+	TOTAL=`grep -c . ${KHULNASOFT_ETC_MANIFEST}`
+	if [[ "${DRY_RUN}" == "true" ]]; then
+		cut -f 2 ${WORK_DIR}/copy | sed -e "s,^,Would update ${ETC_DIR}/,"
+		echo "Dry run: ${FILES} of ${TOTAL} entries (${BYTES} bytes) would be copied to ${ETC_DIR}"
+	else
+		# khulnasoft.version goes last, so that an interrupted sync is picked up again on the next start
+		cut -f 2 ${WORK_DIR}/copy | grep -vx "khulnasoft.version" > ${WORK_DIR}/paths
+		echo "khulnasoft.version" >> ${WORK_DIR}/paths
+		(cd ${KHULNASOFT_ETC_BAK}; tar --no-recursion -cf - -T ${WORK_DIR}/paths) | (cd ${ETC_DIR}; tar xf -)
+		echo "Copied ${FILES} of ${TOTAL} entries (${BYTES} bytes) to ${ETC_DIR}"
+	fi
+	rm -rf ${WORK_DIR}
+}
+
+DRY_RUN=false
+case "$1" in
+	--manifest)
+		generate_manifest $2
+		exit 0
+		;;
+	--dry-run)
+		DRY_RUN=true
+		;;
+esac
 
 if [[ -f "${KHULNASOFT_ETC_BAK}/khulnasoft.version" ]]; then
 	IMAGE_VERSION_SHA=`cat ${KHULNASOFT_ETC_BAK}/khulnasoft.version | sha512sum`
@@ -25,7 +81,13 @@ if [[ -f "${KHULNASOFT_ETC_BAK}/khulnasoft.version" ]]; then
 	fi
 
 	if [[ "x${IMAGE_VERSION_SHA}" != "x${ETC_VERSION_SHA}" ]]; then
-    	echo Updating ${KHULNASOFT_HOME}/etc
-    	(cd ${KHULNASOFT_ETC_BAK}; tar cf - *) | (cd ${KHULNASOFT_HOME}/etc; tar xf -)
+		echo Updating ${KHULNASOFT_HOME}/etc
+		if [[ -f "${KHULNASOFT_ETC_MANIFEST}" ]]; then
+			sync_etc
+		elif [[ "${DRY_RUN}" == "true" ]]; then
+			echo "Dry run: no manifest at ${KHULNASOFT_ETC_MANIFEST}, all of ${KHULNASOFT_ETC_BAK} would be copied"
+		else
+			(cd ${KHULNASOFT_ETC_BAK}; tar cf - *) | (cd ${KHULNASOFT_HOME}/etc; tar xf -)
+		fi
 	fi
 fi